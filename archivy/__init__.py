@@ -1,12 +1,11 @@
 import logging
 from pathlib import Path
 
-import elasticsearch
 from flask import Flask
 from flask_compress import Compress
 from flask_login import LoginManager
 
-from archivy import helpers
+from archivy import catalog, helpers, search, yaml_codec
 from archivy.api import api_bp
 from archivy.models import User
 from archivy.config import Config
@@ -22,18 +21,18 @@ except FileNotFoundError:
     pass
 
 app.config.from_object(config)
+yaml_codec.configure(app.config["USE_LIBYAML"])
 
 (Path(app.config["USER_DIR"]) / "data").mkdir(parents=True, exist_ok=True)
 
-if app.config["SEARCH_CONF"]["enabled"]:
-    with app.app_context():
-        es = helpers.get_elastic_client()
-        try:
-            es.indices.create(
-                index=app.config["SEARCH_CONF"]["index_name"],
-                body=app.config["SEARCH_CONF"]["search_conf"])
-        except elasticsearch.exceptions.RequestError:
-            app.logger.info("Elasticsearch index already created")
+with app.app_context():
+    search_backend = search.get_search_backend()
+    if search_backend:
+        search_backend.init_index()
+
+# the catalog and sqlite search connections are opened on `g`, once per app context
+app.teardown_appcontext(catalog.close_catalog)
+app.teardown_appcontext(search.sqlite.close_search_db)
 
 
 # login routes / setup
@@ -1,16 +1,24 @@
-from flask import Response, jsonify, request, Blueprint
+from flask import (Response, jsonify, json, request, Blueprint, stream_with_context,
+                   current_app)
 from werkzeug.security import check_password_hash
 from flask_login import login_user
 from tinydb import Query
 
-from archivy import data
-from archivy.search import query_index
+from archivy import catalog, data
+from archivy.search import (FACETS, SearchUnavailable, get_search_backend, query_index,
+                            search_index)
+from archivy.search.cache import get_query_cache
 from archivy.models import DataObj, User
 from archivy.helpers import get_db
+from archivy.titles import get_title_index
 
 
 api_bp = Blueprint('api', __name__)
 
+# bounds of the pages of search results
+MAX_SEARCH_SIZE = 100
+SNIPPET_SIZE = 150
+
 
 @api_bp.route("/login", methods=["POST"])
 def login():
@@ -35,7 +43,8 @@ def login():
 @api_bp.route("/bookmarks", methods=["POST"])
 def create_bookmark():
     """
-    Creates a new bookmark
+    Creates a new bookmark. Returns its `bookmark_id`, and the id, title and
+    similarity of the existing dataobjs it is likely a duplicate of as `duplicates`.
 
     **Parameters:**
 
@@ -58,6 +67,7 @@ def create_bookmark():
     if bookmark_id:
         return jsonify(
             bookmark_id=bookmark_id,
+            duplicates=bookmark.duplicates,
         )
     return Response(status=400)
 
@@ -134,9 +144,49 @@ def update_dataobj(dataobj_id):
 
 @api_bp.route("/dataobjs", methods=["GET"])
 def get_dataobjs():
-    """Gets all dataobjs"""
-    cur_dir = data.get_items(structured=False, json_format=True)
-    return jsonify(cur_dir)
+    """
+    Gets all dataobjs, sorted by id.
+
+    The response is streamed so that the whole vault isn't held in memory.
+
+    Optional URL parameters, used to page through large knowledge bases:
+
+    - **limit** - maximum number of dataobjs to return. If `limit` or `cursor`
+      is passed, the response is an object holding the `dataobjs` and a `next_cursor`
+      to pass to get the next page, which is null on the last page.
+    - **cursor** - value of `next_cursor` returned with the previous page.
+    - **fields** - comma-separated list of fields to return, eg `title,tags`.
+      The id is always returned, and the content of dataobjs is only returned
+      if `content` is part of the list.
+    """
+    limit = request.args.get("limit", type=int)
+    if "limit" in request.args and (limit is None or limit < 0):
+        return Response("Invalid limit", status=400)
+    fields = request.args.get("fields")
+    fields = fields.split(",") if fields else None
+    paged = "limit" in request.args or "cursor" in request.args
+    try:
+        dataobjs = data.iter_items(cursor=request.args.get("cursor"), limit=limit,
+                                   fields=fields)
+    except ValueError:
+        # restarting from the first page would make clients loop over the same dataobjs
+        return Response("Invalid cursor", status=400)
+
+    def generate():
+        count, last_id = 0, None
+        yield '{"dataobjs": [' if paged else "["
+        for dataobj in dataobjs:
+            yield ("," if count else "") + json.dumps(dataobj)
+            count += 1
+            last_id = dataobj["metadata"]["id"]
+        if paged:
+            # there might be more dataobjs if the page is full
+            next_cursor = last_id if limit is not None and count == limit else None
+            yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
+        else:
+            yield "]"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
 
 
 @api_bp.route("/dataobj/local_edit/<dataobj_id>", methods=["GET"])
@@ -148,6 +198,73 @@ def local_edit(dataobj_id):
     return Response(status=404)
 
 
+@api_bp.route("/folders", methods=["GET"])
+def get_folder():
+    """
+    Returns the contents of a directory: a page of its dataobjs and its
+    subdirectories, with the number of items they contain.
+
+    Request URL Parameters:
+    - **path** - path of the directory, the root data dir by default
+    - **page** - page of dataobjs to return, starting at 1
+    - **per_page** - number of dataobjs per page, 100 by default
+    """
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = min(max(request.args.get("per_page", data.FOLDER_PAGE_SIZE, type=int), 1), 1000)
+    folder = data.get_folder(request.args.get("path", ""), page=page, per_page=per_page)
+    if folder is None:
+        return Response("Not found", status=404)
+    return jsonify(folder)
+
+
+@api_bp.route("/tags", methods=["GET"])
+def get_tags():
+    """
+    Returns all tags used by dataobjs, with the number of dataobjs that have them,
+    most used tags first.
+    """
+    return jsonify([{"tag": tag, "count": count} for tag, count in catalog.get_tags()])
+
+
+@api_bp.route("/tags/dataobjs", methods=["GET"])
+def get_tagged_dataobjs():
+    """
+    Returns the dataobjs that have the given tags, with their id, title, type,
+    tags, date and path.
+
+    Request URL Parameters:
+    - **tags** (required) - comma-separated list of tags
+    - **mode** - `and` (default) to return dataobjs with all of the tags,
+      `or` to return dataobjs with any of them
+    - **type** - only return dataobjs of this type, eg. bookmark / note
+    """
+    tags = [tag.strip() for tag in request.args.get("tags", "").split(",") if tag.strip()]
+    mode = request.args.get("mode", "and")
+    if not tags or mode not in ("and", "or"):
+        return Response("Invalid tags or mode", status=400)
+    types = [request.args["type"]] if request.args.get("type") else []
+    ids = catalog.find(tags=tags, types=types, match_all=mode == "and")
+    return jsonify(catalog.get_records(ids))
+
+
+@api_bp.route("/titles/suggest", methods=["GET"])
+def suggest_titles():
+    """
+    Suggests dataobjs as you type their title. Returns the dataobjs with a word
+    of their title starting with the prefix, as a list of their `id` and `title`.
+    Titles starting with the prefix come first.
+
+    Request URL Parameters:
+    - **prefix** (required) - beginning of the title or of one of its words
+    - **limit** - maximum number of suggestions, 10 by default and at most 100
+    """
+    prefix = request.args.get("prefix", "")
+    if not prefix.strip():
+        return Response("Must provide prefix parameter", status=400)
+    limit = min(max(request.args.get("limit", 10, type=int), 1), 100)
+    return jsonify(get_title_index().suggest(prefix, limit=limit))
+
+
 @api_bp.route("/folders/new", methods=["POST"])
 def create_folder():
     """
@@ -187,7 +304,68 @@ def search_elastic():
 
     Request URL Parameter:
     - **query**
+
+    Optional URL parameters, used to page through results. If any of them is
+    passed, the response is an object holding the `hits`, the `total` number of
+    results, the `page`, the `size` and a `next` cursor to get the next page,
+    which is null on the last page. The total is also sent in the
+    `X-Total-Count` header.
+
+    - **page** - page of results to return, starting at 1
+    - **size** - number of results per page, 10 by default and at most 100
+    - **after** - value of `next` returned with the previous page, cheaper than
+      `page` for deep pages
+    - **snippet_size** - highlights are made of parts of the content of about
+      this many characters, 150 by default. Pass 0 to highlight the whole content.
+    - **facets** - if set to 1, the response also holds `facets`: the counts of the
+      `tags`, `type`, top-level `folder` and month (`date`) of all the results.
+    - **tags**, **type**, **folder**, **date** - only return results with these
+      values of the facets. Parameters can be repeated, and tags can also be
+      comma-separated. Results must have all of the tags and one of the values
+      of the other facets. `date` is a month, eg. `2021-03`.
+    - **fuzzy** - 1 to tolerate typos in the query, 0 not to. Defaults to
+      `SEARCH_CONF["fuzzy"]`. Fuzzy results found by similarity of titles and
+      tags have `"fuzzy": true` and the `similarity` of each hit.
     """
     query = request.args.get("query")
-    search_results = query_index(query)
-    return jsonify(search_results)
+    paged = any(arg in request.args for arg in
+                ("page", "size", "after", "snippet_size", "facets", "fuzzy") + FACETS)
+    filters = {facet: [value.strip() for values in request.args.getlist(facet)
+                       for value in (values.split(",") if facet == "tags" else [values])
+                       if value.strip()]
+               for facet in FACETS}
+    after = request.args.get("after")
+    backend = get_search_backend()
+    if after is not None and backend is not None:
+        try:
+            backend.decode_cursor(after)
+        except ValueError:
+            return Response("Invalid cursor", status=400)
+    try:
+        if not paged:
+            return jsonify(query_index(query))
+        results = search_index(
+            query,
+            page=max(request.args.get("page", 1, type=int), 1),
+            size=min(max(request.args.get("size", 10, type=int), 1), MAX_SEARCH_SIZE),
+            after=after,
+            snippet_size=max(request.args.get("snippet_size", SNIPPET_SIZE, type=int), 0),
+            filters=filters,
+            facets=request.args.get("facets", 0, type=int) == 1,
+            fuzzy=request.args["fuzzy"] == "1" if "fuzzy" in request.args else None,
+        )
+    except SearchUnavailable:
+        return Response("Search is unavailable", status=503)
+    response = jsonify(results)
+    if results["total"] is not None:
+        response.headers["X-Total-Count"] = results["total"]
+    return response
+
+
+@api_bp.route("/search/stats", methods=["GET"])
+def search_stats():
+    """
+    Returns statistics about the cache of search results: its size, the number of
+    hits and misses and the hit rate.
+    """
+    return jsonify(get_query_cache(current_app.config["SEARCH_CONF"]).stats())
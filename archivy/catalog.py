@@ -0,0 +1,424 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date as Date, datetime
+from pathlib import Path
+
+from flask import current_app, g
+
+from archivy.titles import discard_title_indexes, index_title, unindex_title
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dataobjs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    title TEXT,
+    type TEXT,
+    tags TEXT,
+    date TEXT,
+    mtime REAL,
+    folder TEXT,
+    month TEXT
+);
+CREATE INDEX IF NOT EXISTS dataobjs_path ON dataobjs (path);
+CREATE INDEX IF NOT EXISTS dataobjs_type ON dataobjs (type);
+CREATE INDEX IF NOT EXISTS dataobjs_folder ON dataobjs (folder);
+CREATE INDEX IF NOT EXISTS dataobjs_month ON dataobjs (month);
+CREATE TABLE IF NOT EXISTS tags (
+    tag TEXT NOT NULL COLLATE NOCASE,
+    id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag);
+CREATE INDEX IF NOT EXISTS tags_id ON tags (id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+# bump when the schema changes, to rebuild existing catalogs
+VERSION = "3"
+
+# when each catalog was last compared with the data dir, by path
+_checked_at = {}
+_checked_at_lock = threading.Lock()
+
+
+def _version(conn):
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def get_catalog(force_reconnect=False):
+    """
+    Returns a connection to the sqlite catalog that maps dataobj ids to their
+    location in the data directory, along with the metadata used in listings.
+
+    The catalog also holds an inverted index of the tags of dataobjs, and the
+    top-level folder and month of each dataobj, used as search facets.
+
+    It is stored in `INTERNAL_DIR` and is rebuilt from the data directory
+    the first time it is used with a different data directory.
+    """
+    from archivy.data import get_data_dir
+    db_path = str(Path(current_app.config["INTERNAL_DIR"]) / "catalog.db")
+    if "catalog" not in g or g.catalog_path != db_path or force_reconnect:
+        close_catalog()
+        conn = sqlite3.connect(db_path, timeout=30)
+        if _version(conn) != VERSION:
+            # catalogs are rebuilt from the data dir, so older tables can simply be dropped
+            conn.executescript("DROP TABLE IF EXISTS dataobjs; DROP TABLE IF EXISTS tags;")
+        conn.executescript(SCHEMA)
+        g.catalog = conn
+        g.catalog_path = db_path
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        if meta.get("data_dir") != str(get_data_dir()) or meta.get("version") != VERSION:
+            rebuild()
+    return g.catalog
+
+
+def close_catalog(exception=None):
+    """Closes the connection to the catalog of the app context, if it was opened"""
+    conn = g.pop("catalog", None)
+    if conn is not None:
+        conn.close()
+
+
+def month_of(date):
+    """
+    Returns the `YYYY-MM` month of the date of a dataobj, or None if it can't be parsed.
+
+    Dates are stored as `MM-DD-YY` by archivy, but ISO dates are understood too.
+    """
+    if isinstance(date, (datetime, Date)):
+        return date.strftime("%Y-%m")
+    date = str(date or "")
+    for fmt, length in (("%m-%d-%y", 8), ("%Y-%m-%d", 10)):
+        try:
+            return datetime.strptime(date[:length], fmt).strftime("%Y-%m")
+        except ValueError:
+            pass
+    return None
+
+
+def _record(filename, metadata):
+    from archivy.data import get_data_dir, logical_dir
+    filename = Path(filename)
+    folders = logical_dir(filename).parts
+    return (
+        int(metadata["id"]),
+        str(filename.relative_to(get_data_dir())),
+        str(metadata.get("title", "")),
+        metadata.get("type"),
+        json.dumps(metadata.get("tags") or []),
+        str(metadata.get("date", "")),
+        filename.stat().st_mtime,
+        folders[0] if folders else "",
+        month_of(metadata.get("date")),
+    )
+
+
+def _tags(metadata):
+    tags = metadata.get("tags") or []
+    if isinstance(tags, str):
+        tags = [tags]
+    return sorted({str(tag) for tag in tags})
+
+
+def _save(conn, filename, metadata):
+    record = _record(filename, metadata)
+    conn.execute("INSERT OR REPLACE INTO dataobjs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", record)
+    conn.execute("DELETE FROM tags WHERE id = ?", (record[0],))
+    conn.executemany("INSERT INTO tags VALUES (?, ?)",
+                     [(tag, record[0]) for tag in _tags(metadata)])
+
+
+def add(filename, metadata=None):
+    """
+    Saves the location and metadata of the dataobj stored at `filename` to the catalog.
+
+    If `metadata` isn't passed, it is read from the file.
+    """
+    from archivy.data import load_metadata
+    if metadata is None:
+        metadata = load_metadata(filename)
+    if "id" not in metadata:
+        return
+    conn = get_catalog()
+    with conn:
+        _save(conn, filename, metadata)
+    index_title(int(metadata["id"]), str(metadata.get("title", "")), _tags(metadata))
+
+
+def remove(dataobj_id):
+    """Removes dataobj of given id from the catalog"""
+    conn = get_catalog()
+    with conn:
+        conn.execute("DELETE FROM dataobjs WHERE id = ?", (dataobj_id,))
+        conn.execute("DELETE FROM tags WHERE id = ?", (dataobj_id,))
+    unindex_title(int(dataobj_id))
+
+
+def remove_dir(dirname):
+    """Removes all dataobjs stored under the directory `dirname` from the catalog"""
+    conn = get_catalog()
+    prefix = str(Path(dirname)) + os.sep
+    if prefix == "." + os.sep:
+        prefix = ""
+    with conn:
+        ids = [row[0] for row in conn.execute(
+            "SELECT id FROM dataobjs WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))]
+        conn.execute("DELETE FROM tags WHERE id IN "
+                     "(SELECT id FROM dataobjs WHERE substr(path, 1, ?) = ?)",
+                     (len(prefix), prefix))
+        conn.execute("DELETE FROM dataobjs WHERE substr(path, 1, ?) = ?",
+                     (len(prefix), prefix))
+    for dataobj_id in ids:
+        unindex_title(dataobj_id)
+
+
+def lookup(dataobj_id):
+    """
+    Returns the filename of the dataobj of given id if the catalog knows of it,
+    otherwise None.
+
+    Entries whose file has disappeared are dropped, and entries whose file
+    was modified outside of archivy have their metadata refreshed.
+    """
+    from archivy.data import get_data_dir
+    conn = get_catalog()
+    row = conn.execute("SELECT path, mtime FROM dataobjs WHERE id = ?",
+                       (dataobj_id,)).fetchone()
+    if not row:
+        return None
+    filename = get_data_dir() / row[0]
+    try:
+        mtime = filename.stat().st_mtime
+    except FileNotFoundError:
+        remove(dataobj_id)
+        return None
+    if mtime != row[1]:
+        add(filename)
+    return filename
+
+
+def rebuild():
+    """Empties the catalog and fills it back up by scanning the data directory."""
+    from archivy.data import get_data_dir, map_files, scan_data_dir
+    from archivy.metadata_cache import get_metadata_cache
+    data_dir = get_data_dir()
+    _, filenames = scan_data_dir()
+    cache = get_metadata_cache()
+
+    def load(filename):
+        return cache.load(filename, metadata_only=True)
+
+    dataobjs = [(filename, metadata) for filename, metadata
+                in zip(filenames, map_files(load, filenames)) if "id" in metadata]
+    cache.save()
+
+    conn = get_catalog()
+    with conn:
+        conn.execute("DELETE FROM dataobjs")
+        conn.execute("DELETE FROM tags")
+        for filename, metadata in dataobjs:
+            _save(conn, filename, metadata)
+        conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                         [("data_dir", str(data_dir)), ("version", VERSION)])
+    with _checked_at_lock:
+        _checked_at[g.catalog_path] = time.monotonic()
+    discard_title_indexes()
+    current_app.logger.info(f"Rebuilt catalog with {len(dataobjs)} dataobjs")
+
+
+def refresh(force=False):
+    """
+    Updates the catalog with the files that were added, modified, moved or
+    deleted by other programs since it was last checked, at most every
+    `TREE_CHECK_INTERVAL` seconds unless `force` is set.
+
+    Only the files whose modification time differs from the one in the catalog
+    are read. Returns whether the catalog changed.
+    """
+    from archivy.data import get_data_dir, map_files, scan_data_dir
+    from archivy.metadata_cache import get_metadata_cache
+    conn = get_catalog()
+    now = time.monotonic()
+    with _checked_at_lock:
+        checked_at = _checked_at.get(g.catalog_path)
+        if not force and checked_at is not None and \
+                now - checked_at < current_app.config["TREE_CHECK_INTERVAL"]:
+            return False
+        _checked_at[g.catalog_path] = now
+
+    data_dir = get_data_dir()
+    known = {path: (dataobj_id, mtime) for dataobj_id, path, mtime
+             in conn.execute("SELECT id, path, mtime FROM dataobjs")}
+    _, filenames = scan_data_dir()
+    changed, seen = [], set()
+    for filename in filenames:
+        path = str(filename.relative_to(data_dir))
+        seen.add(path)
+        try:
+            mtime = filename.stat().st_mtime
+        except FileNotFoundError:
+            continue
+        if path not in known or known[path][1] != mtime:
+            changed.append(filename)
+    deleted = [dataobj_id for path, (dataobj_id, _) in known.items() if path not in seen]
+    if not changed and not deleted:
+        return False
+
+    cache = get_metadata_cache()
+
+    def load(filename):
+        try:
+            return cache.load(filename, metadata_only=True)
+        except FileNotFoundError:
+            return {}
+
+    dataobjs = [(filename, metadata) for filename, metadata
+                in zip(changed, map_files(load, changed)) if "id" in metadata]
+    cache.save()
+    with conn:
+        # moved files are removed from their old path before being added at the new one
+        conn.executemany("DELETE FROM dataobjs WHERE id = ?", [(i,) for i in deleted])
+        conn.executemany("DELETE FROM tags WHERE id = ?", [(i,) for i in deleted])
+        for filename, metadata in dataobjs:
+            _save(conn, filename, metadata)
+    for dataobj_id in deleted:
+        unindex_title(dataobj_id)
+    for filename, metadata in dataobjs:
+        index_title(int(metadata["id"]), str(metadata.get("title", "")), _tags(metadata))
+    current_app.logger.info(f"Refreshed catalog: {len(dataobjs)} dataobjs added or modified, "
+                            f"{len(deleted)} removed")
+    return True
+
+
+def page(after=None, limit=None, types=[]):
+    """
+    Returns the ids and paths of the dataobjs whose id is greater than `after`,
+    sorted by id, as `(id, path)` tuples.
+
+    Parameters:
+
+    - **after** - id after which the page starts, from the first dataobj if None.
+    - **limit** - maximum number of dataobjs returned.
+    - **types** - list of dataobj types, eg bookmark / note. All types if empty.
+    """
+    from archivy.data import get_data_dir
+    clauses, params = [], []
+    if after is not None:
+        clauses.append("id > ?")
+        params.append(after)
+    if types:
+        clauses.append(f"type IN ({', '.join('?' * len(types))})")
+        params.extend(types)
+    query = "SELECT id, path FROM dataobjs"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " ORDER BY id"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    data_dir = get_data_dir()
+    return [(dataobj_id, data_dir / path)
+            for dataobj_id, path in get_catalog().execute(query, params)]
+
+
+def get_tags():
+    """Returns a list of `(tag, number of dataobjs with this tag)`, most used tags first"""
+    return get_catalog().execute(
+        "SELECT tag, COUNT(*) AS count FROM tags GROUP BY tag ORDER BY count DESC, tag"
+    ).fetchall()
+
+
+def find(tags=[], types=[], match_all=True, folders=[], months=[]):
+    """
+    Returns the ids of the dataobjs that have the given tags and are of one of the given types.
+
+    Parameters:
+
+    - **tags** - list of tags. Tags are matched case-insensitively.
+    - **types** - list of dataobj types, eg bookmark / note. All types if empty.
+    - **match_all** - if True, dataobjs must have all of the `tags`, otherwise
+      having any of them is enough.
+    - **folders** - list of top-level folders, `""` being the root of the data dir.
+      All folders if empty.
+    - **months** - list of `YYYY-MM` months the dataobjs were created in. All months if empty.
+    """
+    conn = get_catalog()
+    conditions, params = [], []
+    if tags:
+        tags = sorted({tag.lower() for tag in tags})
+        placeholders = ", ".join("?" * len(tags))
+        having = f"HAVING COUNT(DISTINCT lower(tag)) = {len(tags)}" if match_all else ""
+        conditions.append(
+            f"id IN (SELECT id FROM tags WHERE tag IN ({placeholders}) GROUP BY id {having})")
+        params.extend(tags)
+    for column, values in (("type", types), ("folder", folders), ("month", months)):
+        if values:
+            conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return [row[0] for row in conn.execute(f"SELECT id FROM dataobjs {where} ORDER BY id", params)]
+
+
+def facets(dataobj_ids, size=20):
+    """
+    Counts the tags, types, top-level folders and months of creation of the
+    dataobjs of given ids.
+
+    Returns a dict of lists of `{"value": ..., "count": ...}` for each of `tags`,
+    `type`, `folder` and `date`. Months are sorted chronologically, other values
+    by decreasing count and only the `size` most common tags and folders are returned.
+    """
+    conn = get_catalog()
+    # the ids are passed as a single json array, as there can be more of them
+    # than sqlite accepts query parameters
+    selected = "SELECT value FROM json_each(?)"
+    ids = (json.dumps([int(dataobj_id) for dataobj_id in dataobj_ids]),)
+
+    def count(query):
+        return [{"value": value, "count": count} for value, count in conn.execute(query, ids)]
+
+    def count_column(column, order, limit=""):
+        return count(f"SELECT {column}, COUNT(*) AS count FROM dataobjs "
+                     f"WHERE id IN ({selected}) AND {column} IS NOT NULL "
+                     f"GROUP BY {column} ORDER BY {order} {limit}")
+
+    return {
+        "tags": count(f"SELECT tag, COUNT(*) AS count FROM tags WHERE id IN ({selected}) "
+                      f"GROUP BY tag ORDER BY count DESC, tag LIMIT {int(size)}"),
+        "type": count_column("type", "count DESC, type"),
+        "folder": count_column("folder", "count DESC, folder", f"LIMIT {int(size)}"),
+        "date": count_column("month", "month"),
+    }
+
+
+def get_records(dataobj_ids):
+    """Returns the catalog entries of the dataobjs of given ids, as dicts"""
+    conn = get_catalog()
+    records = []
+    # stay below sqlite's limit on the number of query parameters
+    for i in range(0, len(dataobj_ids), 500):
+        chunk = dataobj_ids[i:i + 500]
+        rows = conn.execute(
+            "SELECT id, path, title, type, tags, date, folder, month FROM dataobjs "
+            f"WHERE id IN ({', '.join('?' * len(chunk))}) ORDER BY id", chunk)
+        records.extend({
+            "id": row[0],
+            "path": row[1],
+            "title": row[2],
+            "type": row[3],
+            "tags": json.loads(row[4]),
+            "date": row[5],
+            "folder": row[6],
+            "month": row[7],
+        } for row in rows)
+    return records
@@ -1,3 +1,4 @@
+import time
 from pathlib import Path
 from os import environ
 from pkg_resources import iter_entry_points
@@ -6,12 +7,17 @@ import click
 from click_plugins import with_plugins
 from flask.cli import FlaskGroup, load_dotenv, shell_command
 
-from archivy import app
+from archivy import app, catalog
 from archivy.config import Config
 from archivy.click_web import create_click_web_app
-from archivy.data import open_file, format_file, unformat_file
+from archivy.data import (open_file, format_file, unformat_file, scan_data_dir, map_files,
+                          migrate_layout, get_data_dir)
+from archivy.duplicates import THRESHOLD, get_duplicate_index
 from archivy.helpers import load_config, write_config
+from archivy.metadata_cache import get_metadata_cache
 from archivy.models import User, DataObj
+from archivy.search import get_search_backend
+from archivy.search.manifest import IndexManifest
 
 
 def create_app():
@@ -136,20 +142,82 @@ def unformat(filenames, output_dir):
         unformat_file(path, output_dir)
 
 
-@cli.command(short_help="Sync content to Elasticsearch")
-def index():
-    data_dir = Path(app.config["USER_DIR"]) / "data"
-
-    if not app.config["SEARCH_CONF"]["enabled"]:
+@cli.command("migrate-layout", short_help="Move dataobjs to the flat or sharded layout.")
+@click.option("--shard-size", type=click.IntRange(min=0), default=1000, show_default=True,
+              help="Number of ids per hidden bucket inside each folder, 0 for the flat layout.")
+def migrate_layout_cmd(shard_size):
+    moved = migrate_layout(shard_size)
+    try:
+        config = load_config()
+    except FileNotFoundError:
+        config = {}
+    config["SHARD_SIZE"] = shard_size
+    write_config(config)
+    click.echo(f"Moved {moved} dataobjs.")
+
+
+@cli.command(short_help="Sync content to the search index")
+@click.option("--chunk-size", type=click.IntRange(min=1), default=500, show_default=True,
+              help="Number of dataobjs sent to the search engine per request.")
+@click.option("--workers", type=click.IntRange(min=1), default=4, show_default=True,
+              help="Number of threads sending requests, for engines that support it.")
+@click.option("--full", is_flag=True,
+              help="Index all dataobjs, not only those that changed since the last run.")
+def index(chunk_size, workers, full):
+    backend = get_search_backend()
+    if backend is None:
         click.echo("Search must be enabled for this command.")
         return
 
-    for filename in data_dir.rglob("*.md"):
-        cur_file = open(filename)
-        dataobj = DataObj.from_md(cur_file.read())
-        cur_file.close()
-
-        if dataobj.index():
-            click.echo(f"Indexed {dataobj.title}...")
-        else:
-            click.echo(f"Failed to index {dataobj.title}")
+    manifest = IndexManifest(backend.name, get_data_dir())
+    _, filenames = scan_data_dir()
+    changed, deleted = manifest.changes(filenames, full=full)
+    for dataobj_id in deleted:
+        backend.delete(dataobj_id)
+    manifest.forget(deleted)
+
+    cache = get_metadata_cache()
+
+    def read_dataobj(filename):
+        return DataObj.from_post(cache.load(filename))
+
+    start = time.perf_counter()
+    with click.progressbar(length=len(changed), label="Indexing") as progress:
+        def dataobjs():
+            for dataobj in map_files(read_dataobj, [filename for filename, _ in changed]):
+                progress.update(1)
+                # skip files whose frontmatter couldn't be read
+                if dataobj.id is not None:
+                    yield dataobj
+
+        with backend.reindexing():
+            indexed = set(backend.bulk_index(dataobjs(), chunk_size=chunk_size,
+                                             workers=workers))
+    cache.save()
+    # dataobjs that failed are indexed again next time
+    manifest.record(entry for _, entry in changed if entry["id"] in indexed)
+    manifest.save()
+
+    elapsed = time.perf_counter() - start
+    click.echo(f"Indexed {len(indexed)} of {len(changed)} new or modified dataobjs in "
+               f"{elapsed:.1f}s ({len(indexed) / max(elapsed, 1e-6):.0f} dataobjs/s), "
+               f"{len(filenames) - len(changed)} unchanged, {len(deleted)} removed.")
+
+
+@cli.command(short_help="List groups of dataobjs that are near-duplicates.")
+@click.option("--threshold", type=click.FloatRange(0, 1), default=THRESHOLD, show_default=True,
+              help="Estimated similarity of the content above which dataobjs are duplicates.")
+@click.option("--type", "types", multiple=True,
+              help="Only compare dataobjs of this type, eg. bookmark. Can be repeated.")
+def duplicates(threshold, types):
+    groups = get_duplicate_index().clusters(threshold, types=set(types) if types else None)
+    records = {record["id"]: record
+               for record in catalog.get_records([dataobj_id for group in groups
+                                                  for dataobj_id in group])}
+    for i, group in enumerate(groups, start=1):
+        click.echo(f"Group {i}:")
+        for dataobj_id in group:
+            record = records.get(dataobj_id, {})
+            click.echo(f"  {dataobj_id}: {record.get('title', '')} ({record.get('path', '')})")
+    click.echo(f"Found {len(groups)} groups of duplicates "
+               f"({sum(len(group) for group in groups)} dataobjs).")
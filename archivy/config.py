@@ -14,11 +14,39 @@ class Config(object):
         os.makedirs(self.INTERNAL_DIR, exist_ok=True)
 
         self.PANDOC_HIGHLIGHT_THEME = "pygments"
+        # parse and write frontmatter with the libyaml C bindings when available
+        self.USE_LIBYAML = True
+        # seconds between checks for changes made to the data dir outside of archivy
+        self.TREE_CHECK_INTERVAL = 5
+        # number of threads used to read dataobjs when scanning the data dir
+        self.SCAN_WORKERS = 0
+        # store dataobjs in hidden buckets of this many ids inside each folder, 0 to disable
+        self.SHARD_SIZE = 0
 
         self.SEARCH_CONF = {
                 "enabled": 0,
+                # search engine to use, see `archivy.search.BACKENDS`. If empty,
+                # elasticsearch is used when enabled, otherwise the built-in engine
+                "engine": "",
+                # use the built-in search engine when elasticsearch is disabled
+                "embedded": 1,
+                # index dataobjs in the background instead of during requests
+                "async_indexing": 0,
                 "url": "http://localhost:9200",
                 "index_name": "dataobj",
+                # seconds during which the health of the cluster is cached
+                "health_ttl": 30,
+                # stop calling the engine for breaker_timeout seconds after
+                # breaker_threshold consecutive failures
+                "breaker_threshold": 3,
+                "breaker_timeout": 30,
+                # search with the built-in engine while the engine is unreachable
+                "fallback": 1,
+                # number of search results cached, and for how many seconds
+                "cache_size": 256,
+                "cache_ttl": 60,
+                # tolerate typos in search queries
+                "fuzzy": 0,
                 "search_conf": {
                     "settings": {
                         "highlight": {
@@ -46,9 +74,16 @@ class Config(object):
                                 "analyzer": "rebuilt_standard",
                                 "term_vector": "with_positions_offsets"
                             },
-                            "tags": {"type": "text", "analyzer": "rebuilt_standard"},
+                            "tags": {
+                                "type": "text",
+                                "analyzer": "rebuilt_standard",
+                                "fields": {"keyword": {"type": "keyword"}}
+                            },
                             "body": {"type": "text", "analyzer": "rebuilt_standard"},
-                            "desc": {"type": "text", "analyzer": "rebuilt_standard"}
+                            "desc": {"type": "text", "analyzer": "rebuilt_standard"},
+                            "type": {"type": "keyword"},
+                            "folder": {"type": "keyword"},
+                            "month": {"type": "keyword"}
                         }
                     }
                 }
@@ -1,6 +1,12 @@
 import platform
+import re
 import subprocess
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
 from pathlib import Path
 from shutil import rmtree
 
@@ -8,7 +14,9 @@ import frontmatter
 from flask import current_app
 from werkzeug.utils import secure_filename
 
+from archivy import catalog, duplicates, related, yaml_codec
 from archivy.helpers import load_hooks
+from archivy.metadata_cache import get_metadata_cache
 from archivy.search import remove_from_index
 
 
@@ -27,15 +35,104 @@ class Directory:
 
 
 FILE_GLOB = "-[0-9][0-9]-[0-9][0-9]-[0-9][0-9]-*"
+FM_BOUNDARY = re.compile(r"^-{3,}\s*$")
+ID_PREFIX = re.compile(r"^([0-9]+)-")
+# number of dataobjs returned per page when listing the contents of a folder
+FOLDER_PAGE_SIZE = 100
+# number of dataobjs read from the catalog at a time by `iter_items`
+ITER_PAGE_SIZE = 500
+# prefix of the hidden bucket directories used by the sharded layout
+SHARD_PREFIX = ".shard-"
+
+
+def is_shard(dirname):
+    """Returns whether `dirname` is the name of a bucket of the sharded layout"""
+    return dirname.startswith(SHARD_PREFIX)
+
+
+def shard_name(dataobj_id, shard_size):
+    """Returns the name of the bucket that holds the dataobj of given id"""
+    return f"{SHARD_PREFIX}{int(dataobj_id) // shard_size}"
+
+
+def logical_dir(filename):
+    """
+    Returns the directory of the dataobj at `filename`, relative to the data dir,
+    as the user sees it: without the buckets of the sharded layout.
+    """
+    reldir = Path(filename).parent.relative_to(get_data_dir())
+    return Path(*[part for part in reldir.parts if not is_shard(part)])
+
+
+def load_metadata(filename):
+    """
+    Returns the frontmatter metadata of the dataobj stored at `filename` as a dict.
+
+    Unlike `frontmatter.load`, this stops reading the file at the closing `---`
+    of the yaml header, so the content of the dataobj is never loaded.
+    """
+    # read lines as bytes so that the content after the header is never decoded
+    with open(filename, "rb") as f:
+        line = f.readline()
+        while line and not line.strip():
+            line = f.readline()
+        if not FM_BOUNDARY.match(line.decode("utf-8")):
+            # header isn't yaml, let frontmatter detect its format
+            return frontmatter.load(filename).metadata
+
+        header = []
+        for line in f:
+            line = line.decode("utf-8")
+            if FM_BOUNDARY.match(line):
+                break
+            header.append(line)
+        else:
+            # header is never closed
+            return {}
+
+    metadata = yaml_codec.load_header("".join(header))
+    return metadata if isinstance(metadata, dict) else {}
+
+
+def split_content(text):
+    """
+    Returns the content of the markdown `text` without its yaml header, the same
+    way `frontmatter.loads` does, or None if the text has no yaml header.
+    """
+    text = text.strip()
+    handler = frontmatter.YAMLHandler()
+    if not handler.detect(text):
+        return None
+    try:
+        _, content = handler.split(text)
+    except ValueError:
+        return None
+    return content.strip()
 
 
 def get_by_id(dataobj_id):
-    """Returns filename of dataobj of given id"""
+    """
+    Returns filename of dataobj of given id.
+
+    The location is read from the catalog, and the data directory is only searched
+    when the catalog doesn't know of the dataobj or its entry is stale.
+    """
+    try:
+        dataobj_id = int(dataobj_id)
+    except ValueError:
+        return None
+    filename = catalog.lookup(dataobj_id)
+    if filename:
+        return filename
     results = list(get_data_dir().rglob(f"{dataobj_id}{FILE_GLOB}"))
-    return results[0] if results else None
+    if results:
+        catalog.add(results[0])
+        return results[0]
+    return None
 
 
-def get_items(collections=[], path="", structured=True, json_format=False):
+def get_items(collections=[], path="", structured=True, json_format=False,
+              metadata_only=False):
     """
     Gets all dataobjs.
 
@@ -47,40 +144,416 @@ def get_items(collections=[], path="", structured=True, json_format=False):
       data will just be returned as a list of dataobjs
     - **json_format**: boolean value used internally to pre-process dataobjs
       to send back a json response.
+    - **metadata_only**: if set to True, only the frontmatter of each dataobj is read
+      and dataobjs are returned as dicts of their metadata, without content.
     """
     datacont = Directory("root") if structured else []
     home_dir = get_data_dir()
-    for filename in home_dir.rglob(path + "*"):
+    by_type = collections and not structured and not path
+    if by_type:
+        # only load the dataobjs of these types, using the catalog's type index,
+        # after picking up the files changed by other programs
+        catalog.refresh()
+        dirnames = []
+        filenames = [home_dir / record["path"] for record in
+                     catalog.get_records(catalog.find(types=collections))]
+    else:
+        dirnames, filenames = scan_data_dir(path + "*")
+    if structured:
+        for dirname in dirnames:
+            _tree_node(datacont, dirname.relative_to(home_dir))
+
+    cache = get_metadata_cache()
+
+    def load(filename):
+        try:
+            return cache.load(filename, metadata_only)
+        except FileNotFoundError:
+            # deleted since the data dir or the catalog was read
+            return None
+
+    for filename, data in zip(filenames, map_files(load, filenames)):
+        if data is None:
+            continue
         if structured:
-            paths = filename.relative_to(home_dir)
-            current_dir = datacont
-
-            # iterate through paths
-            for segment in paths.parts:
-                if segment.endswith(".md"):
-                    data = frontmatter.load(filename)
-                    current_dir.child_files.append(data)
-                else:
-                    # directory has not been saved in tree yet
-                    if segment not in current_dir.child_dirs:
-                        current_dir.child_dirs[segment] = Directory(segment)
-                    current_dir = current_dir.child_dirs[segment]
-        else:
-            if filename.parts[-1].endswith(".md"):
-                data = frontmatter.load(filename)
-                if len(collections) == 0 or \
-                        any([collection == data["type"]
-                            for collection in collections]):
-                    if json_format:
-                        dict_dataobj = data.__dict__
-                        # remove unnecessary yaml handler
-                        dict_dataobj.pop("handler")
-                        datacont.append(dict_dataobj)
-                    else:
-                        datacont.append(data)
+            parent = _tree_node(datacont, logical_dir(filename))
+            parent.child_files.append(data)
+        elif len(collections) == 0 or \
+                any([collection == data["type"] for collection in collections]):
+            if json_format:
+                if metadata_only:
+                    datacont.append({"metadata": data})
+                    continue
+                dict_dataobj = data.__dict__
+                # remove unnecessary yaml handler
+                dict_dataobj.pop("handler")
+                datacont.append(dict_dataobj)
+            else:
+                datacont.append(data)
+
+    if not path and not by_type:
+        cache.prune(filenames)
+    cache.save()
     return datacont
 
 
+def iter_items(cursor=None, limit=None, fields=None, collections=[]):
+    """
+    Returns a generator over all dataobjs, sorted by id, that only holds one page of
+    dataobjs in memory at a time.
+
+    Dataobjs are yielded in the same format as `get_items(json_format=True)`:
+    dicts with a `metadata` dict and the `content` of the dataobj.
+
+    Parameters:
+
+    - **cursor** - only dataobjs with an id greater than this are returned.
+      Pass the id of the last dataobj you received to resume iteration.
+      Raises ValueError if it isn't an id, rather than starting over.
+    - **limit** - maximum number of dataobjs to return.
+    - **fields** - list of the fields to return, eg `["title", "tags"]`. The id
+      is always returned. Include `content` to get the body of the dataobjs,
+      which isn't read otherwise.
+    - **collections** - filter dataobj by type, eg. bookmark / note
+    """
+    if cursor is not None:
+        try:
+            cursor = int(cursor)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid cursor {cursor!r}") from e
+    return _iter_items(cursor, limit, fields, collections)
+
+
+def _iter_items(cursor, limit, fields, collections):
+    # pages are read from the id index of the catalog, after picking up the
+    # files changed by other programs
+    catalog.refresh()
+    with_content = fields is None or "content" in fields
+    cache = get_metadata_cache()
+
+    def load(filename):
+        try:
+            return cache.load(filename, metadata_only=not with_content)
+        except FileNotFoundError:
+            # deleted since the catalog was refreshed
+            return None
+
+    count = 0
+    while limit is None or count < limit:
+        size = ITER_PAGE_SIZE if limit is None else min(ITER_PAGE_SIZE, limit - count)
+        rows = catalog.page(cursor, size, collections)
+        if not rows:
+            break
+        cursor = rows[-1][0]
+        for data in map_files(load, [filename for _, filename in rows]):
+            if limit is not None and count >= limit:
+                break
+            if data is None:
+                continue
+            metadata = data.metadata if with_content else data
+            if collections and metadata.get("type") not in collections:
+                continue
+            dataobj = {"metadata": metadata}
+            if fields is not None:
+                dataobj["metadata"] = {key: val for key, val in metadata.items()
+                                       if key in fields or key == "id"}
+            if with_content:
+                dataobj["content"] = data.content
+            count += 1
+            yield dataobj
+    cache.save()
+
+
+def _tree_node(tree, reldir):
+    """Returns the node of `tree` for directory `reldir`, creating it if needed"""
+    node = tree
+    for segment in Path(reldir).parts:
+        if segment not in node.child_dirs:
+            node.child_dirs[segment] = Directory(segment)
+        node = node.child_dirs[segment]
+    return node
+
+
+def scan_data_dir(pattern="*"):
+    """
+    Walks the data dir and returns two lists: the directories and the markdown files
+    whose name matches `pattern`, in the order they were found.
+
+    This uses `os.walk`, which is built on `os.scandir` and doesn't need to stat
+    every file. The files of a directory are listed before those of its subdirectories.
+
+    Buckets of the sharded layout are walked but aren't returned as directories,
+    so their files appear to be part of the folder that contains them.
+    """
+    dirnames, filenames = [], []
+    for root, dirs, files in os.walk(get_data_dir()):
+        root = Path(root)
+        dirs.sort()
+        dirnames.extend(root / dirname for dirname in dirs
+                        if not is_shard(dirname) and fnmatch(dirname, pattern))
+        filenames.extend(root / filename for filename in sorted(files)
+                         if filename.endswith(".md") and fnmatch(filename, pattern))
+    return dirnames, filenames
+
+
+def map_files(func, filenames):
+    """
+    Yields the result of `func(filename)` for each of `filenames`, in order.
+
+    If `SCAN_WORKERS` is set to more than 1 in the config, files are processed by
+    a pool of that many threads, which speeds up reading large vaults, especially
+    on network filesystems. `func` must not rely on the flask app context.
+    """
+    workers = current_app.config["SCAN_WORKERS"]
+    if workers <= 1:
+        for filename in filenames:
+            yield func(filename)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # bound the number of results held in memory at once
+        pending = deque()
+        for filename in filenames:
+            pending.append(executor.submit(func, filename))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# process-wide cache of the sidebar tree of each data dir
+_trees = {}
+_trees_lock = threading.RLock()
+# held while a cached tree is checked in the background
+_tree_check_lock = threading.Lock()
+
+
+def file_changes(stats):
+    """
+    Returns the files of the data dir that were added or modified since `stats`
+    was recorded, and the paths of `stats` whose file was deleted.
+
+    `stats` maps the paths of files to their `(st_mtime_ns, st_size)`. It is used
+    by the in-memory indexes of dataobjs to only read the files that changed.
+    """
+    _, filenames = scan_data_dir()
+    changed = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        if stats.get(str(filename)) != (stat.st_mtime_ns, stat.st_size):
+            changed.append(filename)
+    seen = {str(filename) for filename in filenames}
+    return changed, [path for path in stats if path not in seen]
+
+
+def tree_stats(data_dir):
+    """
+    Returns the modification time of every directory in `data_dir` and the
+    `(st_mtime_ns, st_size)` of every markdown file, by path relative to `data_dir`.
+
+    Files are included so that files modified in place, which doesn't change
+    the modification time of their directory, are detected too.
+    """
+    stats = {}
+    for root, _, files in os.walk(data_dir):
+        reldir = Path(root).relative_to(data_dir)
+        try:
+            stats[str(reldir)] = os.stat(root).st_mtime_ns
+            for filename in files:
+                if filename.endswith(".md"):
+                    stat = os.stat(os.path.join(root, filename))
+                    stats[str(reldir / filename)] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            # deleted while we were walking, which the next check will see
+            continue
+    return stats
+
+
+def get_tree():
+    """
+    Returns the `Directory` tree of the data dir, with dataobjs loaded as metadata dicts.
+
+    The tree is cached for the whole process and updated in place when archivy
+    modifies dataobjs or directories. At most every `TREE_CHECK_INTERVAL` seconds,
+    the modification times of the directories and files are checked in the
+    background to detect files that were changed on disk by other programs, in
+    which case the tree is rebuilt, so pages never wait for the data dir to be walked.
+    """
+    data_dir = get_data_dir()
+    key = str(data_dir)
+    with _trees_lock:
+        cached = _trees.get(key)
+        now = time.monotonic()
+        if cached and now - cached["checked_at"] >= current_app.config["TREE_CHECK_INTERVAL"] \
+                and _tree_check_lock.acquire(blocking=False):
+            # other requests keep using the current tree until the check is done
+            cached["checked_at"] = now
+            threading.Thread(target=_check_tree, daemon=True,
+                             args=(current_app._get_current_object(), data_dir)).start()
+    if cached:
+        current_app.logger.debug("Directory tree cache hit")
+        return cached["tree"]
+    return _build_tree(data_dir)
+
+
+def _build_tree(data_dir, stats=None):
+    if stats is None:
+        stats = tree_stats(data_dir)
+    # the vault is read outside of the lock, so requests aren't blocked meanwhile.
+    # Changes made since `stats` was taken are picked up by the next check.
+    start = time.perf_counter()
+    tree = get_items(metadata_only=True)
+    with _trees_lock:
+        _trees[str(data_dir)] = {"tree": tree, "stats": stats, "checked_at": time.monotonic(),
+                                 "version": 0}
+    current_app.logger.info(
+        f"Directory tree cache miss, rebuilt in {time.perf_counter() - start:.3f}s")
+    return tree
+
+
+def _check_tree(app, data_dir):
+    """Rebuilds the cached tree of `data_dir` if files were changed by other programs"""
+    with app.app_context():
+        try:
+            with _trees_lock:
+                cached = _trees.get(str(data_dir))
+                if cached is None:
+                    return
+                version = cached["version"]
+            stats = tree_stats(data_dir)
+            with _trees_lock:
+                cached = _trees.get(str(data_dir))
+                if cached is None or cached["stats"] == stats:
+                    return
+                if cached["version"] != version:
+                    # archivy changed the tree while the data dir was walked, so
+                    # the differences may be its own: check again on the next request
+                    cached["checked_at"] = 0
+                    return
+            # files were changed by other programs, so the catalog is stale too
+            catalog.refresh(force=True)
+            _build_tree(data_dir, stats)
+        except Exception as e:
+            app.logger.warning(f"Failed to check the directory tree: {e!r}")
+        finally:
+            _tree_check_lock.release()
+
+
+def get_folder(path="", page=1, per_page=FOLDER_PAGE_SIZE):
+    """
+    Returns the contents of the directory at `path` (relative to the data dir),
+    used to lazily load the sidebar one folder at a time.
+
+    The result contains one page of the directory's dataobjs, sorted by title,
+    and all of its subdirectories along with the number of dataobjs and
+    subdirectories they contain. Returns None if the directory doesn't exist.
+    """
+    node = get_tree()
+    for segment in Path(path).parts:
+        node = node.child_dirs.get(segment)
+        if node is None:
+            return None
+
+    files = sorted(node.child_files, key=lambda dataobj: str(dataobj.get("title", "")).lower())
+    start = (page - 1) * per_page
+    return {
+        "path": str(Path(path)) if path else "",
+        "page": page,
+        "per_page": per_page,
+        "num_files": len(files),
+        "num_dirs": len(node.child_dirs),
+        "files": [{"id": dataobj.get("id"), "title": dataobj.get("title")}
+                  for dataobj in files[start:start + per_page]],
+        "dirs": [{
+            "name": name,
+            "path": str(Path(path) / name),
+            "num_files": len(child.child_files),
+            "num_dirs": len(child.child_dirs),
+        } for name, child in sorted(node.child_dirs.items())],
+    }
+
+
+def _cached_tree_node(reldir, create=False):
+    """
+    Returns the cached tree node for the directory `reldir` (relative to the data dir)
+    and the cache entry it belongs to, or `(None, None)` if the tree isn't cached.
+    """
+    data_dir = get_data_dir()
+    cached = _trees.get(str(data_dir))
+    if not cached:
+        return None, None
+    node = cached["tree"]
+    for segment in Path(reldir).parts:
+        if segment not in node.child_dirs:
+            if not create:
+                return None, cached
+            node.child_dirs[segment] = Directory(segment)
+            _stamp(cached, data_dir, Path(reldir))
+        node = node.child_dirs[segment]
+    return node, cached
+
+
+def _stamp(cached, data_dir, reldir, filename=None):
+    """
+    Records the current modification time of `reldir` and its parents, and of
+    the file `filename` in `reldir` if it is given, in the cache entry, so
+    changes made by archivy itself don't invalidate the tree.
+    """
+    reldir = Path(reldir)
+    stats = cached["stats"]
+    cached["version"] += 1
+    if filename is not None:
+        path = str(reldir / Path(filename).name)
+        try:
+            stat = os.stat(data_dir / path)
+            stats[path] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            stats.pop(path, None)
+    for directory in [reldir] + list(reldir.parents):
+        try:
+            stats[str(directory)] = os.stat(data_dir / directory).st_mtime_ns
+        except FileNotFoundError:
+            stats.pop(str(directory), None)
+
+
+def track_dataobj(filename, metadata):
+    """
+    Records that the dataobj at `filename` was created or modified with the
+    given `metadata`, updating the catalog and the cached directory tree.
+    """
+    catalog.add(filename, metadata)
+    related.track(filename, metadata)
+    duplicates.track(filename, metadata)
+    reldir = Path(filename).parent.relative_to(get_data_dir())
+    with _trees_lock:
+        node, cached = _cached_tree_node(logical_dir(filename), create=True)
+        if node is None:
+            return
+        node.child_files = [dataobj for dataobj in node.child_files
+                            if dataobj.get("id") != metadata.get("id")]
+        node.child_files.append(dict(metadata))
+        _stamp(cached, get_data_dir(), reldir, filename)
+
+
+def untrack_dataobj(filename, dataobj_id):
+    """Records that the dataobj of given id stored at `filename` was deleted"""
+    catalog.remove(dataobj_id)
+    related.untrack(dataobj_id)
+    duplicates.untrack(dataobj_id)
+    try:
+        reldir = Path(filename).resolve().parent.relative_to(get_data_dir().resolve())
+    except ValueError:
+        return
+    logical = Path(*[part for part in reldir.parts if not is_shard(part)])
+    with _trees_lock:
+        node, cached = _cached_tree_node(logical)
+        if node is None:
+            return
+        node.child_files = [dataobj for dataobj in node.child_files
+                            if dataobj.get("id") != dataobj_id]
+        _stamp(cached, get_data_dir(), reldir, filename)
+
+
 def create(contents, title, path=""):
     """
     Helper method to save a new dataobj onto the filesystem.
@@ -90,8 +563,17 @@ def create(contents, title, path=""):
     - **contents**: md file contents
     - **title** - title used for filename
     - **path**
+
+    If `SHARD_SIZE` is set in the config, the file is stored in the bucket of
+    `path` that corresponds to the id at the start of `title`.
     """
-    path_to_md_file = get_data_dir() / path / f"{secure_filename(title)}.md"
+    directory = get_data_dir() / path
+    shard_size = current_app.config["SHARD_SIZE"]
+    match = ID_PREFIX.match(title)
+    if shard_size and match:
+        directory = directory / shard_name(match.group(1), shard_size)
+        directory.mkdir(exist_ok=True)
+    path_to_md_file = directory / f"{secure_filename(title)}.md"
     with open(path_to_md_file, "w", encoding="utf-8") as file:
         file.write(contents)
 
@@ -102,7 +584,7 @@ def get_item(dataobj_id):
     """Returns a Post object with the given dataobjs' attributes"""
     file = get_by_id(dataobj_id)
     if file:
-        data = frontmatter.load(file)
+        data = yaml_codec.load(file)
         data["fullpath"] = str(file)
         return data
     return None
@@ -114,6 +596,7 @@ def delete_item(dataobj_id):
     remove_from_index(dataobj_id)
     if file:
         Path(file).unlink()
+        untrack_dataobj(file, int(dataobj_id))
 
 
 def update_item(dataobj_id, new_content):
@@ -152,11 +635,12 @@ def update_item(dataobj_id, new_content):
 
     from archivy.models import DataObj
     filename = get_by_id(dataobj_id)
-    dataobj = frontmatter.load(filename)
+    dataobj = yaml_codec.load(filename)
     dataobj.content = new_content
-    md = frontmatter.dumps(dataobj)
+    md = yaml_codec.dumps(dataobj)
     with open(filename, "w", encoding="utf-8") as f:
         f.write(md)
+    track_dataobj(filename, dataobj.metadata)
 
     converted_dataobj = DataObj.from_md(md)
     converted_dataobj.fullpath = str(filename.relative_to(current_app.config["USER_DIR"]))
@@ -166,9 +650,9 @@ def update_item(dataobj_id, new_content):
 
 def get_dirs():
     """Gets all dir names where dataobjs are stored"""
-    # join glob matchers
-    dirnames = [str(dir_path.relative_to(get_data_dir())) for dir_path
-                in get_data_dir().rglob("*") if dir_path.is_dir()]
+    # only directories are listed, the files they contain aren't read
+    dirnames, _ = scan_data_dir()
+    dirnames = [str(dirname.relative_to(get_data_dir())) for dirname in dirnames]
 
     # append name for root dir
     dirnames.append("not classified")
@@ -180,6 +664,8 @@ def create_dir(name):
     home_dir = get_data_dir()
     new_path = home_dir / name
     new_path.mkdir(parents=True, exist_ok=True)
+    with _trees_lock:
+        _cached_tree_node(new_path.relative_to(home_dir), create=True)
     return str(new_path.relative_to(home_dir))
 
 
@@ -187,9 +673,19 @@ def delete_dir(name):
     """Deletes dir of given name"""
     try:
         rmtree(get_data_dir() / name)
-        return True
     except FileNotFoundError:
         return False
+    catalog.remove_dir(name)
+    reldir = Path(name)
+    with _trees_lock:
+        parent, cached = _cached_tree_node(reldir.parent)
+        if parent is not None:
+            parent.child_dirs.pop(reldir.name, None)
+            for path in list(cached["stats"]):
+                if Path(path) == reldir or reldir in Path(path).parents:
+                    del cached["stats"][path]
+            _stamp(cached, get_data_dir(), reldir.parent)
+    return True
 
 
 def format_file(path: str):
@@ -239,7 +735,6 @@ def unformat_file(path: str, out_dir: str):
     and a filename of format "{id}-{old_filename}.md"
     """
 
-    data_dir = get_data_dir()
     path = Path(path)
     out_dir = Path(out_dir)
     if not path.exists() and out_dir.exists() and out_dir.is_dir():
@@ -251,11 +746,11 @@ def unformat_file(path: str, out_dir: str):
             unformat_file(filename, str(out_dir))
 
     else:
-        dataobj = frontmatter.load(str(path))
+        dataobj = yaml_codec.load(str(path))
 
         try:
             # get relative path of object in `data` dir
-            datapath = path.parent.resolve().relative_to(data_dir)
+            datapath = logical_dir(path.resolve())
         except ValueError:
             datapath = Path()
 
@@ -267,6 +762,43 @@ def unformat_file(path: str, out_dir: str):
 
         current_app.logger.info(f"Unformatted and moved {str(path)} to {str(new_path.resolve())}")
         path.unlink()
+        if "id" in dataobj.metadata:
+            untrack_dataobj(path, dataobj["id"])
+
+
+def migrate_layout(shard_size):
+    """
+    Moves the dataobjs of the data dir to the layout given by `shard_size`: into
+    buckets of `shard_size` consecutive ids under each folder, or back into
+    the folders themselves if `shard_size` is 0.
+
+    Returns the number of moved files.
+    """
+    data_dir = get_data_dir()
+    _, filenames = scan_data_dir()
+    moved = 0
+    for filename in filenames:
+        match = ID_PREFIX.match(filename.name)
+        dataobj_id = int(match.group(1)) if match else load_metadata(filename).get("id")
+        target_dir = data_dir / logical_dir(filename)
+        if shard_size and isinstance(dataobj_id, int):
+            target_dir = target_dir / shard_name(dataobj_id, shard_size)
+        if target_dir == filename.parent:
+            continue
+        target_dir.mkdir(exist_ok=True)
+        os.replace(str(filename), str(target_dir / filename.name))
+        moved += 1
+
+    # remove the buckets that are now empty
+    for root, _, _ in os.walk(data_dir, topdown=False):
+        if is_shard(Path(root).name) and not os.listdir(root):
+            os.rmdir(root)
+
+    current_app.config["SHARD_SIZE"] = shard_size
+    with _trees_lock:
+        _trees.pop(str(data_dir), None)
+    catalog.rebuild()
+    return moved
 
 
 def open_file(path):
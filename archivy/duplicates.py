@@ -0,0 +1,381 @@
+import os
+import pickle
+import random
+import re
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from flask import current_app
+
+try:
+    import numpy as np
+except ImportError:
+    # signatures are then computed in pure python, which is several times slower
+    np = None
+
+
+WORD = re.compile(r"\w+")
+# number of words of the shingles compared between dataobjs
+SHINGLE_SIZE = 3
+# the signatures are made of NUM_PERM min hashes, split into BANDS bands for LSH.
+# Dataobjs become candidates if all the hashes of one of their bands are equal,
+# which mostly happens above a similarity of about (1 / BANDS) ** (1 / rows) = 0.5
+NUM_PERM = 64
+BANDS = 16
+# estimated similarity above which dataobjs are considered duplicates
+THRESHOLD = 0.8
+
+# the hash functions are `(a * x + b) % PRIME`, with the same coefficients in
+# every process so signatures can be compared
+PRIME = (1 << 61) - 1
+_random = random.Random(0)
+PERMUTATIONS = [(_random.randrange(1, PRIME), _random.randrange(PRIME)) for _ in range(NUM_PERM)]
+
+# signatures computed by the numpy and pure python implementations must be equal,
+# so the products, which don't fit 64 bits, are split on the 32 low bits of `a`
+if np is not None:
+    _PRIME = np.uint64(PRIME)
+    _A_HIGH = np.array([a >> 32 for a, _ in PERMUTATIONS], dtype=np.uint64)[:, None]
+    _A_LOW = np.array([a & 0xFFFFFFFF for a, _ in PERMUTATIONS], dtype=np.uint64)[:, None]
+    _B = np.array([b for _, b in PERMUTATIONS], dtype=np.uint64)[:, None]
+# number of shingles hashed at once by numpy, which bounds the memory used
+CHUNK_SIZE = 4096
+# version of the signatures stored on disk, which changes with the parameters above
+SIGNATURES_VERSION = (1, SHINGLE_SIZE, NUM_PERM, BANDS)
+
+# indexes already built by this process, by data dir
+_indexes = {}
+_indexes_lock = threading.Lock()
+# held while an index is built in the background
+_build_lock = threading.Lock()
+
+
+def shingles(text):
+    """Returns the hashes of the sequences of `SHINGLE_SIZE` words of `text`, lowercased"""
+    words = WORD.findall(str(text).lower())
+    if len(words) <= SHINGLE_SIZE:
+        # texts of a few words are compared as a whole
+        return {zlib.crc32(" ".join(words).encode())} if words else set()
+    return {zlib.crc32(" ".join(words[i:i + SHINGLE_SIZE]).encode())
+            for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def minhash(text):
+    """
+    Returns the MinHash signature of `text`: for each hash function, the smallest
+    hash of its shingles. Returns None if `text` has no words.
+    """
+    hashes = shingles(text)
+    if not hashes:
+        return None
+    if np is None:
+        return tuple(min((a * x + b) % PRIME for x in hashes) for a, b in PERMUTATIONS)
+
+    hashes = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+    minimums = None
+    for start in range(0, len(hashes), CHUNK_SIZE):
+        x = hashes[start:start + CHUNK_SIZE]
+        low = (_A_LOW * x) % _PRIME
+        # a * x = (a >> 32) * x * 2 ** 32 + (a & 0xFFFFFFFF) * x, and 2 ** 61 = 1 mod PRIME
+        high = (_A_HIGH * x) % _PRIME
+        high = ((high >> np.uint64(29)) + ((high & np.uint64((1 << 29) - 1)) << np.uint64(32)))
+        values = ((low + high % _PRIME + _B) % _PRIME).min(axis=1)
+        minimums = values if minimums is None else np.minimum(minimums, values)
+    return tuple(int(value) for value in minimums)
+
+
+def similarity(signature, other):
+    """Estimates the Jaccard similarity of the shingles of two texts from their signatures"""
+    return sum(1 for x, y in zip(signature, other) if x == y) / NUM_PERM
+
+
+def _bands(signature):
+    rows = NUM_PERM // BANDS
+    return [(band, signature[band * rows:(band + 1) * rows]) for band in range(BANDS)]
+
+
+def dataobj_text(fields):
+    """Returns the text of a dataobj that is compared: its content, or its title if it has none"""
+    return fields.get("content") or fields.get("title") or ""
+
+
+class DuplicateIndex:
+    """
+    Locality-sensitive hashing index of the MinHash signatures of the dataobjs
+    of a data dir, used to find near-duplicates.
+
+    Each signature is split into bands, and dataobjs are stored in a bucket for
+    each of their bands. Only the dataobjs sharing a bucket with a signature are
+    compared with it, so lookups don't depend on the size of the vault and
+    clusters of duplicates are found in near-linear time.
+
+    Like `archivy.search.embedded.EmbeddedIndex`, the index is built from the
+    data dir the first time it is used, then kept up to date by archivy, and
+    files changed by other programs are picked up at most every
+    `TREE_CHECK_INTERVAL` seconds. If `path` is given, the signatures are also
+    stored there, so they are only computed again for files that changed.
+    """
+
+    def __init__(self, data_dir, path=None):
+        self.data_dir = data_dir
+        self.path = Path(path) if path is not None else None
+        self.lock = threading.RLock()
+        # (band, hashes of the band) -> ids of the dataobjs in the bucket
+        self.buckets = {}
+        # dataobj id -> signature, title, type, path and stat of its file
+        self.docs = {}
+        self.paths = {}
+        # when the data dir was last compared with the index, None until built
+        self.checked_at = None
+
+    def add(self, dataobj_id, fields, filename=None):
+        """
+        Computes the signature of the dataobj of given id. `fields` is a dict
+        with its title, type and content.
+        """
+        signature = minhash(dataobj_text(fields))
+        stat = None
+        if filename is not None:
+            try:
+                stat = os.stat(filename)
+                stat = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                pass
+
+        self._insert(dataobj_id, {
+            "signature": signature,
+            "title": fields.get("title"),
+            "type": fields.get("type"),
+            "path": str(filename) if filename is not None else None,
+            "stat": stat,
+        })
+
+    def _insert(self, dataobj_id, doc):
+        with self.lock:
+            self.remove(dataobj_id)
+            self.docs[dataobj_id] = doc
+            if doc["path"] is not None:
+                self.paths[doc["path"]] = dataobj_id
+            if doc["signature"] is not None:
+                for band in _bands(doc["signature"]):
+                    self.buckets.setdefault(band, set()).add(dataobj_id)
+
+    def remove(self, dataobj_id):
+        """Removes the dataobj of given id from the index"""
+        with self.lock:
+            doc = self.docs.pop(dataobj_id, None)
+            if doc is None:
+                return
+            if doc["signature"] is not None:
+                for band in _bands(doc["signature"]):
+                    bucket = self.buckets[band]
+                    bucket.discard(dataobj_id)
+                    if not bucket:
+                        del self.buckets[band]
+            if self.paths.get(doc["path"]) == dataobj_id:
+                del self.paths[doc["path"]]
+
+    def refresh(self):
+        """Reads the files of the data dir that changed since they were last read"""
+        from archivy.data import file_changes, map_files
+        from archivy.metadata_cache import get_metadata_cache
+
+        with self.lock:
+            now = time.monotonic()
+            if self.checked_at is not None and \
+                    now - self.checked_at < current_app.config["TREE_CHECK_INTERVAL"]:
+                return
+            if self.checked_at is None:
+                self._load()
+            self.checked_at = now
+
+            changed, deleted = file_changes({
+                path: self.docs[dataobj_id]["stat"] for path, dataobj_id in self.paths.items()})
+            for path in deleted:
+                self.remove(self.paths[path])
+
+            cache = get_metadata_cache()
+            for filename, post in zip(changed, map_files(cache.load, changed)):
+                if "id" in post.metadata:
+                    self.add(post["id"], dict(post.metadata, content=post.content), filename)
+            cache.save()
+            if changed or deleted:
+                self._save()
+
+    def _load(self):
+        """Reads the signatures stored at `path`, whose files are checked by `refresh`"""
+        if self.path is None:
+            return
+        try:
+            with self.path.open("rb") as f:
+                version, docs = pickle.load(f)
+        except Exception:
+            # missing, corrupt or from another version, the signatures are computed again
+            return
+        if version != SIGNATURES_VERSION:
+            return
+        for dataobj_id, doc in docs.items():
+            self._insert(dataobj_id, doc)
+
+    def _save(self):
+        """Stores the signatures of the dataobjs read from files at `path`"""
+        if self.path is None:
+            return
+        docs = {dataobj_id: self.docs[dataobj_id] for dataobj_id in self.paths.values()}
+        # a unique temporary file, as the server and the cli may save at the same time
+        with tempfile.NamedTemporaryFile(dir=str(self.path.parent), prefix=self.path.name,
+                                         suffix=".tmp", delete=False) as f:
+            try:
+                pickle.dump((SIGNATURES_VERSION, docs), f, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                f.close()
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, str(self.path))
+
+    def find(self, signature, threshold=THRESHOLD, exclude=None):
+        """
+        Returns the dataobjs whose signature is similar to `signature`, as dicts
+        with their `id`, `title` and estimated `similarity`, most similar first.
+        The dataobj of id `exclude` is left out.
+        """
+        if signature is None:
+            return []
+        with self.lock:
+            candidates = set()
+            for band in _bands(signature):
+                candidates.update(self.buckets.get(band, ()))
+            candidates.discard(exclude)
+            matches = []
+            for dataobj_id in candidates:
+                doc = self.docs[dataobj_id]
+                score = similarity(signature, doc["signature"])
+                if score >= threshold:
+                    matches.append({"id": dataobj_id, "title": doc["title"],
+                                    "similarity": round(score, 3)})
+        return sorted(matches, key=lambda match: (-match["similarity"], match["id"]))
+
+    def clusters(self, threshold=THRESHOLD, types=None):
+        """
+        Returns the groups of dataobjs that are near-duplicates of each other, as
+        sorted lists of ids, largest groups first. Only the dataobjs of one of
+        `types` are grouped if it is given.
+
+        The members of each bucket are only compared with its first member, and
+        groups are merged with a union-find, so the vault is grouped in
+        near-linear time.
+        """
+        parents = {}
+
+        def root(dataobj_id):
+            while parents.setdefault(dataobj_id, dataobj_id) != dataobj_id:
+                # path halving keeps the trees flat
+                parents[dataobj_id] = parents[parents[dataobj_id]]
+                dataobj_id = parents[dataobj_id]
+            return dataobj_id
+
+        with self.lock:
+            for bucket in self.buckets.values():
+                members = sorted(dataobj_id for dataobj_id in bucket
+                                 if types is None or self.docs[dataobj_id]["type"] in types)
+                if len(members) < 2:
+                    continue
+                first = self.docs[members[0]]["signature"]
+                for dataobj_id in members[1:]:
+                    if similarity(first, self.docs[dataobj_id]["signature"]) >= threshold:
+                        parents[root(dataobj_id)] = root(members[0])
+
+        groups = {}
+        for dataobj_id in parents:
+            groups.setdefault(root(dataobj_id), []).append(dataobj_id)
+        return sorted((sorted(group) for group in groups.values() if len(group) > 1),
+                      key=lambda group: (-len(group), group))
+
+
+def get_duplicate_index(build=True):
+    """
+    Returns the duplicate index of the current data dir, building or refreshing
+    it first if `build` is set. Returns None if `build` isn't set and the index
+    wasn't built yet.
+    """
+    from archivy.data import get_data_dir
+    data_dir = get_data_dir()
+    with _indexes_lock:
+        index = _indexes.get(str(data_dir))
+        if index is None:
+            if not build:
+                return None
+            index = _indexes[str(data_dir)] = DuplicateIndex(data_dir, _signatures_path())
+    if build:
+        index.refresh()
+    return index
+
+
+def _signatures_path():
+    return Path(current_app.config["INTERNAL_DIR"]) / "duplicates.pickle"
+
+
+def build_in_background():
+    """
+    Builds the duplicate index of the current data dir in a background thread,
+    unless it is already being built. It is only used once built, so that
+    requests never wait for the signatures of the whole vault.
+    """
+    from archivy.data import get_data_dir
+    app = current_app._get_current_object()
+    data_dir = get_data_dir()
+
+    def run():
+        with app.app_context():
+            try:
+                index = DuplicateIndex(data_dir, _signatures_path())
+                index.refresh()
+                with _indexes_lock:
+                    _indexes.setdefault(str(data_dir), index)
+            except Exception as e:
+                app.logger.warning(f"Failed to build the duplicate index: {e!r}")
+            finally:
+                _build_lock.release()
+
+    # only one build at a time
+    if _build_lock.acquire(blocking=False):
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+    return None
+
+
+def find_duplicates(dataobj, threshold=THRESHOLD):
+    """
+    Returns the dataobjs that are likely duplicates of the `archivy.models.DataObj`.
+
+    Returns an empty list if the duplicate index wasn't built yet, and starts
+    building it in the background: changes made meanwhile are picked up by its
+    next refresh.
+    """
+    if get_duplicate_index(build=False) is None:
+        build_in_background()
+        return []
+    fields = {"title": dataobj.title, "content": dataobj.content}
+    return get_duplicate_index().find(minhash(dataobj_text(fields)), threshold,
+                                      exclude=dataobj.id)
+
+
+def track(filename, metadata):
+    """Updates the signature of the dataobj at `filename`, if the index was built"""
+    from archivy.metadata_cache import get_metadata_cache
+    index = get_duplicate_index(build=False)
+    if index is None or "id" not in metadata:
+        return
+    post = get_metadata_cache().load(filename)
+    index.add(int(metadata["id"]), dict(post.metadata, content=post.content), filename)
+
+
+def untrack(dataobj_id):
+    """Removes the dataobj of given id, if the index was built"""
+    index = get_duplicate_index(build=False)
+    if index is not None:
+        index.remove(int(dataobj_id))
@@ -1,5 +1,6 @@
 from pathlib import Path
-import sys
+import threading
+import time
 
 import elasticsearch
 import yaml
@@ -63,30 +64,92 @@ def set_max_id(val):
     db.update(operations.set("val", val), Query().name == "max_id")
 
 
-def get_elastic_client():
-    """Returns the elasticsearch client you can use to search and insert / delete data"""
-    if not current_app.config["SEARCH_CONF"]["enabled"]:
-        return None
+# elasticsearch clients of the process and the last known health of their cluster, by url
+_elastic_clients = {}
+_elastic_health = {}
+_elastic_lock = threading.Lock()
 
-    es = Elasticsearch(current_app.config["SEARCH_CONF"]["url"])
-    try:
-        health = es.cluster.health()
-    except elasticsearch.exceptions.ConnectionError:
-        current_app.logger.error(
-            "Elasticsearch does not seem to be running on "
-            f"{current_app.config['SEARCH_CONF']['url']}. Please start "
-            "it, for example with: sudo service elasticsearch restart"
-        )
-        current_app.logger.error(
-            "You can disable Elasticsearch by modifying the `enabled` variable "
-            f"in {str(Path(current_app.config['INTERNAL_DIR']) / 'config.yml')}"
-        )
-        sys.exit(1)
 
+def _check_elastic_health(es, url, logger):
+    """Queries the health of the cluster at `url` and caches it"""
+    health = es.cluster.health()
+    with _elastic_lock:
+        _elastic_health[url] = {"health": health, "checked_at": time.monotonic(),
+                                "refreshing": False}
     if health["status"] not in ("yellow", "green"):
-        current_app.logger.warning(
+        logger.warning(
             "Elasticsearch reports that it is not working "
             "properly. Search might not work. You can disable "
             "Elasticsearch by setting ELASTICSEARCH_ENABLED to 0."
         )
+    return health
+
+
+def _refresh_elastic_health(es, url, logger):
+    try:
+        _check_elastic_health(es, url, logger)
+    except elasticsearch.exceptions.TransportError as e:
+        logger.error(f"Elasticsearch does not seem to be working on {url}: {e!r}")
+        with _elastic_lock:
+            _elastic_health[url] = {"health": {"status": "red"},
+                                    "checked_at": time.monotonic(), "refreshing": False}
+    finally:
+        # whatever happened, the next stale read must be able to refresh the health again
+        with _elastic_lock:
+            if url in _elastic_health:
+                _elastic_health[url]["refreshing"] = False
+
+
+def get_elastic_health():
+    """Returns the last known health of the elasticsearch cluster, or None if unknown"""
+    entry = _elastic_health.get(current_app.config["SEARCH_CONF"]["url"])
+    return entry["health"] if entry else None
+
+
+def get_elastic_client():
+    """
+    Returns the elasticsearch client you can use to search and insert / delete data.
+
+    A single client, with its pool of persistent connections, is shared by the
+    whole process. The health of the cluster is checked on first use, then
+    refreshed in the background once it is older than `SEARCH_CONF["health_ttl"]`
+    seconds, so operations don't wait on health checks.
+
+    The client is returned even if the cluster can't be reached: operations
+    then fail and are handled by the circuit breaker of `archivy.search`.
+    """
+    conf = current_app.config["SEARCH_CONF"]
+    if not conf["enabled"] and conf.get("engine") != "elasticsearch":
+        return None
+
+    url = conf["url"]
+    with _elastic_lock:
+        es = _elastic_clients.get(url)
+        if es is None:
+            es = _elastic_clients[url] = Elasticsearch(url)
+        entry = _elastic_health.get(url)
+        refresh = (entry is not None and not entry["refreshing"]
+                   and time.monotonic() - entry["checked_at"] > conf.get("health_ttl", 30))
+        if refresh:
+            entry["refreshing"] = True
+
+    if entry is None:
+        try:
+            _check_elastic_health(es, url, current_app.logger)
+        except elasticsearch.exceptions.ConnectionError:
+            current_app.logger.error(
+                "Elasticsearch does not seem to be running on "
+                f"{url}. Please start "
+                "it, for example with: sudo service elasticsearch restart"
+            )
+            current_app.logger.error(
+                "You can disable Elasticsearch by modifying the `enabled` variable "
+                f"in {str(Path(current_app.config['INTERNAL_DIR']) / 'config.yml')}"
+            )
+            with _elastic_lock:
+                _elastic_health[url] = {"health": {"status": "red"},
+                                        "checked_at": time.monotonic(), "refreshing": False}
+    elif refresh:
+        threading.Thread(target=_refresh_elastic_health, daemon=True,
+                         args=(es, url, current_app.logger)).start()
     return es
@@ -0,0 +1,113 @@
+import os
+import pickle
+import tempfile
+import threading
+from pathlib import Path
+
+import frontmatter
+from flask import current_app
+
+from archivy import yaml_codec
+
+
+# caches already loaded by this process, by path of their cache file
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class MetadataCache:
+    """
+    Cache of the parsed frontmatter of dataobjs, stored as a pickle file in `INTERNAL_DIR`.
+
+    Entries are keyed by the path of the file and are only used if the modification
+    time and size of the file haven't changed, so files are only parsed again
+    once they are modified.
+
+    Its methods don't use the flask app context, so they can be called from the
+    worker threads used to scan the data dir.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.dirty = False
+        try:
+            with self.path.open("rb") as f:
+                self.entries = pickle.load(f)
+        except Exception:
+            # a missing, truncated or corrupt cache is simply rebuilt, and unpickling
+            # can raise almost anything on bad data
+            self.entries = {}
+        if not isinstance(self.entries, dict):
+            self.entries = {}
+
+    def _cached_metadata(self, filename):
+        stat = os.stat(filename)
+        entry = self.entries.get(str(filename))
+        if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            return dict(entry[2]), stat
+        return None, stat
+
+    def _store(self, filename, stat, metadata):
+        with self.lock:
+            self.entries[str(filename)] = (stat.st_mtime_ns, stat.st_size, dict(metadata))
+            self.dirty = True
+
+    def load(self, filename, metadata_only=False):
+        """
+        Returns the dataobj at `filename`, as a `frontmatter.Post`, or as a dict
+        of its metadata if `metadata_only` is set.
+        """
+        from archivy.data import load_metadata, split_content
+        metadata, stat = self._cached_metadata(filename)
+        if metadata_only:
+            if metadata is None:
+                metadata = load_metadata(filename)
+                self._store(filename, stat, metadata)
+            return metadata
+
+        if metadata is not None:
+            with open(filename, encoding="utf-8") as f:
+                content = split_content(f.read())
+            if content is not None:
+                post = frontmatter.Post(content)
+                post.metadata.update(metadata)
+                return post
+        post = yaml_codec.load(filename)
+        self._store(filename, stat, post.metadata)
+        return post
+
+    def prune(self, filenames):
+        """Drops the entries of files that are not part of `filenames`"""
+        keep = {str(filename) for filename in filenames}
+        with self.lock:
+            for key in list(self.entries):
+                if key not in keep:
+                    del self.entries[key]
+                    self.dirty = True
+
+    def save(self):
+        """Writes the cache back to disk if it was modified"""
+        with self.lock:
+            if not self.dirty:
+                return
+            # a unique temporary file, as the server and the cli may save at the same time
+            with tempfile.NamedTemporaryFile(dir=str(self.path.parent), prefix=self.path.name,
+                                             suffix=".tmp", delete=False) as f:
+                try:
+                    pickle.dump(self.entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+                except Exception:
+                    f.close()
+                    os.unlink(f.name)
+                    raise
+            os.replace(f.name, str(self.path))
+            self.dirty = False
+
+
+def get_metadata_cache():
+    """Returns the metadata cache of the current `INTERNAL_DIR`"""
+    path = str(Path(current_app.config["INTERNAL_DIR"]) / "metadata_cache.pickle")
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = MetadataCache(path)
+        return _caches[path]
@@ -14,8 +14,9 @@ from html2text import html2text
 from tinydb import Query
 from werkzeug.security import generate_password_hash
 
-from archivy import helpers
-from archivy.data import create
+from archivy import helpers, yaml_codec
+from archivy.data import create, track_dataobj
+from archivy.duplicates import find_duplicates
 from archivy.search import add_to_index
 
 
@@ -88,6 +89,8 @@ class DataObj:
     path: str = attrib(validator=instance_of(str), default="")
     fullpath: Optional[str] = attrib(validator=optional(instance_of(str)),
                                      default=None)
+    # dataobjs that are likely duplicates of a new bookmark, set by `insert`
+    duplicates: List[dict] = attrib(factory=list)
 
     def process_bookmark_url(self):
         """Process url to get content for bookmark"""
@@ -191,11 +194,14 @@ class DataObj:
             dataobj = frontmatter.Post(self.content)
             dataobj.metadata = data
             self.fullpath = create(
-                                frontmatter.dumps(dataobj),
+                                yaml_codec.dumps(dataobj),
                                 str(self.id) + "-" +
                                 dataobj["date"] + "-" + dataobj["title"],
                                 path=self.path,
                                 )
+            track_dataobj(self.fullpath, data)
+            if self.type in ("bookmark", "pocket_bookmark"):
+                self.duplicates = find_duplicates(self)
 
             hooks.on_dataobj_create(self)
             self.index()
@@ -217,7 +223,11 @@ class DataObj:
 
         ```
         """
-        data = frontmatter.loads(md_content)
+        return cls.from_post(yaml_codec.loads(md_content))
+
+    @classmethod
+    def from_post(cls, data: frontmatter.Post):
+        """Class method to generate new dataobj from a parsed `frontmatter.Post`"""
         dataobj = {}
         dataobj["content"] = data.content
         for pair in ["tags", "desc", "id", "title", "path"]:
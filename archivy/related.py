@@ -0,0 +1,409 @@
+import os
+import threading
+import time
+from collections import Counter
+
+from flask import current_app
+
+from archivy.search.embedded import FIELD_WEIGHTS, tokenize
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    # related notes are an optional feature, installed with `pip install archivy[related]`
+    np = sparse = None
+
+
+# fields of dataobjs used to compare them
+FIELDS = ("title", "tags", "content")
+# number of related dataobjs shown by default
+RELATED_LIMIT = 5
+# number of dataobjs whose similarities are computed in a single matrix product
+BATCH_SIZE = 64
+# added and edited dataobjs go to a small matrix of recent changes, which is
+# merged into the main one once it holds more than this share of the dataobjs
+TAIL_RATIO = 0.05
+MIN_TAIL_SIZE = 256
+# the main matrix is also rebuilt once this share of its rows were removed or replaced
+MAX_DEAD_RATIO = 0.25
+
+# indexes already built by this process, by data dir
+_indexes = {}
+_indexes_lock = threading.Lock()
+# held while an index is built or refreshed in the background
+_build_lock = threading.Lock()
+
+
+def is_available():
+    """Returns whether numpy and scipy are installed, which related notes need"""
+    return np is not None
+
+
+class _Segment:
+    """
+    Log term frequencies of some dataobjs as a sparse matrix with a row per
+    dataobj, along with its transpose, which similarities are computed with.
+
+    Rows of dataobjs that were removed or edited since are masked rather than
+    deleted, so the matrix never has to be rebuilt for a single change.
+    """
+
+    def __init__(self, ids, terms, num_terms):
+        self.ids = np.array(ids, dtype=np.int64)
+        self.rows = {dataobj_id: row for row, dataobj_id in enumerate(ids)}
+        self.dead = 0
+        columns = [terms[dataobj_id][0] for dataobj_id in ids]
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(row) for row in columns])
+        indices = np.concatenate(columns) if columns else np.zeros(0, dtype=np.int64)
+        data = np.log1p(np.concatenate([terms[dataobj_id][1] for dataobj_id in ids])) \
+            if ids else np.zeros(0)
+        self.num_terms = num_terms
+        matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(ids), num_terms))
+        self.squares = sparse.csr_matrix((data ** 2, indices, indptr), shape=matrix.shape)
+        # kept in row format, so products don't convert it on every query
+        self.transposed = matrix.T.tocsr()
+        self.inv_norms = None
+        self.generation = None
+
+    def discard(self, dataobj_id):
+        """Masks the row of the dataobj of given id, if it is part of the segment"""
+        row = self.rows.pop(dataobj_id, None)
+        if row is None:
+            return
+        self.ids[row] = -1
+        if self.inv_norms is not None:
+            self.inv_norms[row] = 0
+        self.dead += 1
+
+    def update_norms(self, weights, generation):
+        """Computes the inverse norms of the rows weighted by `weights`, if they changed"""
+        if self.generation == generation:
+            return
+        norms = np.sqrt(self.squares.dot(weights[:self.num_terms]))
+        self.inv_norms = np.zeros(len(norms))
+        alive = (norms > 0) & (self.ids >= 0)
+        self.inv_norms[alive] = 1 / norms[alive]
+        self.generation = generation
+
+    def scores(self, queries):
+        """
+        Returns the cosine similarities of the normalized weighted `queries`
+        with the rows of the segment, as a sparse matrix.
+        """
+        if queries.shape[1] > self.num_terms:
+            # terms added since the segment was built appear in none of its rows
+            queries = queries[:, :self.num_terms]
+        scores = queries.dot(self.transposed).tocsr()
+        scores.data *= self.inv_norms[scores.indices]
+        return scores
+
+
+class RelatedIndex:
+    """
+    TF-IDF vectors of the dataobjs of a data dir, used to find the dataobjs most
+    similar to a given one.
+
+    The term frequencies of each dataobj are kept as numpy arrays and are only
+    recomputed when the dataobj changes. They are assembled into scipy sparse
+    matrices of log term frequencies: a main one, and a small one of the
+    dataobjs added or edited since, which is merged into the main one once it
+    grows. Single changes thus only rebuild the small matrix. Inverse document
+    frequencies and row norms are applied as scalings when similarities are
+    computed, so they don't require rebuilding the matrices either. The cosine
+    similarities of a batch of dataobjs with all others are then a single
+    sparse matrix product per matrix.
+
+    The index is built from the data dir in the background the first time it
+    is needed, then kept up to date by archivy, and files changed by other
+    programs are picked up in the background at most every
+    `TREE_CHECK_INTERVAL` seconds, so pages never wait for the data dir to be
+    read.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.lock = threading.RLock()
+        # term -> column of the matrices
+        self.vocabulary = {}
+        # number of dataobjs in which the term of each column appears
+        self.document_frequencies = np.zeros(1024, dtype=np.int64)
+        # dataobj id -> columns and weighted frequencies of its terms
+        self.terms = {}
+        # dataobj id -> title, path and stat of its file
+        self.docs = {}
+        self.paths = {}
+        # main matrix, and matrix of the dataobjs changed since it was built
+        self.base = None
+        self.tail = None
+        self.tail_ids = {}
+        # squared inverse document frequencies, and a counter of their changes
+        self.weights = None
+        self.generation = 0
+        # when the data dir was last compared with the index, None until built
+        self.checked_at = None
+
+    def _columns(self, terms):
+        columns = [self.vocabulary.setdefault(term, len(self.vocabulary)) for term in terms]
+        size = len(self.document_frequencies)
+        if len(self.vocabulary) > size:
+            self.document_frequencies = np.concatenate([
+                self.document_frequencies,
+                np.zeros(max(size, len(self.vocabulary) - size), dtype=np.int64)])
+        return np.array(columns, dtype=np.int64)
+
+    def add(self, dataobj_id, fields, filename=None):
+        """
+        Computes the term frequencies of the dataobj of given id. `fields` is a
+        dict with its title, tags and content.
+        """
+        frequencies = Counter()
+        for field in FIELDS:
+            value = fields.get(field) or ""
+            if isinstance(value, (list, tuple)):
+                value = " ".join(str(item) for item in value)
+            for term in tokenize(value):
+                frequencies[term] += FIELD_WEIGHTS[field]
+
+        stat = None
+        if filename is not None:
+            try:
+                stat = os.stat(filename)
+                stat = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                pass
+
+        with self.lock:
+            self.remove(dataobj_id)
+            columns = self._columns(frequencies)
+            self.terms[dataobj_id] = (columns, np.array(list(frequencies.values()), dtype=float))
+            self.document_frequencies[columns] += 1
+            self.docs[dataobj_id] = {
+                "title": fields.get("title"),
+                "path": str(filename) if filename is not None else None,
+                "stat": stat,
+            }
+            if filename is not None:
+                self.paths[str(filename)] = dataobj_id
+            self.tail_ids[dataobj_id] = None
+            self.tail = None
+            self.weights = None
+
+    def remove(self, dataobj_id):
+        """Removes the dataobj of given id from the index"""
+        with self.lock:
+            doc = self.docs.pop(dataobj_id, None)
+            if doc is None:
+                return
+            columns, _ = self.terms.pop(dataobj_id)
+            self.document_frequencies[columns] -= 1
+            if self.paths.get(doc["path"]) == dataobj_id:
+                del self.paths[doc["path"]]
+            if dataobj_id in self.tail_ids:
+                del self.tail_ids[dataobj_id]
+                self.tail = None
+            elif self.base is not None:
+                self.base.discard(dataobj_id)
+            self.weights = None
+
+    def stale(self):
+        """Returns whether the data dir should be compared with the index again"""
+        return self.checked_at is None or \
+            time.monotonic() - self.checked_at >= current_app.config["TREE_CHECK_INTERVAL"]
+
+    def refresh(self):
+        """
+        Reads the files of the data dir that changed since they were last read.
+
+        The lock of the index is only held to apply the changes, so the index
+        can be queried while the data dir is scanned.
+        """
+        from archivy.data import file_changes, map_files
+        from archivy.metadata_cache import get_metadata_cache
+
+        with self.lock:
+            if not self.stale():
+                return
+            self.checked_at = time.monotonic()
+            stats = {path: self.docs[dataobj_id]["stat"]
+                     for path, dataobj_id in self.paths.items()}
+
+        changed, deleted = file_changes(stats)
+        with self.lock:
+            for path in deleted:
+                if path in self.paths:
+                    self.remove(self.paths[path])
+
+        cache = get_metadata_cache()
+        for filename, post in zip(changed, map_files(cache.load, changed)):
+            if "id" in post.metadata:
+                self.add(post["id"], dict(post.metadata, content=post.content), filename)
+        cache.save()
+
+    def _segments(self):
+        base_size = len(self.base.ids) if self.base is not None else 0
+        if self.base is None or self.base.dead > MAX_DEAD_RATIO * base_size or \
+                len(self.tail_ids) > max(MIN_TAIL_SIZE, TAIL_RATIO * base_size):
+            self.base = _Segment(list(self.terms), self.terms, len(self.document_frequencies))
+            self.tail_ids = {}
+            self.tail = None
+        elif self.tail is None and self.tail_ids:
+            self.tail = _Segment(list(self.tail_ids), self.terms,
+                                 len(self.document_frequencies))
+        if self.weights is None:
+            # smoothed inverse document frequencies, squared as they weight both vectors
+            num_docs = len(self.terms)
+            idf = np.log((1 + num_docs) / (1 + self.document_frequencies)) + 1
+            self.weights = idf ** 2
+            self.generation += 1
+        segments = [segment for segment in (self.base, self.tail)
+                    if segment is not None and len(segment.ids)]
+        for segment in segments:
+            segment.update_norms(self.weights, self.generation)
+        return segments
+
+    def _queries(self, dataobj_ids):
+        """Returns the normalized tf-idf vectors of the dataobjs, weighted once more by idf"""
+        columns = [self.terms[dataobj_id][0] for dataobj_id in dataobj_ids]
+        indptr = np.zeros(len(columns) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(row) for row in columns])
+        indices = np.concatenate(columns)
+        data = np.log1p(np.concatenate([self.terms[dataobj_id][1]
+                                        for dataobj_id in dataobj_ids]))
+        weighted = sparse.csr_matrix((data * self.weights[indices], indices, indptr),
+                                     shape=(len(dataobj_ids), len(self.document_frequencies)))
+        norms = np.sqrt(np.asarray(weighted.multiply(
+            sparse.csr_matrix((data, indices, indptr), shape=weighted.shape)).sum(axis=1)))
+        return sparse.diags(np.divide(1, norms.ravel(), out=np.zeros(len(norms)),
+                                      where=norms.ravel() > 0)).dot(weighted).tocsr()
+
+    def related(self, dataobj_ids, limit=RELATED_LIMIT):
+        """
+        Returns a dict mapping each of `dataobj_ids` to the `limit` dataobjs most
+        similar to it, as dicts with their `id`, `title` and cosine `score`, most
+        similar first. Dataobjs that share no terms are left out.
+        """
+        with self.lock:
+            segments = self._segments()
+            related = {dataobj_id: [] for dataobj_id in dataobj_ids}
+            known = [dataobj_id for dataobj_id in dataobj_ids if dataobj_id in self.terms]
+            for start in range(0, len(known), BATCH_SIZE):
+                batch = known[start:start + BATCH_SIZE]
+                queries = self._queries(batch)
+                scores = [(segment.ids, segment.scores(queries)) for segment in segments]
+                for i, dataobj_id in enumerate(batch):
+                    ids = np.concatenate([segment_ids[matrix.indices[
+                        matrix.indptr[i]:matrix.indptr[i + 1]]]
+                        for segment_ids, matrix in scores] or [np.zeros(0, dtype=np.int64)])
+                    values = np.concatenate([matrix.data[matrix.indptr[i]:matrix.indptr[i + 1]]
+                                             for _, matrix in scores] or [np.zeros(0)])
+                    related[dataobj_id] = self._top(ids, values, dataobj_id, limit)
+            return related
+
+    def _top(self, ids, values, dataobj_id, limit):
+        # masked rows have no norm, so a score of 0
+        keep = (ids != dataobj_id) & (values > 0)
+        ids, values = ids[keep], values[keep]
+        if len(values) > limit:
+            best = np.argpartition(-values, limit)[:limit]
+            ids, values = ids[best], values[best]
+        order = np.argsort(-values, kind="stable")
+        return [{"id": int(related_id), "title": self.docs[int(related_id)]["title"],
+                 "score": round(float(value), 3)}
+                for related_id, value in zip(ids[order], values[order])]
+
+
+def get_related_index(build=True):
+    """
+    Returns the related notes index of the current data dir, building or
+    refreshing it first if `build` is set. Returns None if `build` isn't set and
+    the index wasn't built yet, or if numpy and scipy aren't installed.
+    """
+    from archivy.data import get_data_dir
+    if not is_available():
+        return None
+    data_dir = get_data_dir()
+    with _indexes_lock:
+        index = _indexes.get(str(data_dir))
+        if index is None:
+            if not build:
+                return None
+            index = _indexes[str(data_dir)] = RelatedIndex(data_dir)
+    if build:
+        index.refresh()
+    return index
+
+
+def refresh_in_background():
+    """
+    Builds the related notes index of the current data dir in a background
+    thread, or refreshes it if it was built, unless this is already running.
+    Returns the thread, or None if none was started.
+
+    A new index is only used once built, and changes made meanwhile are
+    picked up by its next refresh.
+    """
+    from archivy.data import get_data_dir
+    app = current_app._get_current_object()
+    data_dir = get_data_dir()
+
+    def run():
+        with app.app_context():
+            try:
+                with _indexes_lock:
+                    index = _indexes.get(str(data_dir))
+                if index is not None:
+                    index.refresh()
+                    return
+                index = RelatedIndex(data_dir)
+                index.refresh()
+                with _indexes_lock:
+                    _indexes.setdefault(str(data_dir), index)
+            except Exception as e:
+                app.logger.warning(f"Failed to read the data dir for related notes: {e!r}")
+            finally:
+                _build_lock.release()
+
+    # only one build or refresh at a time
+    if _build_lock.acquire(blocking=False):
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+    return None
+
+
+def get_related(dataobj_ids, limit=RELATED_LIMIT):
+    """
+    Returns the dataobjs most similar to each of the dataobjs of given ids, in
+    the format of `RelatedIndex.related`, or None if numpy and scipy aren't
+    installed or the index is still being built.
+
+    The index is built and refreshed in the background, so the results don't
+    include files changed by other programs until it is refreshed.
+    """
+    if not is_available():
+        return None
+    index = get_related_index(build=False)
+    if index is None or index.stale():
+        refresh_in_background()
+    if index is None:
+        return None
+    return index.related([int(dataobj_id) for dataobj_id in dataobj_ids], limit)
+
+
+def track(filename, metadata):
+    """Updates the vectors of the dataobj at `filename`, if the index was built"""
+    from archivy.metadata_cache import get_metadata_cache
+    index = get_related_index(build=False)
+    if index is None or "id" not in metadata:
+        return
+    post = get_metadata_cache().load(filename)
+    index.add(int(metadata["id"]), dict(post.metadata, content=post.content), filename)
+
+
+def untrack(dataobj_id):
+    """Removes the dataobj of given id, if the index was built"""
+    index = get_related_index(build=False)
+    if index is not None:
+        index.remove(int(dataobj_id))
@@ -1,24 +1,25 @@
 import os
 
-import frontmatter
 from flask import render_template, flash, redirect, request, url_for
 from flask_login import login_user, login_required, current_user, logout_user
 from tinydb import Query
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from archivy.models import DataObj, User
-from archivy import data, app, forms
+from archivy import data, app, forms, related, yaml_codec
 from archivy.helpers import get_db
+from archivy.search import get_engine_name
 
 
 @app.context_processor
 def pass_defaults():
-    dataobjs = data.get_items()
+    # only the root folder is rendered, subfolders are loaded when expanded
+    root_folder = data.get_folder()
     SEP = os.path.sep
     # check windows parsing for js (https://github.com/Uzay-G/archivy/issues/115)
     if SEP == "\\":
         SEP += "\\"
-    return dict(dataobjs=dataobjs, SEP=os.path.sep)
+    return dict(root_folder=root_folder, SEP=os.path.sep)
 
 
 @app.before_request
@@ -37,7 +38,7 @@ def index():
     return render_template(
             "home.html",
             title="Home",
-            search_enabled=app.config["SEARCH_CONF"]["enabled"],
+            search_enabled=get_engine_name() is not None,
             )
 
 
@@ -59,6 +60,9 @@ def new_bookmark():
         bookmark_id = bookmark.insert()
         if bookmark_id:
             flash("Bookmark Saved!")
+            for duplicate in bookmark.duplicates:
+                flash(f"This bookmark looks like a duplicate of \"{duplicate['title']}\" "
+                      f"(id {duplicate['id']})")
             return redirect(f"/dataobj/{bookmark_id}")
     return render_template(
         "dataobjs/new.html",
@@ -98,12 +102,16 @@ def show_dataobj(dataobj_id):
         return redirect("/")
 
     if request.args.get("raw") == "1":
-        return frontmatter.dumps(dataobj)
+        return yaml_codec.dumps(dataobj)
 
+    # None if numpy and scipy aren't installed or the index isn't built yet,
+    # which hides the panel
+    related_dataobjs = related.get_related([dataobj["id"]])
     return render_template(
         "dataobjs/show.html",
         title=dataobj["title"],
         dataobj=dataobj,
+        related=related_dataobjs[int(dataobj["id"])] if related_dataobjs else None,
         form=forms.DeleteDataForm())
 
 
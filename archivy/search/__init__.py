@@ -0,0 +1,263 @@
+import sqlite3
+import threading
+
+import elasticsearch
+from flask import current_app
+
+from archivy.search.base import (FACETS, SearchBackend, count_facets,  # noqa: F401
+                                 filtered_ids)
+from archivy.search.breaker import SearchUnavailable, get_breaker
+from archivy.search.cache import get_query_cache, normalize_query
+from archivy.search.elastic import ElasticsearchBackend
+from archivy.search.embedded import EmbeddedBackend
+from archivy.search.queue import get_index_queue
+from archivy.search.spool import has_spooled, replay, spool
+from archivy.search.sqlite import SQLiteBackend
+from archivy.titles import get_trigram_index
+
+
+# search engines that can be selected with `SEARCH_CONF["engine"]`
+BACKENDS = {
+    ElasticsearchBackend.name: ElasticsearchBackend,
+    EmbeddedBackend.name: EmbeddedBackend,
+    SQLiteBackend.name: SQLiteBackend,
+}
+
+
+def get_engine_name():
+    """
+    Returns the name of the configured search engine, or None if search is disabled.
+
+    `SEARCH_CONF["engine"]` takes precedence. Otherwise elasticsearch is used if
+    it is enabled, and the built-in engine if `SEARCH_CONF["embedded"]` is set.
+    """
+    conf = current_app.config["SEARCH_CONF"]
+    if conf.get("engine"):
+        return conf["engine"]
+    if conf["enabled"]:
+        return ElasticsearchBackend.name
+    if conf.get("embedded", 1):
+        return EmbeddedBackend.name
+    return None
+
+
+def get_search_backend():
+    """Returns the `SearchBackend` of the configured engine, or None if search is disabled"""
+    name = get_engine_name()
+    if name is None:
+        return None
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown search engine {name}. Available: {', '.join(BACKENDS)}")
+    return backend(current_app.config["SEARCH_CONF"])
+
+
+def is_outage(error):
+    """
+    Returns whether `error` means that the search engine is unreachable or
+    failing, as opposed to a bug or invalid input, which the engine isn't to blame for.
+    """
+    if isinstance(error, elasticsearch.exceptions.ConnectionError):
+        # includes timeouts
+        return True
+    if isinstance(error, elasticsearch.exceptions.TransportError):
+        return isinstance(error.status_code, int) and error.status_code >= 500
+    # sqlite3 reports locked or unreadable databases as operational errors, and
+    # other backends are expected to raise the builtin connection and timeout errors
+    return isinstance(error, (sqlite3.OperationalError, ConnectionError, TimeoutError))
+
+
+def _call(backend, operation, *args):
+    """
+    Calls `operation` of `backend` through the circuit breaker of the engine.
+
+    Returns `(True, result)` if it succeeded, or `(False, None)` if the engine
+    failed or the circuit is open. Only errors for which `is_outage` is true
+    count as failures of the engine, others are raised. Operations spooled
+    while the engine was unreachable are replayed in the background once a call succeeds.
+    """
+    breaker = get_breaker(backend.name, current_app.config["SEARCH_CONF"])
+    if not breaker.allow():
+        return False, None
+    try:
+        result = operation(*args)
+    except Exception as e:
+        if not is_outage(e):
+            raise
+        breaker.failure()
+        current_app.logger.warning(f"Search engine {backend.name} failed: {e!r}")
+        return False, None
+    breaker.success()
+    if has_spooled():
+        _replay_in_background(current_app._get_current_object())
+    return True, result
+
+
+_replay_lock = threading.Lock()
+
+
+def _replay_in_background(app):
+    def run():
+        with app.app_context():
+            try:
+                replay(get_search_backend())
+                invalidate_query_cache()
+            except Exception as e:
+                app.logger.warning(f"Failed to replay spooled search operations: {e!r}")
+            finally:
+                _replay_lock.release()
+
+    # only one replay at a time
+    if _replay_lock.acquire(blocking=False):
+        threading.Thread(target=run, daemon=True).start()
+
+
+def invalidate_query_cache():
+    """Discards cached search results, after the index changed"""
+    backend = get_search_backend()
+    get_query_cache(current_app.config["SEARCH_CONF"]).invalidate(
+        backend.refresh_delay if backend else 0)
+
+
+def add_to_index(model):
+    """
+    Adds dataobj to the search index. If object of given id already exists, it will be updated.
+
+    If the search engine is unreachable, the dataobj is spooled and indexed once
+    the engine is back.
+
+    Params:
+
+    - **model** - Instance of `archivy.models.Dataobj`, the object you want to index.
+    """
+    backend = get_search_backend()
+    if not backend:
+        return
+    invalidate_query_cache()
+    if current_app.config["SEARCH_CONF"].get("async_indexing"):
+        get_index_queue().put(model.id, "index", model)
+        return True
+    ok, result = _call(backend, backend.index, model)
+    if not ok:
+        spool("index", model.id)
+        return True
+    # searches that ran during the write may have been cached
+    invalidate_query_cache()
+    return result
+
+
+def remove_from_index(dataobj_id):
+    """Removes object of given id"""
+    backend = get_search_backend()
+    if not backend:
+        return
+    invalidate_query_cache()
+    if current_app.config["SEARCH_CONF"].get("async_indexing"):
+        get_index_queue().put(dataobj_id, "delete")
+        return
+    ok, _ = _call(backend, backend.delete, dataobj_id)
+    if not ok:
+        spool("delete", dataobj_id)
+        return
+    # searches that ran during the write may have been cached
+    invalidate_query_cache()
+
+
+def search_index(query, page=1, size=10, after=None, snippet_size=None, filters=None,
+                 facets=False, fuzzy=None):
+    """
+    Returns a page of search results for your given query, as a dict with the
+    `hits`, the `total` number of results, the `page` and `size`, and a `next`
+    cursor to pass as `after` to get the next page (see `SearchBackend.search`).
+
+    If `facets` is set, the counts of the tags, types, top-level folders and
+    months of all results are returned as `facets`. Results can be narrowed down
+    by passing some of these values as `filters`, eg.
+    `{"tags": ["python"], "date": ["2021-03"]}`.
+
+    If `fuzzy` is set, or `SEARCH_CONF["fuzzy"]` by default, typos in the query
+    are tolerated: engines that support it match words close to the terms of
+    the query, and searches with other engines that find nothing return the
+    dataobjs whose title and tags are most similar to the query (see
+    `fuzzy_search`).
+
+    `page` is ignored if `after` is given: cursors are cheaper than page numbers
+    for deep pages, as the results of previous pages don't need to be skipped.
+    Raises ValueError if `after` isn't a cursor of the search engine.
+
+    Results are cached for `SEARCH_CONF["cache_ttl"]` seconds, until the next
+    write to the index.
+
+    If the search engine is unreachable, the built-in engine is used instead,
+    unless `SEARCH_CONF["fallback"]` is disabled, in which case
+    `SearchUnavailable` is raised.
+    """
+    if after is not None:
+        page = None
+    if fuzzy is None:
+        fuzzy = bool(current_app.config["SEARCH_CONF"].get("fuzzy", 0))
+    backend = get_search_backend()
+    if not backend:
+        return {"hits": [], "total": 0, "page": page, "size": size, "next": None}
+    if after is not None:
+        # checked before calling the engine, whose failures would count against it
+        backend.decode_cursor(after)
+    cache = get_query_cache(current_app.config["SEARCH_CONF"])
+    filters = {facet: sorted(values) for facet, values in (filters or {}).items() if values}
+    key = (backend.name, current_app.config["USER_DIR"], normalize_query(query),
+           page, size, after, snippet_size, tuple(sorted(
+               (facet, tuple(values)) for facet, values in filters.items())), facets, fuzzy)
+    results = cache.get(key)
+    if results is not None:
+        return results
+    generation = cache.current_generation()
+    options = {"size": size, "offset": (page - 1) * size if page else 0, "after": after,
+               "snippet_size": snippet_size, "filters": filters, "facets": facets,
+               "fuzzy": fuzzy}
+    ok, results = _call(backend, lambda: backend.search(query, **options))
+    if not ok:
+        if backend.name == EmbeddedBackend.name or \
+                not current_app.config["SEARCH_CONF"].get("fallback", 1):
+            raise SearchUnavailable(f"Search engine {backend.name} is unavailable")
+        # cursors of another engine mean nothing to the built-in one
+        if after is not None:
+            options.update(after=None, offset=0)
+        backend = EmbeddedBackend(current_app.config["SEARCH_CONF"])
+        results = backend.search(query, **options)
+    if fuzzy and not backend.fuzzy and not results["hits"] and page == 1:
+        results = fuzzy_search(query, size, filters, facets)
+    results = dict(results, page=page, size=size)
+    if ok:
+        cache.put(key, results, generation)
+    return results
+
+
+def fuzzy_search(query, size=10, filters=None, facets=False):
+    """
+    Returns the dataobjs whose title and tags are most similar to `query`,
+    in the format of `search_index`, despite typos.
+
+    They are looked up in the trigram index of `archivy.titles`, which only
+    reads the dataobjs sharing trigrams with the query. Results are a single
+    page, and each hit has the `similarity` of the dataobj to the query.
+    """
+    matches = get_trigram_index().search(query, limit=size, ids=filtered_ids(filters))
+    results = {
+        "hits": [dict(match, id=str(match["id"])) for match in matches],
+        "total": len(matches),
+        "next": None,
+        "fuzzy": True,
+    }
+    if facets:
+        results["facets"] = count_facets(match["id"] for match in matches)
+    return results
+
+
+def query_index(query):
+    """
+    Returns the first page of search results for your given query.
+
+    See `search_index` for caching and the handling of unreachable engines.
+    """
+    return search_index(query)["hits"]
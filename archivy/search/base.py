@@ -0,0 +1,191 @@
+import base64
+import json
+from contextlib import contextmanager
+
+
+def encode_cursor(values):
+    """Encodes the sort values of the last hit of a page into an opaque cursor"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, offset=False):
+    """
+    Decodes a cursor made by `encode_cursor`, which must hold the `[score, id]`
+    of the last hit of a page, or the offset of the next page if `offset` is set.
+    Raises ValueError if it is invalid, so that malformed cursors sent by
+    clients aren't mistaken for failures of the search engine.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (AttributeError, TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+    if offset:
+        valid = _is_int(values) and values >= 0
+    else:
+        valid = isinstance(values, list) and len(values) == 2 and \
+            (_is_int(values[0]) or isinstance(values[0], float)) and _is_int(values[1])
+    if not valid:
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return values
+
+
+def _is_int(value):
+    # booleans are ints in python, but not in json
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+#: facets returned with search results, which can also be used to filter them
+FACETS = ("tags", "type", "folder", "date")
+
+
+def filtered_ids(filters):
+    """
+    Returns the ids of the dataobjs matching the facet `filters`, looked up in
+    the catalog, or None if there are no filters.
+
+    `filters` maps facets to lists of values. Dataobjs must have all of the
+    `tags`, and one of the values of each other facet.
+    """
+    from archivy import catalog
+    filters = {facet: values for facet, values in (filters or {}).items() if values}
+    if not filters:
+        return None
+    return set(catalog.find(
+        tags=filters.get("tags", []),
+        types=filters.get("type", []),
+        folders=filters.get("folder", []),
+        months=filters.get("date", []),
+    ))
+
+
+def count_facets(dataobj_ids):
+    """Returns the facets of the dataobjs of given ids, counted in the catalog"""
+    from archivy import catalog
+    return catalog.facets(dataobj_ids)
+
+
+class SearchBackend:
+    """
+    Interface of the search engines archivy can index dataobjs into.
+
+    Backends are selected with `SEARCH_CONF["engine"]` and registered in
+    `archivy.search.BACKENDS`. They are created with the `SEARCH_CONF` dict
+    and are used within the flask app context.
+    """
+
+    #: name used to select the backend in `SEARCH_CONF["engine"]`
+    name = None
+    #: whether `search` tolerates typos itself when `fuzzy` is set. Otherwise,
+    #: `archivy.search.search_index` looks for similar titles and tags when
+    #: fuzzy searches find nothing.
+    fuzzy = False
+    #: whether the cursors returned by `search` hold the offset of the next page,
+    #: like those of the default implementation, rather than the `[score, id]`
+    #: of the last hit of the page
+    offset_cursors = True
+    #: seconds after which writes show up in search results, during which the
+    #: results of searches aren't cached
+    refresh_delay = 0
+
+    def __init__(self, conf):
+        self.conf = conf
+
+    def init_index(self):
+        """Creates the index if it doesn't exist yet. Called when archivy starts."""
+
+    def index(self, dataobj):
+        """
+        Adds the `archivy.models.DataObj` to the index, or updates it if a dataobj
+        of the same id is already indexed. Returns whether it succeeded.
+        """
+        raise NotImplementedError
+
+    def bulk_index(self, dataobjs, chunk_size=500, workers=1):
+        """
+        Indexes an iterable of dataobjs and returns the list of the ids of those
+        that were indexed, so callers can tell which ones failed.
+
+        Backends that support it send the dataobjs in requests or transactions of
+        `chunk_size` dataobjs, using up to `workers` threads.
+        """
+        return [int(dataobj.id) for dataobj in dataobjs if self.index(dataobj)]
+
+    @contextmanager
+    def reindexing(self):
+        """
+        Context manager wrapping the `bulk_index` calls of `archivy index`, for
+        backends that can be tuned for large imports while they run.
+        """
+        yield
+
+    def delete(self, dataobj_id):
+        """Removes the dataobj of given id from the index"""
+        raise NotImplementedError
+
+    def query(self, query, limit=10):
+        """
+        Returns the best `limit` results for `query`, as a list of dicts with the
+        `id` and `title` of each dataobj and, if its content matched, a `highlight`
+        list of the matching parts of the content with the matches wrapped in `==`.
+        """
+        return self.search(query, size=limit)["hits"]
+
+    def search(self, query, size=10, offset=0, after=None, snippet_size=None,
+               filters=None, facets=False, fuzzy=False):
+        """
+        Returns a page of results for `query`, as a dict with:
+
+        - **hits** - `size` results in the format of `query`, skipping the first
+          `offset` ones, or the ones up to the cursor `after` if it is given.
+        - **total** - total number of results, or None if the backend can't tell.
+        - **next** - cursor to pass as `after` to get the next page, or None if
+          there are no more results.
+        - **facets** - only if `facets` is set, the counts of the values of each
+          of `FACETS` among all results, in the format of `archivy.catalog.facets`.
+
+        If `snippet_size` is set, highlights are made of short parts of the
+        content around the matches, of about `snippet_size` characters each,
+        instead of the whole content.
+
+        `filters` maps facets to the values results must have, see `filtered_ids`.
+
+        `fuzzy` asks backends whose `fuzzy` attribute is set to also match words
+        close to the terms of the query.
+
+        Backends that only implement `query` are paginated by fetching the
+        results of previous pages and skipping them. Their results are filtered
+        after the query, and facets only count the results that were fetched.
+        """
+        if after is not None:
+            offset = self.decode_cursor(after)
+        hits = self.query(query, limit=offset + size + 1)
+        ids = filtered_ids(filters)
+        if ids is not None:
+            hits = [hit for hit in hits if int(hit["id"]) in ids]
+        results = {
+            "hits": hits[offset:offset + size],
+            "total": None,
+            "next": encode_cursor(offset + size) if len(hits) > offset + size else None,
+        }
+        if facets:
+            results["facets"] = count_facets(hit["id"] for hit in hits)
+        return results
+
+    def decode_cursor(self, cursor):
+        """Decodes a cursor returned by `search`. Raises ValueError if it is invalid."""
+        return decode_cursor(cursor, offset=self.offset_cursors)
+
+    def highlight(self, dataobj_id, query, snippet_size=None):
+        """
+        Returns the parts of the content of the dataobj of given id that match
+        `query`, with the matches wrapped in `==`, either the whole content or
+        snippets of about `snippet_size` characters.
+        """
+        raise NotImplementedError
+
+    def health(self):
+        """
+        Returns a dict describing the state of the engine, whose `status` is one
+        of `green`, `yellow` or `red` like elasticsearch's cluster health.
+        """
+        return {"status": "green"}
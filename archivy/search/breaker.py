@@ -0,0 +1,71 @@
+import threading
+import time
+
+
+class SearchUnavailable(Exception):
+    """Raised when the search engine can't be reached and there is no fallback"""
+
+
+class CircuitBreaker:
+    """
+    Stops calling the search engine after `threshold` consecutive failures.
+
+    The circuit then stays open for `timeout` seconds, during which calls are
+    rejected right away. After that, one call is let through to probe the
+    engine: the circuit closes if it succeeds and opens again otherwise.
+    """
+
+    def __init__(self, threshold=3, timeout=30):
+        self.threshold = threshold
+        self.timeout = timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """Returns whether the engine should be called"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.timeout:
+                # let this call probe the engine, and reject the others meanwhile
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def success(self):
+        """Records a successful call. Returns True if the circuit was open."""
+        with self.lock:
+            was_open = self.opened_at is not None
+            self.failures = 0
+            self.opened_at = None
+            return was_open
+
+    def failure(self):
+        """Records a failed call, opening the circuit if needed"""
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
+# circuit breakers of the process, by search engine
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(engine, conf):
+    """Returns the circuit breaker of the search engine named `engine`"""
+    with _breakers_lock:
+        if engine not in _breakers:
+            _breakers[engine] = CircuitBreaker(conf.get("breaker_threshold", 3),
+                                               conf.get("breaker_timeout", 30))
+        return _breakers[engine]
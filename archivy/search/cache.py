@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache:
+    """
+    LRU cache of search results, whose entries expire after `ttl` seconds.
+
+    Every write to the search index bumps a generation counter with
+    `invalidate`, and entries cached before the last write are never returned.
+    Engines that only make writes searchable after a delay pass it to
+    `invalidate`, and results aren't cached until it has passed.
+    """
+
+    def __init__(self, max_size=256, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.settles_at = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached results for `key`, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != self.generation or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, results, generation):
+        """
+        Caches `results` for `key`. `generation` is the value returned by
+        `current_generation` before the search started, so results computed
+        during a write, or before it was searchable, aren't cached.
+        """
+        if self.max_size <= 0 or generation is None:
+            return
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = (generation, time.monotonic() + self.ttl, results)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def current_generation(self):
+        """
+        Returns the generation to pass to `put` for a search starting now, or
+        None while the last write may not be searchable yet.
+        """
+        with self.lock:
+            if time.monotonic() < self.settles_at:
+                return None
+            return self.generation
+
+    def invalidate(self, delay=0):
+        """
+        Marks all cached results as stale, after a write to the index that
+        the engine makes searchable within `delay` seconds.
+        """
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.settles_at = max(self.settles_at, time.monotonic() + delay)
+
+    def stats(self):
+        """Returns the size and hit rate of the cache"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "generation": self.generation,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_query_cache(conf):
+    """Returns the query cache of the process, configured from `SEARCH_CONF`"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = QueryCache(conf.get("cache_size", 256), conf.get("cache_ttl", 60))
+        return _cache
+
+
+def normalize_query(query):
+    """Normalizes case and whitespace, which don't change the results of a search"""
+    return " ".join(str(query).lower().split())
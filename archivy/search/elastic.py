@@ -0,0 +1,251 @@
+from contextlib import contextmanager
+from itertools import islice
+
+import elasticsearch
+from elasticsearch.helpers import parallel_bulk
+from flask import current_app
+
+from archivy.helpers import get_elastic_client, get_elastic_health
+from archivy.search.base import SearchBackend, encode_cursor
+
+
+# fields searched by queries, the other fields being only used for facets
+SEARCHABLE_FIELDS = ["title", "content", "desc", "tags"]
+# keyword fields holding the values of each facet
+FACET_FIELDS = {"tags": "tags.keyword", "type": "type", "folder": "folder", "date": "month"}
+# number of values returned for each facet, and months of the date histogram
+FACET_SIZE = 20
+MAX_MONTHS = 1200
+
+
+class ElasticsearchBackend(SearchBackend):
+    """Search backend storing dataobjs in an elasticsearch index"""
+
+    name = "elasticsearch"
+    fuzzy = True
+    offset_cursors = False
+    # the default refresh interval of elasticsearch indexes
+    refresh_delay = 1
+
+    @property
+    def index_name(self):
+        return self.conf["index_name"]
+
+    def _payloads(self, dataobjs):
+        """
+        Returns the documents of the list of `dataobjs` as plain dicts, which
+        can be sent from threads without an app context.
+
+        Facets are keyword fields filled from the catalog, as dataobjs read back
+        from their files don't carry their type or location. The catalog
+        entries of all the dataobjs are read at once.
+        """
+        from archivy import catalog
+        records = {record["id"]: record for record in
+                   catalog.get_records([int(dataobj.id) for dataobj in dataobjs])}
+        payloads = []
+        for dataobj in dataobjs:
+            payload = {field: getattr(dataobj, field) for field in dataobj.__searchable__}
+            record = records.get(int(dataobj.id))
+            if record:
+                payload.update(type=record["type"], folder=record["folder"],
+                               month=record["month"])
+            payloads.append(payload)
+        return payloads
+
+    def _filters(self, filters):
+        clauses = []
+        for facet, values in (filters or {}).items():
+            if not values:
+                continue
+            if facet == "tags":
+                # dataobjs must have all of the tags
+                clauses.extend({"term": {FACET_FIELDS[facet]: value}} for value in values)
+            else:
+                clauses.append({"terms": {FACET_FIELDS[facet]: values}})
+        return clauses
+
+    def _aggregations(self):
+        aggs = {facet: {"terms": {"field": field, "size": FACET_SIZE}}
+                for facet, field in FACET_FIELDS.items()}
+        # a monthly histogram, in chronological order
+        aggs["date"]["terms"].update(size=MAX_MONTHS, order={"_key": "asc"})
+        return aggs
+
+    def _facets(self, aggregations):
+        return {facet: [{"value": bucket["key"], "count": bucket["doc_count"]}
+                        for bucket in aggregations[facet]["buckets"]]
+                for facet in FACET_FIELDS}
+
+    def init_index(self):
+        es = get_elastic_client()
+        if not es:
+            return
+        try:
+            es.indices.create(index=self.index_name, body=self.conf["search_conf"])
+        except elasticsearch.exceptions.RequestError:
+            current_app.logger.info("Elasticsearch index already created")
+        except elasticsearch.exceptions.ConnectionError:
+            current_app.logger.error("Couldn't create the Elasticsearch index")
+
+    def index(self, dataobj):
+        es = get_elastic_client()
+        if not es:
+            return
+        es.index(index=self.index_name, id=dataobj.id, body=self._payloads([dataobj])[0])
+        return True
+
+    @contextmanager
+    def reindexing(self):
+        """
+        Disables refreshing the index while `archivy index` runs, and restores
+        the previous refresh interval afterwards. Only the cli does this, as the
+        small batches of the index queue shouldn't change the settings.
+        """
+        es = get_elastic_client()
+        if not es:
+            yield
+            return
+        settings = es.indices.get_settings(index=self.index_name, name="index.refresh_interval")
+        # None resets the interval to the elasticsearch default
+        refresh_interval = settings.get(self.index_name, {}).get("settings", {}).get(
+            "index", {}).get("refresh_interval")
+        es.indices.put_settings(index=self.index_name, body={"index": {"refresh_interval": "-1"}})
+        try:
+            yield
+        finally:
+            es.indices.put_settings(index=self.index_name,
+                                    body={"index": {"refresh_interval": refresh_interval}})
+            es.indices.refresh(index=self.index_name)
+
+    def bulk_index(self, dataobjs, chunk_size=500, workers=1):
+        """
+        Streams the dataobjs to elasticsearch through bulk requests of `chunk_size`
+        dataobjs, sent by `workers` threads.
+
+        The threads of `parallel_bulk` have no app context, so dataobjs are read
+        and turned into documents in the calling thread, `workers` requests at a
+        time, and the threads are only handed plain dicts to send.
+        """
+        es = get_elastic_client()
+        if not es:
+            return []
+        dataobjs = iter(dataobjs)
+        indexed = []
+        while True:
+            batch = list(islice(dataobjs, chunk_size * workers))
+            if not batch:
+                break
+            actions = [{"_index": self.index_name, "_id": dataobj.id, "_source": payload}
+                       for dataobj, payload in zip(batch, self._payloads(batch))]
+            for ok, info in parallel_bulk(es, actions, thread_count=workers,
+                                          chunk_size=chunk_size, raise_on_error=False):
+                if ok:
+                    indexed.append(int(info["index"]["_id"]))
+                else:
+                    current_app.logger.error(f"Failed to index dataobj: {info}")
+        return indexed
+
+    def delete(self, dataobj_id):
+        es = get_elastic_client()
+        if not es:
+            return
+        # dataobjs that were never indexed are fine
+        es.delete(index=self.index_name, id=dataobj_id, ignore=[404])
+
+    def _search(self, query, snippet_size=None, **kwargs):
+        # without a snippet size, the whole content is highlighted
+        fragments = {"fragment_size": snippet_size, "number_of_fragments": 3} \
+            if snippet_size else {"fragment_size": 0}
+        return get_elastic_client().search(
+            index=self.index_name,
+            body={
+                "query": query,
+                "highlight": {
+                    **fragments,
+                    "fields": {
+                        "content": {
+                            "pre_tags": "==",
+                            "post_tags": "==",
+                        }
+                    }
+                },
+                **kwargs
+            }
+        )
+
+    def search(self, query, size=10, offset=0, after=None, snippet_size=None,
+               filters=None, facets=False, fuzzy=False):
+        """
+        Returns a page of matches, sorted by score and then by id so that pages
+        can be walked with `search_after` without skipping or repeating dataobjs.
+        """
+        if not get_elastic_client():
+            results = {"hits": [], "total": 0, "next": None}
+            if facets:
+                results["facets"] = {facet: [] for facet in FACET_FIELDS}
+            return results
+        options = {
+            "size": size,
+            "sort": [{"_score": "desc"}, {"_id": "asc"}],
+            "track_total_hits": True,
+        }
+        if after is not None:
+            score, dataobj_id = self.decode_cursor(after)
+            # ids are sorted as the keywords they are stored as
+            options["search_after"] = [score, str(dataobj_id)]
+        else:
+            options["from"] = offset
+        if facets:
+            options["aggs"] = self._aggregations()
+        multi_match = {
+            "query": query,
+            "fields": SEARCHABLE_FIELDS,
+            "analyzer": "rebuilt_standard"
+        }
+        if fuzzy:
+            # terms match words within 1 or 2 edits, depending on their length
+            multi_match.update(fuzziness="AUTO", prefix_length=1)
+        search = self._search({
+            "bool": {
+                "must": {"multi_match": multi_match},
+                "filter": self._filters(filters),
+            }
+        }, snippet_size=snippet_size, **options)
+
+        raw_hits = search["hits"]["hits"]
+        hits = []
+        for hit in raw_hits:
+            formatted_hit = {"id": hit["_id"], "title": hit["_source"]["title"]}
+            if "highlight" in hit:
+                formatted_hit["highlight"] = hit["highlight"]["content"]
+            hits.append(formatted_hit)
+
+        results = {
+            "hits": hits,
+            "total": search["hits"]["total"]["value"],
+            # the page might not be the last one if it is full
+            "next": encode_cursor([raw_hits[-1]["sort"][0], int(raw_hits[-1]["sort"][1])])
+            if len(raw_hits) == size else None,
+        }
+        if facets:
+            results["facets"] = self._facets(search["aggregations"])
+        return results
+
+    def highlight(self, dataobj_id, query, snippet_size=None):
+        if not get_elastic_client():
+            return []
+        search = self._search({
+            "bool": {
+                "filter": {"ids": {"values": [str(dataobj_id)]}},
+                "must": {"match": {"content": query}},
+            }
+        }, snippet_size=snippet_size)
+        for hit in search["hits"]["hits"]:
+            return hit.get("highlight", {}).get("content", [])
+        return []
+
+    def health(self):
+        if not get_elastic_client():
+            return {"status": "red"}
+        return get_elastic_health()
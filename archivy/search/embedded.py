@@ -0,0 +1,294 @@
+import heapq
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import current_app
+
+from archivy.search.base import SearchBackend, count_facets, encode_cursor, filtered_ids
+
+
+TOKEN = re.compile(r"\w+")
+# same stopwords as the `_english_` list of the elasticsearch analyzer
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into",
+    "is", "it", "no", "not", "of", "on", "or", "such", "that", "the", "their", "then",
+    "there", "these", "they", "this", "to", "was", "will", "with",
+}
+# weight of the terms of each field when scoring documents
+FIELD_WEIGHTS = {"title": 2.0, "tags": 1.5, "desc": 1.0, "content": 1.0}
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# indexes already built by this process, by data dir
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def tokenize(text):
+    """Splits `text` into lowercase terms, without stopwords"""
+    return [term for term in TOKEN.findall(str(text).lower()) if term not in STOPWORDS]
+
+
+def highlight(text, terms):
+    """Wraps the words of `text` that are part of `terms` in `==`, like elasticsearch does"""
+    return TOKEN.sub(
+        lambda match: f"=={match.group()}==" if match.group().lower() in terms else match.group(),
+        text)
+
+
+def snippets(text, terms, size, max_snippets=3):
+    """
+    Returns up to `max_snippets` parts of `text` of about `size` characters
+    around the words that are part of `terms`, highlighted with `highlight`.
+    """
+    parts = []
+    end = 0
+    for match in TOKEN.finditer(text):
+        if match.start() < end or match.group().lower() not in terms:
+            continue
+        start = max(match.start() - size // 2, end)
+        end = min(start + size, len(text))
+        parts.append(highlight(text[start:end].strip(), terms))
+        if len(parts) == max_snippets:
+            break
+    return parts
+
+
+class EmbeddedIndex:
+    """
+    In-memory inverted index of the dataobjs of a data dir, ranked with BM25.
+
+    The index is built from the data dir the first time it is queried, then
+    kept up to date by `add_to_index` / `remove_from_index`. Files changed by other programs are
+    picked up at most every `TREE_CHECK_INTERVAL` seconds.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.lock = threading.RLock()
+        # term -> {dataobj id: weighted term frequency}
+        self.postings = {}
+        # dataobj id -> title, terms, length, path and stat of its file
+        self.docs = {}
+        self.paths = {}
+        self.total_length = 0
+        # when the data dir was last compared with the index, None until built
+        self.checked_at = None
+
+    def add(self, dataobj_id, fields, filename=None):
+        """
+        Indexes the dataobj of given id. `fields` is a dict with its title,
+        content, desc and tags.
+        """
+        frequencies = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            value = fields.get(field) or ""
+            if isinstance(value, (list, tuple)):
+                value = " ".join(str(item) for item in value)
+            for term in tokenize(value):
+                frequencies[term] += weight
+
+        stat = None
+        if filename is not None:
+            try:
+                stat = os.stat(filename)
+                stat = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                pass
+
+        with self.lock:
+            self.remove(dataobj_id)
+            for term, frequency in frequencies.items():
+                self.postings.setdefault(term, {})[dataobj_id] = frequency
+            length = sum(frequencies.values())
+            self.docs[dataobj_id] = {
+                "title": fields.get("title"),
+                "terms": list(frequencies),
+                "length": length,
+                "path": str(filename) if filename is not None else None,
+                "stat": stat,
+            }
+            if filename is not None:
+                self.paths[str(filename)] = dataobj_id
+            self.total_length += length
+
+    def remove(self, dataobj_id):
+        """Removes the dataobj of given id from the index"""
+        with self.lock:
+            doc = self.docs.pop(dataobj_id, None)
+            if doc is None:
+                return
+            for term in doc["terms"]:
+                postings = self.postings[term]
+                del postings[dataobj_id]
+                if not postings:
+                    del self.postings[term]
+            if self.paths.get(doc["path"]) == dataobj_id:
+                del self.paths[doc["path"]]
+            self.total_length -= doc["length"]
+
+    def refresh(self):
+        """Indexes the files of the data dir that changed since they were last indexed"""
+        from archivy.data import file_changes, map_files
+        from archivy.metadata_cache import get_metadata_cache
+
+        with self.lock:
+            now = time.monotonic()
+            if self.checked_at is not None and \
+                    now - self.checked_at < current_app.config["TREE_CHECK_INTERVAL"]:
+                return
+            self.checked_at = now
+
+            changed, deleted = file_changes({
+                path: self.docs[dataobj_id]["stat"] for path, dataobj_id in self.paths.items()})
+            for path in deleted:
+                self.remove(self.paths[path])
+
+            cache = get_metadata_cache()
+            for filename, post in zip(changed, map_files(cache.load, changed)):
+                if "id" in post.metadata:
+                    fields = dict(post.metadata, content=post.content)
+                    self.add(post["id"], fields, filename)
+            cache.save()
+
+    def score(self, query, ids=None):
+        """
+        Returns the BM25 scores of the dataobjs matching `query`, by id, only
+        considering the dataobjs whose id is in `ids` if it is given.
+        """
+        terms = set(tokenize(query))
+        scores = Counter()
+        with self.lock:
+            if not self.docs:
+                return scores
+            num_docs = len(self.docs)
+            avg_length = self.total_length / num_docs or 1
+            for term in terms:
+                postings = self.postings.get(term, {})
+                idf = math.log(1 + (num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for dataobj_id, frequency in postings.items():
+                    if ids is not None and dataobj_id not in ids:
+                        continue
+                    length = self.docs[dataobj_id]["length"]
+                    scores[dataobj_id] += idf * frequency * (K1 + 1) / (
+                        frequency + K1 * (1 - B + B * length / avg_length))
+        return scores
+
+    def search(self, query, limit=10, after=None, ids=None):
+        """
+        Returns the ids of the `limit` best matches for `query` with their scores,
+        and the total number of matches.
+
+        See `top_matches` for the order of matches and `after`, and `score` for `ids`.
+        """
+        scores = self.score(query, ids)
+        return top_matches(scores, limit, after), len(scores)
+
+
+def top_matches(scores, limit, after=None):
+    """
+    Returns the `limit` best `(id, score)` pairs of `scores`, sorted by decreasing
+    score, then by id. If `after` is a `(score, id)` pair, only the matches
+    sorted after it are returned.
+    """
+    matches = scores.items()
+    if after is not None:
+        after_score, after_id = after
+        matches = [(dataobj_id, score) for dataobj_id, score in matches
+                   if (-score, dataobj_id) > (-after_score, after_id)]
+    return heapq.nsmallest(limit, matches, key=lambda item: (-item[1], item[0]))
+
+
+def get_index(build=True):
+    """
+    Returns the embedded index of the current data dir, building or refreshing
+    it first if `build` is set. Returns None if `build` isn't set and the index
+    wasn't built yet.
+    """
+    from archivy.data import get_data_dir
+    data_dir = get_data_dir()
+    with _indexes_lock:
+        index = _indexes.get(str(data_dir))
+        if index is None:
+            if not build:
+                return None
+            index = _indexes[str(data_dir)] = EmbeddedIndex(data_dir)
+    if build:
+        index.refresh()
+    return index
+
+
+class EmbeddedBackend(SearchBackend):
+    """Search backend using the in-memory `EmbeddedIndex` of the data dir"""
+
+    name = "embedded"
+    offset_cursors = False
+
+    def index(self, dataobj):
+        from archivy.data import get_by_id
+        index = get_index(build=False)
+        if index is None:
+            # the dataobj will be read from disk when the index is built
+            return True
+        fields = {field: getattr(dataobj, field) for field in dataobj.__searchable__}
+        index.add(dataobj.id, fields, get_by_id(dataobj.id))
+        return True
+
+    def delete(self, dataobj_id):
+        index = get_index(build=False)
+        if index is not None:
+            index.remove(int(dataobj_id))
+
+    def search(self, query, size=10, offset=0, after=None, snippet_size=None,
+               filters=None, facets=False, fuzzy=False):
+        index = get_index()
+        scores = index.score(query, filtered_ids(filters))
+        # fetch one more match to know if there is a next page
+        if after is not None:
+            matches = top_matches(scores, size + 1, after=self.decode_cursor(after))
+        else:
+            matches = top_matches(scores, offset + size + 1)[offset:]
+        more = len(matches) > size
+        matches = matches[:size]
+        hits = []
+        for dataobj_id, _ in matches:
+            doc = index.docs.get(dataobj_id)
+            if doc is None:
+                continue
+            hit = {"id": str(dataobj_id), "title": doc["title"]}
+            fragments = self.highlight(dataobj_id, query, snippet_size)
+            if fragments:
+                hit["highlight"] = fragments
+            hits.append(hit)
+        results = {
+            "hits": hits,
+            "total": len(scores),
+            "next": encode_cursor([matches[-1][1], matches[-1][0]]) if more else None,
+        }
+        if facets:
+            results["facets"] = count_facets(scores)
+        return results
+
+    def highlight(self, dataobj_id, query, snippet_size=None):
+        from archivy.data import get_by_id
+        from archivy.metadata_cache import get_metadata_cache
+
+        filename = get_by_id(dataobj_id)
+        terms = set(tokenize(query))
+        if filename is None:
+            return []
+        content = get_metadata_cache().load(filename).content
+        if not terms.intersection(tokenize(content)):
+            return []
+        if snippet_size:
+            return snippets(content, terms, snippet_size)
+        return [highlight(content, terms)]
+
+    def health(self):
+        index = get_index(build=False)
+        return {"status": "green", "documents": len(index.docs) if index else 0}
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from flask import current_app
+
+
+def file_hash(filename):
+    """Returns the sha256 of the contents of `filename`"""
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class IndexManifest:
+    """
+    Record of the files that were last sent to the search engine by `archivy index`,
+    used to only index the files that changed since.
+
+    It maps dataobj ids to the path, modification time, size and content hash
+    of their file, and is stored as `search_manifest.json` in `INTERNAL_DIR`.
+    The manifest is discarded if the search engine or the data dir changed.
+    """
+
+    def __init__(self, engine, data_dir):
+        self.path = Path(current_app.config["INTERNAL_DIR"]) / "search_manifest.json"
+        self.engine = engine
+        self.data_dir = str(data_dir)
+        self.entries = {}
+        try:
+            with self.path.open() as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        if manifest.get("engine") == engine and manifest.get("data_dir") == self.data_dir:
+            self.entries = {int(dataobj_id): entry
+                            for dataobj_id, entry in manifest["dataobjs"].items()}
+
+    def changes(self, filenames, full=False):
+        """
+        Compares `filenames` with the manifest and returns the new or modified
+        files, as a list of `(filename, entry)` where `entry` is what should be
+        recorded once the file is indexed, and the ids of the dataobjs whose file
+        disappeared.
+
+        Files whose modification time and size are unchanged aren't read. The others
+        are hashed, so files that were only touched aren't indexed again. If `full`
+        is set, all files are returned as modified, but deleted files are still
+        found from the manifest.
+        """
+        from archivy.data import ID_PREFIX, load_metadata
+
+        changed, seen = [], set()
+        for filename in filenames:
+            match = ID_PREFIX.match(filename.name)
+            dataobj_id = int(match.group(1)) if match else load_metadata(filename).get("id")
+            if not isinstance(dataobj_id, int):
+                continue
+            seen.add(dataobj_id)
+            stat = os.stat(filename)
+            entry = {"path": str(filename), "mtime": stat.st_mtime_ns, "size": stat.st_size}
+            old_entry = None if full else self.entries.get(dataobj_id)
+            if old_entry and all(old_entry.get(key) == entry[key] for key in entry):
+                continue
+            entry["hash"] = file_hash(filename)
+            if old_entry and old_entry.get("path") == entry["path"] and \
+                    old_entry.get("hash") == entry["hash"]:
+                # only the modification time changed
+                self.entries[dataobj_id] = entry
+                continue
+            changed.append((filename, dict(entry, id=dataobj_id)))
+        deleted = [dataobj_id for dataobj_id in self.entries if dataobj_id not in seen]
+        return changed, deleted
+
+    def record(self, entries):
+        """Records the given entries returned by `changes` as indexed"""
+        for entry in entries:
+            entry = dict(entry)
+            self.entries[entry.pop("id")] = entry
+
+    def forget(self, dataobj_ids):
+        """Removes the dataobjs of given ids from the manifest"""
+        for dataobj_id in dataobj_ids:
+            self.entries.pop(dataobj_id, None)
+
+    def save(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        with tmp_path.open("w") as f:
+            json.dump({
+                "engine": self.engine,
+                "data_dir": self.data_dir,
+                "dataobjs": {str(dataobj_id): entry for dataobj_id, entry in self.entries.items()},
+            }, f)
+        os.replace(str(tmp_path), str(self.path))
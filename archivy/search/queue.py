@@ -0,0 +1,151 @@
+import atexit
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+# maximum number of operations sent to the search engine at once
+BATCH_SIZE = 500
+# seconds to wait for more operations before sending a batch
+FLUSH_INTERVAL = 0.5
+# a failed batch is retried this many times, waiting twice as long each time
+MAX_RETRIES = 5
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 60
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+class IndexQueue:
+    """
+    Queue of dataobjs to index or remove from the search index, processed in
+    batches by a background thread so that requests don't wait on the search engine.
+
+    Operations on the same dataobj are coalesced: only the last one is applied.
+    Failed batches are retried with exponential backoff, then spooled to be
+    replayed later. Pending operations are flushed when the process exits.
+    """
+
+    def __init__(self, app, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # dataobj id -> ("index", dataobj) or ("delete", None)
+        self.pending = OrderedDict()
+        self.in_flight = 0
+        self.flushing = False
+        self.closed = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="archivy-index-queue", daemon=True)
+        self.thread.start()
+
+    def put(self, dataobj_id, operation, dataobj=None):
+        """Queues `operation` ("index" or "delete") for the dataobj of given id"""
+        with self.cond:
+            # move the dataobj to the end, so it isn't sent before its previous operations
+            self.pending.pop(int(dataobj_id), None)
+            self.pending[int(dataobj_id)] = (operation, dataobj)
+            self.cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Waits until all queued operations were processed. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            self.flushing = True
+            self.cond.notify_all()
+            try:
+                while self.pending or self.in_flight:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self.cond.wait(remaining)
+            finally:
+                self.flushing = False
+        return True
+
+    def close(self, timeout=30):
+        """Processes the pending operations and stops the worker thread"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join(timeout)
+
+    def _next_batch(self):
+        with self.cond:
+            while not self.pending and not self.closed:
+                self.cond.wait()
+            # give operations a chance to accumulate, to send fewer and bigger batches
+            deadline = time.monotonic() + self.flush_interval
+            while not self.closed and not self.flushing and len(self.pending) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            batch = []
+            while self.pending and len(batch) < self.batch_size:
+                batch.append(self.pending.popitem(last=False))
+            self.in_flight = len(batch)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                # the queue was closed and is empty
+                return
+            for attempt in range(MAX_RETRIES + 1):
+                try:
+                    self._process(batch)
+                    break
+                except Exception as e:
+                    if attempt == MAX_RETRIES:
+                        self.app.logger.error(
+                            f"Failed to index {len(batch)} dataobjs, spooling them: {e}")
+                        self._spool(batch)
+                        break
+                    delay = min(RETRY_DELAY * 2 ** attempt, MAX_RETRY_DELAY)
+                    self.app.logger.warning(
+                        f"Failed to index {len(batch)} dataobjs, retrying in {delay}s: {e}")
+                    time.sleep(delay)
+            with self.cond:
+                self.in_flight = 0
+                self.cond.notify_all()
+
+    def _spool(self, batch):
+        from archivy.search.spool import spool
+        with self.app.app_context():
+            for dataobj_id, (operation, _) in batch:
+                spool(operation, dataobj_id)
+
+    def _process(self, batch):
+        from archivy.search import get_search_backend, invalidate_query_cache
+        with self.app.app_context():
+            backend = get_search_backend()
+            if backend is None:
+                return
+            dataobjs = []
+            for dataobj_id, (operation, dataobj) in batch:
+                if operation == "delete":
+                    backend.delete(dataobj_id)
+                else:
+                    dataobjs.append(dataobj)
+            if dataobjs:
+                indexed = backend.bulk_index(dataobjs, chunk_size=self.batch_size)
+                if len(indexed) != len(dataobjs):
+                    raise RuntimeError(
+                        f"only {len(indexed)} of {len(dataobjs)} dataobjs were indexed")
+            # results cached since the operations were queued are stale
+            invalidate_query_cache()
+
+
+def get_index_queue():
+    """Returns the indexing queue of the process, starting it if needed"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = IndexQueue(current_app._get_current_object())
+            atexit.register(_queue.close)
+        return _queue
@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+from flask import current_app
+
+
+_spool_lock = threading.Lock()
+
+
+def _spool_path():
+    return Path(current_app.config["INTERNAL_DIR"]) / "search_spool.jsonl"
+
+
+def spool(operation, dataobj_id):
+    """
+    Records that the dataobj of given id must be indexed (`operation` is "index")
+    or removed from the index ("delete") once the search engine is reachable again.
+
+    Operations are appended to `search_spool.jsonl` in `INTERNAL_DIR`, so they
+    survive restarts.
+    """
+    line = json.dumps({"op": operation, "id": int(dataobj_id)})
+    with _spool_lock:
+        with _spool_path().open("a") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def has_spooled():
+    """Returns whether operations are waiting to be replayed"""
+    return _spool_path().exists()
+
+
+def replay(backend):
+    """
+    Sends the spooled operations to `backend`, then empties the spool.
+
+    Only the last operation of each dataobj is replayed, and dataobjs are read
+    from disk so their current version is indexed. If replaying fails, the
+    operations are kept for the next attempt. Returns the number of replayed operations.
+    """
+    from archivy.data import get_by_id
+    from archivy.metadata_cache import get_metadata_cache
+    from archivy.models import DataObj
+
+    path = _spool_path()
+    replaying = path.with_suffix(".replaying")
+    with _spool_lock:
+        if not path.exists():
+            return 0
+        # operations spooled while replaying go to a new file
+        os.replace(str(path), str(replaying))
+
+    operations = {}
+    with replaying.open() as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # partially written line
+                continue
+            operations.pop(entry["id"], None)
+            operations[entry["id"]] = entry["op"]
+
+    try:
+        cache = get_metadata_cache()
+        dataobjs = []
+        for dataobj_id, operation in operations.items():
+            filename = get_by_id(dataobj_id) if operation == "index" else None
+            if filename is None:
+                backend.delete(dataobj_id)
+            else:
+                dataobjs.append(DataObj.from_post(cache.load(filename)))
+        if dataobjs and len(backend.bulk_index(dataobjs)) != len(dataobjs):
+            raise RuntimeError("some dataobjs couldn't be indexed")
+    except Exception:
+        # keep the operations, before any that were spooled meanwhile
+        with _spool_lock:
+            spooled_meanwhile = path.read_text() if path.exists() else ""
+            with replaying.open("w") as f:
+                for dataobj_id, operation in operations.items():
+                    f.write(json.dumps({"op": operation, "id": dataobj_id}) + "\n")
+                f.write(spooled_meanwhile)
+            os.replace(str(replaying), str(path))
+        raise
+    replaying.unlink()
+    current_app.logger.info(f"Replayed {len(operations)} spooled search index operations")
+    return len(operations)
@@ -0,0 +1,191 @@
+import json
+import re
+import sqlite3
+from itertools import islice
+from pathlib import Path
+
+from flask import current_app, g
+
+from archivy.search.base import SearchBackend, count_facets, encode_cursor, filtered_ids
+
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS dataobjs USING fts5(
+    title, content, desc, tags,
+    tokenize = 'porter unicode61',
+    prefix = '2 3'
+);
+"""
+# ranking of results, with the weights of the title, content, desc and tags columns
+RANK = "bm25(dataobjs, 2.0, 1.0, 1.0, 1.5)"
+# terms of a query, with an optional `*` to search for words starting with them
+QUERY_TERM = re.compile(r"(\w+)(\*?)")
+# markers of the matches in snippets, replaced by `==` once we know the content matched
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+
+def to_fts_query(query):
+    """
+    Converts a user query to an fts5 query matching any of its terms.
+
+    Terms are quoted so that characters of the fts5 syntax in the query are
+    searched for literally, except for a trailing `*` which makes a prefix query.
+    """
+    return " OR ".join(f'"{term}"{star}' for term, star in QUERY_TERM.findall(query))
+
+
+def close_search_db(exception=None):
+    """Closes the connection to the search database of the app context, if it was opened"""
+    conn = g.pop("search_db", None)
+    if conn is not None:
+        conn.close()
+
+
+class SQLiteBackend(SearchBackend):
+    """
+    Search backend using the fts5 full-text search extension of sqlite, stored
+    in `search.db` in `INTERNAL_DIR`.
+    """
+
+    name = "sqlite"
+    offset_cursors = False
+
+    def connect(self):
+        """Returns the connection to the search database, which is cached on `g`"""
+        db_path = str(Path(current_app.config["INTERNAL_DIR"]) / "search.db")
+        if "search_db" not in g or g.search_db_path != db_path:
+            close_search_db()
+            conn = sqlite3.connect(db_path, timeout=30)
+            conn.executescript(SCHEMA)
+            g.search_db = conn
+            g.search_db_path = db_path
+        return g.search_db
+
+    def init_index(self):
+        self.connect()
+
+    def _row(self, dataobj):
+        tags = dataobj.tags or []
+        if not isinstance(tags, str):
+            tags = " ".join(str(tag) for tag in tags)
+        return (int(dataobj.id), dataobj.title or "", dataobj.content or "",
+                dataobj.desc or "", tags)
+
+    def _write(self, conn, rows):
+        conn.executemany("DELETE FROM dataobjs WHERE rowid = ?", [(row[0],) for row in rows])
+        conn.executemany("INSERT INTO dataobjs (rowid, title, content, desc, tags) "
+                         "VALUES (?, ?, ?, ?, ?)", rows)
+
+    def index(self, dataobj):
+        conn = self.connect()
+        with conn:
+            self._write(conn, [self._row(dataobj)])
+        return True
+
+    def bulk_index(self, dataobjs, chunk_size=500, workers=1):
+        conn = self.connect()
+        dataobjs = iter(dataobjs)
+        indexed = []
+        while True:
+            rows = [self._row(dataobj) for dataobj in islice(dataobjs, chunk_size)]
+            if not rows:
+                return indexed
+            # one transaction per batch instead of one per dataobj
+            with conn:
+                self._write(conn, rows)
+            indexed.extend(row[0] for row in rows)
+
+    def delete(self, dataobj_id):
+        conn = self.connect()
+        with conn:
+            conn.execute("DELETE FROM dataobjs WHERE rowid = ?", (int(dataobj_id),))
+
+    def _snippet(self, snippet):
+        if MATCH_START not in snippet:
+            return []
+        return [snippet.replace(MATCH_START, "==").replace(MATCH_END, "==")]
+
+    def _highlight_function(self, snippet_size):
+        """Returns the fts5 function highlighting the content, and its parameters"""
+        if snippet_size == 0:
+            # the whole content
+            return "highlight(dataobjs, 1, ?, ?)", [MATCH_START, MATCH_END]
+        # fts5 snippets are measured in tokens, of about 6 characters
+        tokens = max(1, min(64, snippet_size // 6)) if snippet_size else 32
+        return "snippet(dataobjs, 1, ?, ?, '...', ?)", [MATCH_START, MATCH_END, tokens]
+
+    def search(self, query, size=10, offset=0, after=None, snippet_size=None,
+               filters=None, facets=False, fuzzy=False):
+        fts_query = to_fts_query(query)
+        if not fts_query:
+            results = {"hits": [], "total": 0, "next": None}
+            if facets:
+                results["facets"] = count_facets([])
+            return results
+        conn = self.connect()
+
+        match, params = "dataobjs MATCH ?", [fts_query]
+        ids = filtered_ids(filters)
+        if ids is not None:
+            # the ids are passed as a single json array, as there can be more of
+            # them than sqlite accepts query parameters
+            match += " AND rowid IN (SELECT value FROM json_each(?))"
+            params.append(json.dumps(sorted(ids)))
+        if facets:
+            matching = [row[0] for row in conn.execute(
+                f"SELECT rowid FROM dataobjs WHERE {match}", params)]
+            total = len(matching)
+        else:
+            total = conn.execute(f"SELECT COUNT(*) FROM dataobjs WHERE {match}",
+                                 params).fetchone()[0]
+
+        condition, page_params = "", list(params)
+        if after is not None:
+            score, dataobj_id = self.decode_cursor(after)
+            condition = "WHERE score > ? OR (score = ? AND rowid > ?)"
+            page_params += [score, score, dataobj_id]
+            offset = 0
+        # fetch one more match to know if there is a next page
+        rows = conn.execute(
+            f"SELECT rowid, title, score FROM (SELECT rowid, title, {RANK} AS score "
+            f"FROM dataobjs WHERE {match}) {condition} "
+            "ORDER BY score, rowid LIMIT ? OFFSET ?", page_params + [size + 1, offset]).fetchall()
+        more = len(rows) > size
+        rows = rows[:size]
+
+        # only make snippets for the returned page
+        function, function_params = self._highlight_function(snippet_size)
+        snippets = dict(conn.execute(
+            f"SELECT rowid, {function} FROM dataobjs "
+            f"WHERE dataobjs MATCH ? AND rowid IN ({', '.join('?' * len(rows))})",
+            function_params + [fts_query] + [row[0] for row in rows]))
+        hits = []
+        for dataobj_id, title, _ in rows:
+            hit = {"id": str(dataobj_id), "title": title}
+            highlight = self._snippet(snippets.get(dataobj_id, ""))
+            if highlight:
+                hit["highlight"] = highlight
+            hits.append(hit)
+        results = {
+            "hits": hits,
+            "total": total,
+            "next": encode_cursor([rows[-1][2], rows[-1][0]]) if more else None,
+        }
+        if facets:
+            results["facets"] = count_facets(matching)
+        return results
+
+    def highlight(self, dataobj_id, query, snippet_size=None):
+        fts_query = to_fts_query(query)
+        if not fts_query:
+            return []
+        function, function_params = self._highlight_function(snippet_size)
+        row = self.connect().execute(
+            f"SELECT {function} FROM dataobjs WHERE dataobjs MATCH ? AND rowid = ?",
+            function_params + [fts_query, int(dataobj_id)]).fetchone()
+        return self._snippet(row[0]) if row else []
+
+    def health(self):
+        count = self.connect().execute("SELECT COUNT(*) FROM dataobjs").fetchone()[0]
+        return {"status": "green", "documents": count}
@@ -0,0 +1,249 @@
+import heapq
+import json
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+from pathlib import Path
+
+from flask import current_app
+
+
+WORD = re.compile(r"\w+")
+# share of the trigrams of a query a dataobj must have to be returned by fuzzy searches
+SIMILARITY_THRESHOLD = 0.3
+
+# indexes already built by this process, by kind and path of the catalog they mirror
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def normalize(text):
+    """Lowercases `text` and collapses its whitespace, so that prefixes match titles"""
+    return " ".join(str(text).lower().split())
+
+
+def title_keys(title):
+    """
+    Returns the keys a title is found by: the normalized title from the start
+    of each of its words, so that typing any of its words suggests it.
+    """
+    title = normalize(title)
+    return sorted({title[match.start():] for match in WORD.finditer(title)})
+
+
+class TitleIndex:
+    """
+    In-memory prefix index of the titles of dataobjs, used to suggest titles
+    as users type them.
+
+    It is made of sorted lists of `(key, id)` pairs: one of the whole titles and
+    one of all keys made by `title_keys`. The titles matching a prefix are found
+    by bisecting the lists and reading the following pairs, so lookups only
+    depend on the number of suggestions, not on the size of the vault.
+    """
+
+    def __init__(self, titles=()):
+        self.lock = threading.Lock()
+        # dataobj id -> title and keys
+        self.titles = {dataobj_id: (title, title_keys(title or ""))
+                       for dataobj_id, title in titles}
+        self.starts = sorted((normalize(title or ""), dataobj_id)
+                             for dataobj_id, (title, _) in self.titles.items())
+        self.keys = sorted((key, dataobj_id) for dataobj_id, (_, keys) in self.titles.items()
+                           for key in keys)
+
+    def add(self, dataobj_id, title):
+        """Indexes the title of the dataobj of given id, replacing its previous title"""
+        with self.lock:
+            self._remove(dataobj_id)
+            keys = title_keys(title or "")
+            self.titles[dataobj_id] = (title, keys)
+            insort(self.starts, (normalize(title or ""), dataobj_id))
+            for key in keys:
+                insort(self.keys, (key, dataobj_id))
+
+    def remove(self, dataobj_id):
+        """Removes the title of the dataobj of given id from the index"""
+        with self.lock:
+            self._remove(dataobj_id)
+
+    def _remove(self, dataobj_id):
+        if dataobj_id not in self.titles:
+            return
+        title, keys = self.titles.pop(dataobj_id)
+        for entries, key in [(self.starts, normalize(title or ""))] + \
+                [(self.keys, key) for key in keys]:
+            i = bisect_left(entries, (key, dataobj_id))
+            if i < len(entries) and entries[i] == (key, dataobj_id):
+                del entries[i]
+
+    def _matches(self, entries, prefix):
+        i = bisect_left(entries, (prefix,))
+        while i < len(entries) and entries[i][0].startswith(prefix):
+            yield entries[i][1]
+            i += 1
+
+    def suggest(self, prefix, limit=10):
+        """
+        Returns up to `limit` dataobjs whose title has a word starting with
+        `prefix`, as dicts with their `id` and `title`. Titles starting with
+        `prefix` come first.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        suggestions = []
+        seen = set()
+        with self.lock:
+            for entries in (self.starts, self.keys):
+                for dataobj_id in self._matches(entries, prefix):
+                    if len(suggestions) == limit:
+                        return suggestions
+                    if dataobj_id not in seen:
+                        seen.add(dataobj_id)
+                        suggestions.append({"id": dataobj_id,
+                                            "title": self.titles[dataobj_id][0]})
+        return suggestions
+
+
+class TrigramIndex:
+    """
+    In-memory trigram index of the titles and tags of dataobjs, used to find
+    them despite typos.
+
+    Each word is padded with two spaces before and one after and cut into
+    trigrams, like postgres' `pg_trgm` does. Dataobjs are found through the
+    inverted index of their trigrams, so only the dataobjs sharing trigrams
+    with the query are looked at.
+    """
+
+    def __init__(self, dataobjs=()):
+        self.lock = threading.Lock()
+        # trigram -> ids of the dataobjs that have it
+        self.postings = {}
+        # dataobj id -> title and trigrams
+        self.docs = {}
+        for dataobj_id, title, tags in dataobjs:
+            self.add(dataobj_id, title, tags)
+
+    def add(self, dataobj_id, title, tags=()):
+        """Indexes the title and tags of the dataobj of given id"""
+        grams = trigrams(" ".join([title or ""] + [str(tag) for tag in tags]))
+        with self.lock:
+            self._remove(dataobj_id)
+            self.docs[dataobj_id] = (title, grams)
+            for gram in grams:
+                self.postings.setdefault(gram, set()).add(dataobj_id)
+
+    def remove(self, dataobj_id):
+        """Removes the dataobj of given id from the index"""
+        with self.lock:
+            self._remove(dataobj_id)
+
+    def _remove(self, dataobj_id):
+        if dataobj_id not in self.docs:
+            return
+        _, grams = self.docs.pop(dataobj_id)
+        for gram in grams:
+            postings = self.postings[gram]
+            postings.discard(dataobj_id)
+            if not postings:
+                del self.postings[gram]
+
+    def search(self, query, limit=10, threshold=SIMILARITY_THRESHOLD, ids=None):
+        """
+        Returns up to `limit` dataobjs similar to `query`, as dicts with their
+        `id`, `title` and `similarity`, most similar first. Only the dataobjs
+        whose id is in `ids` are considered if it is given.
+
+        The similarity is the share of the trigrams of the query found in the
+        title and tags of a dataobj. Dataobjs below `threshold` are left out,
+        and ties are broken in favor of dataobjs with fewer trigrams.
+        """
+        grams = trigrams(query)
+        if not grams:
+            return []
+        shared = Counter()
+        with self.lock:
+            for gram in grams:
+                for dataobj_id in self.postings.get(gram, ()):
+                    if ids is None or dataobj_id in ids:
+                        shared[dataobj_id] += 1
+            matches = []
+            for dataobj_id, count in shared.items():
+                similarity = count / len(grams)
+                if similarity >= threshold:
+                    title, doc_grams = self.docs[dataobj_id]
+                    overlap = count / (len(grams) + len(doc_grams) - count)
+                    matches.append((-similarity, -overlap, dataobj_id, title))
+        return [{"id": dataobj_id, "title": title, "similarity": round(-similarity, 3)}
+                for similarity, _, dataobj_id, title in heapq.nsmallest(limit, matches)]
+
+
+def trigrams(text):
+    """Returns the set of trigrams of the words of `text`, lowercased"""
+    grams = set()
+    for word in WORD.findall(str(text).lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _catalog_path():
+    return str(Path(current_app.config["INTERNAL_DIR"]) / "catalog.db")
+
+
+def _get_index(kind, load, build):
+    from archivy.catalog import get_catalog
+    key = (kind, _catalog_path())
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None or not build:
+            return index
+    # getting the catalog might rebuild it, which discards the indexes
+    index = load(get_catalog())
+    with _indexes_lock:
+        return _indexes.setdefault(key, index)
+
+
+def get_title_index(build=True):
+    """
+    Returns the title index of the current catalog, building it from the
+    catalog first if needed. Returns None if `build` isn't set and the index
+    wasn't built yet.
+    """
+    return _get_index("titles", lambda conn: TitleIndex(
+        conn.execute("SELECT id, title FROM dataobjs").fetchall()), build)
+
+
+def get_trigram_index(build=True):
+    """Returns the trigram index of the current catalog, like `get_title_index`"""
+    return _get_index("trigrams", lambda conn: TrigramIndex(
+        (dataobj_id, title, json.loads(tags)) for dataobj_id, title, tags
+        in conn.execute("SELECT id, title, tags FROM dataobjs")), build)
+
+
+def index_title(dataobj_id, title, tags):
+    """Updates the indexes of the current catalog that were built with the dataobj of given id"""
+    index = get_title_index(build=False)
+    if index is not None:
+        index.add(dataobj_id, title)
+    index = get_trigram_index(build=False)
+    if index is not None:
+        index.add(dataobj_id, title, tags)
+
+
+def unindex_title(dataobj_id):
+    """Removes the dataobj of given id from the indexes of the current catalog"""
+    for index in (get_title_index(build=False), get_trigram_index(build=False)):
+        if index is not None:
+            index.remove(dataobj_id)
+
+
+def discard_title_indexes():
+    """Drops the indexes of the current catalog, to build them again when they are next used"""
+    path = _catalog_path()
+    with _indexes_lock:
+        for key in [key for key in _indexes if key[1] == path]:
+            del _indexes[key]
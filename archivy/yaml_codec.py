@@ -0,0 +1,82 @@
+import frontmatter
+import yaml
+from frontmatter.default_handlers import YAMLHandler
+
+try:
+    from yaml import CSafeLoader, CSafeDumper
+    LIBYAML_AVAILABLE = True
+except ImportError:
+    LIBYAML_AVAILABLE = False
+
+
+def _same_with_libyaml(value):
+    """
+    Checks whether the libyaml dumper outputs `value` the same way the pure
+    python dumper does.
+
+    libyaml escapes characters outside of the basic multilingual plane and wraps
+    escaped strings differently, so metadata containing these or non printable
+    characters is dumped with the pure python dumper to keep files byte-identical.
+    """
+    if isinstance(value, str):
+        return value.isprintable() and all(ord(char) <= 0xFFFF for char in value)
+    if isinstance(value, dict):
+        return all(_same_with_libyaml(k) and _same_with_libyaml(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return all(_same_with_libyaml(item) for item in value)
+    return True
+
+
+class FastYAMLHandler(YAMLHandler):
+    """
+    Frontmatter handler that uses the libyaml C loader and dumper when they are
+    available and enabled, and the pure python implementations otherwise.
+
+    Metadata is always written the way the pure python dumper writes it, so files
+    don't depend on whether libyaml is installed.
+    """
+
+    def __init__(self, use_libyaml=True):
+        super().__init__()
+        self.use_libyaml = use_libyaml and LIBYAML_AVAILABLE
+
+    def load(self, fm, **kwargs):
+        kwargs.setdefault("Loader", CSafeLoader if self.use_libyaml else yaml.SafeLoader)
+        return super().load(fm, **kwargs)
+
+    def export(self, metadata, **kwargs):
+        if self.use_libyaml and _same_with_libyaml(metadata):
+            kwargs.setdefault("Dumper", CSafeDumper)
+        kwargs.setdefault("Dumper", yaml.SafeDumper)
+        return super().export(metadata, **kwargs)
+
+
+handler = FastYAMLHandler()
+
+
+def configure(use_libyaml):
+    """Sets whether frontmatter is parsed and written with libyaml"""
+    global handler
+    handler = FastYAMLHandler(use_libyaml)
+
+
+def loads(text):
+    """Parses markdown `text` with frontmatter, like `frontmatter.loads`"""
+    # let frontmatter detect other header formats
+    return frontmatter.loads(text, handler=handler if handler.detect(text.strip()) else None)
+
+
+def load(filename):
+    """Parses the markdown file at `filename`, like `frontmatter.load`"""
+    with open(filename, encoding="utf-8") as f:
+        return loads(f.read())
+
+
+def load_header(header):
+    """Parses a yaml frontmatter header, without its `---` delimiters"""
+    return handler.load(header)
+
+
+def dumps(post):
+    """Serializes a `frontmatter.Post` to markdown, like `frontmatter.dumps`"""
+    return frontmatter.dumps(post, handler=handler)
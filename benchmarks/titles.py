@@ -0,0 +1,32 @@
+"""
+Micro-benchmark of title suggestions with the in-memory title index, on a
+synthetic vault of titles.
+
+Usage: python benchmarks/titles.py [number of titles]
+"""
+import sys
+import time
+
+from archivy.titles import TitleIndex
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    start = time.perf_counter()
+    index = TitleIndex((i, f"Note number {i} about topic {i % 100}") for i in range(size))
+    built = time.perf_counter() - start
+
+    queries = ["topic 4", "note", "about topic 99", "number 12345", "missing"]
+    rounds = 100
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for query in queries:
+            index.suggest(query)
+    elapsed = time.perf_counter() - start
+
+    print(f"{size} titles, index built in {built:.3f}s")
+    print(f"suggest: {elapsed / (rounds * len(queries)) * 1000:.3f}ms per query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark of frontmatter parsing and dumping with the pure python yaml
+implementation and with libyaml, on a synthetic vault of notes.
+
+Usage: python benchmarks/yaml_codec.py [number of notes]
+"""
+import random
+import string
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import frontmatter
+
+from archivy import yaml_codec
+
+
+def make_vault(directory, size):
+    random.seed(0)
+    words = ["".join(random.choices(string.ascii_lowercase, k=random.randint(2, 10)))
+             for _ in range(2000)]
+    for i in range(1, size + 1):
+        post = frontmatter.Post(" ".join(random.choices(words, k=300)))
+        post.metadata.update({
+            "type": random.choice(["note", "bookmark"]),
+            "desc": " ".join(random.choices(words, k=10)),
+            "title": " ".join(random.choices(words, k=6)).capitalize(),
+            "date": "01-01-21",
+            "tags": random.sample(words, 3),
+            "id": i,
+            "path": "",
+            "url": f"https://example.com/{i}",
+        })
+        with (directory / f"{i}-01-01-21-note.md").open("w", encoding="utf-8") as f:
+            f.write(frontmatter.dumps(post))
+
+
+def bench(filenames):
+    start = time.perf_counter()
+    posts = [yaml_codec.load(filename) for filename in filenames]
+    parsed = time.perf_counter()
+    dumped = [yaml_codec.dumps(post) for post in posts]
+    end = time.perf_counter()
+    return parsed - start, end - parsed, dumped
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as directory:
+        make_vault(Path(directory), size)
+        filenames = sorted(Path(directory).iterdir())
+
+        yaml_codec.configure(False)
+        pure_parse, pure_dump, pure_output = bench(filenames)
+        yaml_codec.configure(True)
+        if not yaml_codec.handler.use_libyaml:
+            print("libyaml is not available, install PyYAML with its C extension.")
+            return
+        c_parse, c_dump, c_output = bench(filenames)
+
+    print(f"{size} notes")
+    print(f"parse: pure python {pure_parse:.3f}s, libyaml {c_parse:.3f}s "
+          f"({pure_parse / c_parse:.1f}x faster)")
+    print(f"dump:  pure python {pure_dump:.3f}s, libyaml {c_dump:.3f}s "
+          f"({pure_dump / c_dump:.1f}x faster)")
+    print("output identical:", pure_output == c_output)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ import click
 import pytest
 import responses
 
-from archivy import app, cli
+from archivy import app, cli, data, duplicates, related
 from archivy.click_web import create_click_web_app, _flask_app
 from archivy.helpers import get_db
 from archivy.models import DataObj, User
@@ -48,6 +48,9 @@ def test_app():
         User(**user).insert()
         yield _app
 
+    # wait for indexes built in the background, which write to the directory
+    with duplicates._build_lock, related._build_lock, data._tree_check_lock:
+        pass
     # close and remove the temporary database
     shutil.rmtree(app_dir)
 
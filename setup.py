@@ -33,5 +33,9 @@ setuptools.setup(
     include_package_data=True,
     zip_safe=False,
     install_requires=install_requires,
+    extras_require={
+        # related notes on the page of each dataobj
+        "related": ["numpy", "scipy"],
+    },
     python_requires='>=3.6',
 )
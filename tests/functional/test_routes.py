@@ -132,3 +132,25 @@ def test_logging_out(test_app, client: FlaskClient):
 
     resp = client.get("/", follow_redirects=True)
     assert request.path == "/login"
+
+
+def test_related_notes_panel(test_app, client: FlaskClient, note_fixture, monkeypatch):
+    from archivy import related
+    from archivy.models import DataObj
+    note = DataObj(type="note", title="Related one", tags=["testing", "archivy"])
+    note.insert()
+
+    monkeypatch.setattr(related, "np", None)
+    response = client.get(f"/dataobj/{note_fixture.id}")
+    assert b"Related notes" not in response.data
+
+    if related.sparse is not None:
+        monkeypatch.undo()
+        # hidden while the index is built in the background
+        response = client.get(f"/dataobj/{note_fixture.id}")
+        assert b"Related notes" not in response.data
+        with related._build_lock:
+            pass
+        response = client.get(f"/dataobj/{note_fixture.id}")
+        assert b"Related notes" in response.data
+        assert b"Related one" in response.data
@@ -4,6 +4,7 @@ import responses
 from flask import Flask
 from flask.testing import FlaskClient
 from archivy.data import create_dir, get_items
+from archivy.search.base import encode_cursor
 from archivy.models import DataObj
 
 def test_bookmark_not_found(test_app, client: FlaskClient):
@@ -128,3 +129,111 @@ def test_unlogged_in_api_fails(test_app, client: FlaskClient):
     resp = client.get("/api/dataobjs")
     assert resp.status_code == 302
 
+
+
+def test_get_folder(test_app, client: FlaskClient, note_fixture):
+    create_dir("nested/deeper")
+    for i in range(3):
+        DataObj(type="note", title=f"Nested {i}", path="nested").insert()
+
+    resp = client.get("/api/folders")
+    assert resp.status_code == 200
+    assert resp.json["files"] == [{"id": note_fixture.id, "title": note_fixture.title}]
+    assert resp.json["dirs"] == [{"name": "nested", "path": "nested", "num_files": 3, "num_dirs": 1}]
+
+    resp = client.get("/api/folders?path=nested&per_page=2&page=2")
+    assert resp.status_code == 200
+    assert resp.json["num_files"] == 3
+    assert [dataobj["title"] for dataobj in resp.json["files"]] == ["Nested 2"]
+    assert resp.json["dirs"][0]["path"] == "nested/deeper"
+
+
+def test_get_folder_not_found(test_app, client: FlaskClient):
+    resp = client.get("/api/folders?path=inexistent")
+    assert resp.status_code == 404
+
+
+def test_get_dataobjs_paginated(test_app, client: FlaskClient):
+    for i in range(5):
+        DataObj(type="note", title=f"Note {i}", content="Lorem ipsum").insert()
+
+    resp = client.get("/api/dataobjs?limit=2&fields=title")
+    assert resp.status_code == 200
+    assert resp.json["dataobjs"] == [
+        {"metadata": {"id": 1, "title": "Note 0"}},
+        {"metadata": {"id": 2, "title": "Note 1"}},
+    ]
+    assert resp.json["next_cursor"] == 2
+
+    ids = []
+    cursor = resp.json["next_cursor"]
+    while cursor is not None:
+        resp = client.get(f"/api/dataobjs?limit=2&cursor={cursor}&fields=title,content")
+        ids += [dataobj["metadata"]["id"] for dataobj in resp.json["dataobjs"]]
+        assert all(dataobj["content"] == "Lorem ipsum" for dataobj in resp.json["dataobjs"])
+        cursor = resp.json["next_cursor"]
+    assert ids == [3, 4, 5]
+
+    # invalid cursors are rejected instead of restarting from the first page
+    assert client.get("/api/dataobjs?limit=2&cursor=abc").status_code == 400
+    assert client.get("/api/dataobjs?limit=-1").status_code == 400
+
+
+def test_tags(test_app, client: FlaskClient, note_fixture, bookmark_fixture):
+    resp = client.get("/api/tags")
+    assert resp.status_code == 200
+    assert {"tag": "testing", "count": 2} in resp.json
+
+    resp = client.get("/api/tags/dataobjs?tags=testing,archivy")
+    assert resp.status_code == 200
+    assert len(resp.json) == 2
+
+    resp = client.get("/api/tags/dataobjs?tags=testing&type=bookmark")
+    assert [record["id"] for record in resp.json] == [bookmark_fixture.id]
+
+    resp = client.get("/api/tags/dataobjs?tags=testing,unused&mode=or&type=note")
+    assert [record["id"] for record in resp.json] == [note_fixture.id]
+    assert client.get("/api/tags/dataobjs?tags=testing&mode=xor").status_code == 400
+    assert client.get("/api/tags/dataobjs").status_code == 400
+
+
+def test_search_paginated(test_app, client: FlaskClient):
+    for i in range(3):
+        DataObj(type="note", title=f"Result {i}", content="searchable").insert()
+
+    resp = client.get("/api/search?query=searchable")
+    assert isinstance(resp.json, list) and len(resp.json) == 3
+
+    resp = client.get("/api/search?query=searchable&size=2")
+    assert resp.headers["X-Total-Count"] == "3"
+    assert resp.json["total"] == 3 and resp.json["page"] == 1 and resp.json["size"] == 2
+    assert len(resp.json["hits"]) == 2
+
+    resp = client.get(f"/api/search?query=searchable&size=2&after={resp.json['next']}")
+    assert len(resp.json["hits"]) == 1
+    assert resp.json["next"] is None
+    assert client.get("/api/search?query=searchable&size=1000").json["size"] == 100
+    assert client.get("/api/search?query=searchable&after=invalid").status_code == 400
+    # well-formed cursors of the wrong shape are rejected too, without opening the breaker
+    for values in (1, [1.5], ["1", 2], [1.5, 2, 3], [None, 2]):
+        cursor = encode_cursor(values)
+        assert client.get(f"/api/search?query=searchable&after={cursor}").status_code == 400
+    assert client.get("/api/search?query=searchable&size=2").status_code == 200
+
+
+def test_search_facets(test_app, client: FlaskClient, note_fixture, bookmark_fixture):
+    resp = client.get("/api/search?query=testing&facets=1")
+    assert resp.json["total"] == 2
+    assert {"value": "bookmark", "count": 1} in resp.json["facets"]["type"]
+
+    resp = client.get("/api/search?query=testing&type=note")
+    assert [hit["id"] for hit in resp.json["hits"]] == [str(note_fixture.id)]
+    resp = client.get("/api/search?query=testing&tags=testing,archivy&type=note&type=bookmark")
+    assert resp.json["total"] == 2
+
+
+def test_suggest_titles(test_app, client: FlaskClient, note_fixture):
+    resp = client.get("/api/titles/suggest?prefix=note")
+    assert resp.json == [{"id": note_fixture.id, "title": "Test Note"}]
+    assert client.get("/api/titles/suggest?prefix=other").json == []
+    assert client.get("/api/titles/suggest").status_code == 400
@@ -0,0 +1,152 @@
+import os
+import sqlite3
+
+import pytest
+
+from archivy import catalog
+from archivy.data import get_by_id, get_items, delete_item, delete_dir, create_dir, update_item
+from archivy.models import DataObj
+
+
+def test_insert_adds_to_catalog(test_app, note_fixture):
+    assert catalog.lookup(note_fixture.id) == note_fixture.fullpath
+    row = catalog.get_catalog().execute(
+        "SELECT title, type, tags FROM dataobjs WHERE id = ?", (note_fixture.id,)).fetchone()
+    assert row == ("Test Note", "note", '["testing", "archivy"]')
+
+
+def test_get_by_id_uses_catalog(test_app, note_fixture, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("data dir should not be searched")
+
+    monkeypatch.setattr("pathlib.Path.rglob", fail)
+    assert get_by_id(note_fixture.id) == note_fixture.fullpath
+
+
+def test_stale_entries_are_repaired(test_app, note_fixture):
+    # move the file behind archivy's back
+    new_dir = create_dir("moved")
+    new_path = note_fixture.fullpath.parent / new_dir / note_fixture.fullpath.name
+    os.rename(note_fixture.fullpath, new_path)
+
+    assert get_by_id(note_fixture.id) == new_path
+    assert catalog.lookup(note_fixture.id) == new_path
+
+
+def test_catalog_closed_with_app_context(test_app, note_fixture):
+    with test_app.app_context():
+        conn = catalog.get_catalog()
+        assert catalog.lookup(note_fixture.id) == note_fixture.fullpath
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+
+
+def test_catalog_rebuilt_for_new_data_dir(test_app, note_fixture):
+    conn = catalog.get_catalog()
+    with conn:
+        conn.execute("DELETE FROM dataobjs")
+        conn.execute("UPDATE meta SET value = 'elsewhere' WHERE key = 'data_dir'")
+
+    assert catalog.get_catalog(force_reconnect=True)
+    assert catalog.lookup(note_fixture.id) == note_fixture.fullpath
+
+
+def test_update_and_delete_keep_catalog_in_sync(test_app, note_fixture):
+    update_item(note_fixture.id, "new content")
+    assert catalog.lookup(note_fixture.id) == note_fixture.fullpath
+
+    delete_item(note_fixture.id)
+    assert catalog.lookup(note_fixture.id) is None
+    assert get_by_id(note_fixture.id) is None
+
+
+def test_delete_dir_removes_entries(test_app):
+    create_dir("nested")
+    note = DataObj(type="note", title="Nested", path="nested")
+    note.insert()
+    assert catalog.lookup(note.id)
+
+    delete_dir("nested")
+    assert catalog.lookup(note.id) is None
+
+
+def test_tag_index(test_app, note_fixture, bookmark_fixture):
+    other = DataObj(type="note", title="Other", tags=["Testing", "other"])
+    other.insert()
+
+    assert catalog.get_tags()[0] == ("testing", 3)
+    both = sorted([note_fixture.id, bookmark_fixture.id])
+    assert catalog.find(tags=["testing", "archivy"]) == both
+    assert catalog.find(tags=["testing", "OTHER"]) == [other.id]
+    assert catalog.find(tags=["archivy", "other"], match_all=False) == both + [other.id]
+    assert catalog.find(tags=["testing"], types=["bookmark"]) == [bookmark_fixture.id]
+    assert catalog.find(types=["note"]) == sorted([note_fixture.id, other.id])
+
+    record = catalog.get_records([note_fixture.id])[0]
+    assert record["title"] == note_fixture.title
+    assert record["tags"] == ["testing", "archivy"]
+
+
+def test_tag_index_follows_updates(test_app, note_fixture):
+    dataobj = get_by_id(note_fixture.id)
+    dataobj.write_text(dataobj.read_text().replace("- archivy", "- renamed"))
+    assert catalog.lookup(note_fixture.id)
+    assert catalog.find(tags=["renamed"]) == [note_fixture.id]
+    assert catalog.find(tags=["archivy"]) == []
+
+    delete_item(note_fixture.id)
+    assert catalog.get_tags() == []
+
+
+def test_refresh_picks_up_external_changes(test_app, note_fixture, monkeypatch):
+    monkeypatch.setitem(test_app.config, "TREE_CHECK_INTERVAL", 0)
+    data_dir = note_fixture.fullpath.parent
+    (data_dir / "7-01-01-21-external.md").write_text("---\nid: 7\ntitle: External\n"
+                                                      "type: note\n---\nhello")
+    moved = create_dir("moved")
+    os.rename(note_fixture.fullpath, data_dir / moved / note_fixture.fullpath.name)
+
+    notes = get_items(collections=["note"], structured=False, json_format=True)
+    assert sorted(note["metadata"]["id"] for note in notes) == [note_fixture.id, 7]
+    assert catalog.get_records([note_fixture.id])[0]["folder"] == "moved"
+    assert not catalog.refresh()
+
+    # deleted files are dropped instead of failing the listing
+    (data_dir / "7-01-01-21-external.md").unlink()
+    monkeypatch.setattr(catalog, "refresh", lambda force=False: False)
+    notes = get_items(collections=["note"], structured=False, json_format=True)
+    assert [note["metadata"]["id"] for note in notes] == [note_fixture.id]
+
+
+def test_month_of():
+    assert catalog.month_of("03-14-21") == "2021-03"
+    assert catalog.month_of("2021-03-14T10:00") == "2021-03"
+    assert catalog.month_of("someday") is None
+    assert catalog.month_of(None) is None
+
+
+def test_facets(test_app, note_fixture, bookmark_fixture):
+    create_dir("projects")
+    note = DataObj(type="note", title="Nested", tags=["testing"], path="projects")
+    note.insert()
+    month = catalog.month_of(note.date)
+
+    facets = catalog.facets([note_fixture.id, bookmark_fixture.id, note.id])
+    assert facets["tags"][0] == {"value": "testing", "count": 3}
+    assert facets["type"] == [{"value": "note", "count": 2}, {"value": "bookmark", "count": 1}]
+    assert facets["folder"] == [{"value": "", "count": 2}, {"value": "projects", "count": 1}]
+    assert facets["date"] == [{"value": month, "count": 3}]
+    assert catalog.facets([note.id])["type"] == [{"value": "note", "count": 1}]
+
+    assert catalog.find(folders=["projects"]) == [note.id]
+    assert catalog.find(types=["note"], months=[month]) == [note_fixture.id, note.id]
+    assert catalog.find(months=["1999-01"]) == []
+
+
+def test_old_catalog_is_rebuilt(test_app, note_fixture):
+    conn = catalog.get_catalog()
+    with conn:
+        conn.executescript("DROP TABLE dataobjs; CREATE TABLE dataobjs (id INTEGER PRIMARY KEY);")
+        conn.execute("UPDATE meta SET value = '2' WHERE key = 'version'")
+    catalog.get_catalog(force_reconnect=True)
+    assert catalog.find(folders=[""]) == [note_fixture.id]
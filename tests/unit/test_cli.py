@@ -7,6 +7,8 @@ from archivy.cli import cli
 from archivy.helpers import get_db
 from archivy.models import DataObj
 from archivy.data import get_items, create_dir, get_data_dir
+from archivy.search import query_index
+from archivy.search.sqlite import SQLiteBackend
 
 
 def test_initialization(test_app, cli_runner, click_cli):
@@ -189,3 +191,98 @@ def test_unformat_directory(test_app, cli_runner, click_cli, bookmark_fixture, n
     # unformat directory
     res = cli_runner.invoke(cli, ["unformat", os.path.join(get_data_dir(), note_dir), out_dir])
     assert f"Unformatted and moved {nested_note.fullpath} to {out_dir}/{note_dir}/{nested_note.title}" in res.output
+
+
+def test_migrate_layout(test_app, cli_runner, click_cli, note_fixture, monkeypatch):
+    monkeypatch.setitem(test_app.config, "SHARD_SIZE", 0)
+    res = cli_runner.invoke(cli, ["migrate-layout", "--shard-size", "100"])
+    assert "Moved 1 dataobjs." in res.output
+    assert (get_data_dir() / ".shard-0" / note_fixture.fullpath.name).exists()
+
+    conf = open(os.path.join(test_app.config["INTERNAL_DIR"], "config.yml")).read()
+    assert "SHARD_SIZE: 100" in conf
+
+
+def test_index(test_app, cli_runner, click_cli, note_fixture, bookmark_fixture, monkeypatch):
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF", {"enabled": 0, "engine": "sqlite"})
+    res = cli_runner.invoke(cli, ["index", "--chunk-size", "1"])
+    assert "Indexed 2 of 2 new or modified dataobjs" in res.output
+    assert [hit["id"] for hit in query_index("note")] == [str(note_fixture.id)]
+
+    # only changed files are indexed again
+    res = cli_runner.invoke(cli, ["index"])
+    assert "Indexed 0 of 0 new or modified dataobjs" in res.output
+    assert "2 unchanged, 0 removed" in res.output
+
+    os.utime(note_fixture.fullpath)
+    res = cli_runner.invoke(cli, ["index"])
+    assert "Indexed 0 of 0 new or modified dataobjs" in res.output
+
+    with open(note_fixture.fullpath, "a") as f:
+        f.write("\nappended")
+    bookmark_fixture.fullpath.unlink()
+    res = cli_runner.invoke(cli, ["index"])
+    assert "Indexed 1 of 1 new or modified dataobjs" in res.output
+    assert "0 unchanged, 1 removed" in res.output
+    assert [hit["id"] for hit in query_index("appended")] == [str(note_fixture.id)]
+
+    res = cli_runner.invoke(cli, ["index", "--full"])
+    assert "Indexed 1 of 1 new or modified dataobjs" in res.output
+
+
+def test_full_index_removes_deleted(test_app, cli_runner, click_cli, monkeypatch):
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF", {"enabled": 0, "engine": "sqlite"})
+    kept = DataObj(type="note", title="Kept", content="zebra")
+    kept.insert()
+    deleted = DataObj(type="note", title="Deleted", content="zebra")
+    deleted.insert()
+    cli_runner.invoke(cli, ["index"])
+    deleted.fullpath.unlink()
+
+    res = cli_runner.invoke(cli, ["index", "--full"])
+    assert "Indexed 1 of 1 new or modified dataobjs" in res.output
+    assert "0 unchanged, 1 removed" in res.output
+    assert [hit["id"] for hit in query_index("zebra")] == [str(kept.id)]
+    res = cli_runner.invoke(cli, ["index"])
+    assert "1 unchanged, 0 removed" in res.output
+
+
+def test_index_records_partial_success(test_app, cli_runner, click_cli, note_fixture,
+                                       bookmark_fixture, monkeypatch):
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF", {"enabled": 0, "engine": "sqlite"})
+    bulk_index = SQLiteBackend.bulk_index
+
+    def failing_bulk_index(self, dataobjs, chunk_size=500, workers=1):
+        # the bookmark is always rejected
+        return [dataobj_id for dataobj_id in bulk_index(self, dataobjs, chunk_size, workers)
+                if dataobj_id != bookmark_fixture.id]
+
+    monkeypatch.setattr(SQLiteBackend, "bulk_index", failing_bulk_index)
+    res = cli_runner.invoke(cli, ["index"])
+    assert "Indexed 1 of 2 new or modified dataobjs" in res.output
+    # only the dataobj that failed is sent again
+    res = cli_runner.invoke(cli, ["index"])
+    assert "Indexed 0 of 1 new or modified dataobjs" in res.output
+    assert "1 unchanged, 0 removed" in res.output
+
+
+def test_index_search_disabled(test_app, cli_runner, click_cli, monkeypatch):
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF", {"enabled": 0, "embedded": 0})
+    res = cli_runner.invoke(cli, ["index"])
+    assert "Search must be enabled for this command." in res.output
+
+
+def test_duplicates(test_app, cli_runner, click_cli, note_fixture):
+    content = " ".join(f"paragraph {i} of the same article" for i in range(20))
+    first = DataObj(type="bookmark", title="First", content=content, url="https://example.org")
+    first.insert()
+    second = DataObj(type="bookmark", title="Second", content=content, url="https://example.net")
+    second.insert()
+
+    res = cli_runner.invoke(cli, ["duplicates", "--type", "bookmark"])
+    assert res.exit_code == 0
+    assert f"  {first.id}: First" in res.output
+    assert f"  {second.id}: Second" in res.output
+    assert "Found 1 groups of duplicates (2 dataobjs)." in res.output
+    res = cli_runner.invoke(cli, ["duplicates", "--type", "note"])
+    assert "Found 0 groups" in res.output
@@ -0,0 +1,168 @@
+import logging
+
+import frontmatter
+
+from archivy import data
+from archivy.data import (get_items, get_dirs, get_tree, get_folder, get_by_id, create_dir,
+                          delete_dir, delete_item, update_item, load_metadata, get_data_dir,
+                          migrate_layout)
+from archivy.models import DataObj
+
+
+def test_load_metadata_matches_frontmatter(test_app, note_fixture, bookmark_fixture):
+    for dataobj in (note_fixture, bookmark_fixture):
+        assert load_metadata(dataobj.fullpath) == frontmatter.load(dataobj.fullpath).metadata
+
+
+def test_load_metadata_stops_at_header(test_app):
+    path = get_data_dir() / "header.md"
+    # the body is not valid utf-8, so reading it would fail
+    path.write_bytes(b"\n---\ntitle: Header\nid: 3\n---\n\n\xff\xfe")
+    assert load_metadata(path) == {"title": "Header", "id": 3}
+
+
+def test_load_metadata_without_header(test_app):
+    path = get_data_dir() / "plain.md"
+    path.write_text("no header here")
+    assert load_metadata(path) == {}
+
+    path.write_text("---\ntitle: never closed\n")
+    assert load_metadata(path) == {}
+
+
+def test_get_items_metadata_only(test_app, note_fixture):
+    items = get_items(structured=False, metadata_only=True)
+    assert items == [frontmatter.load(note_fixture.fullpath).metadata]
+
+    tree = get_items(metadata_only=True)
+    assert tree.child_files[0]["title"] == note_fixture.title
+    assert "content" not in tree.child_files[0]
+
+    json_items = get_items(structured=False, json_format=True, metadata_only=True)
+    assert json_items == [{"metadata": items[0]}]
+
+
+def test_get_dirs(test_app):
+    create_dir("a/b")
+    create_dir("c")
+    assert get_dirs() == ["a", "c", "a/b", "not classified"]
+
+
+def wait_for_tree_check():
+    with data._tree_check_lock:
+        pass
+
+
+def test_tree_is_cached_and_updated_in_place(test_app, note_fixture, monkeypatch, caplog):
+    caplog.set_level(logging.DEBUG, logger=test_app.logger.name)
+    tree = get_tree()
+    assert get_tree() is tree
+    assert [record.levelname for record in caplog.records
+            if record.message.startswith("Directory tree cache")] == ["INFO", "DEBUG"]
+    assert [dataobj["id"] for dataobj in tree.child_files] == [note_fixture.id]
+
+    create_dir("nested")
+    note = DataObj(type="note", title="Nested note", path="nested")
+    note.insert()
+    update_item(note_fixture.id, "new content")
+    delete_item(note_fixture.id)
+
+    monkeypatch.setitem(test_app.config, "TREE_CHECK_INTERVAL", 0)
+    # changes made by archivy don't invalidate the tree
+    assert get_tree() is tree
+    assert tree.child_files == []
+    assert tree.child_dirs["nested"].child_files[0]["title"] == "Nested note"
+
+    wait_for_tree_check()
+    delete_dir("nested")
+    assert get_tree() is tree
+    assert tree.child_dirs == {}
+
+
+def test_tree_rebuilt_on_external_changes(test_app, note_fixture, monkeypatch):
+    monkeypatch.setitem(test_app.config, "TREE_CHECK_INTERVAL", 0)
+    tree = get_tree()
+    (get_data_dir() / "external").mkdir()
+    (get_data_dir() / "external" / "5-01-01-21-ext.md").write_text("---\nid: 5\ntitle: ext\n---\n")
+
+    # the data dir is checked in the background, without holding up the page
+    assert get_tree() is tree
+    wait_for_tree_check()
+    new_tree = get_tree()
+    assert new_tree is not tree
+    assert new_tree.child_dirs["external"].child_files == [{"id": 5, "title": "ext"}]
+
+    # files edited in place don't change the modification time of their directory
+    note_fixture.fullpath.write_text(f"---\nid: {note_fixture.id}\ntitle: Edited elsewhere\n---\n")
+    get_tree()
+    wait_for_tree_check()
+    assert get_tree().child_files == [{"id": note_fixture.id, "title": "Edited elsewhere"}]
+
+
+def test_parallel_scan_matches_serial(test_app, note_fixture, monkeypatch):
+    create_dir("nested/deeper")
+    for i in range(10):
+        DataObj(type="note", title=f"Note {i}", path="nested/deeper" if i % 2 else "").insert()
+
+    serial = get_items(structured=False, json_format=True)
+    serial_dirs = get_dirs()
+    monkeypatch.setitem(test_app.config, "SCAN_WORKERS", 4)
+    assert get_items(structured=False, json_format=True) == serial
+    assert get_dirs() == serial_dirs
+
+    tree = get_items(metadata_only=True)
+    assert len(tree.child_files) == 6
+    assert len(tree.child_dirs["nested"].child_dirs["deeper"].child_files) == 5
+
+
+def test_sharded_layout(test_app, monkeypatch):
+    monkeypatch.setitem(test_app.config, "SHARD_SIZE", 2)
+    create_dir("nested")
+    notes = [DataObj(type="note", title=f"Note {i}", path="nested") for i in range(3)]
+    for note in notes:
+        note.insert()
+
+    data_dir = get_data_dir()
+    assert get_by_id(notes[0].id).parent == data_dir / "nested" / ".shard-0"
+    assert get_by_id(notes[2].id).parent == data_dir / "nested" / ".shard-1"
+    assert get_dirs() == ["nested", "not classified"]
+    assert get_folder("nested")["num_files"] == 3
+    assert get_folder("nested")["num_dirs"] == 0
+    tree = get_items(metadata_only=True)
+    assert list(tree.child_dirs) == ["nested"]
+    assert len(tree.child_dirs["nested"].child_files) == 3
+
+    delete_item(notes[2].id)
+    assert get_folder("nested")["num_files"] == 2
+
+
+def test_migrate_layout(test_app, note_fixture, monkeypatch):
+    monkeypatch.setitem(test_app.config, "SHARD_SIZE", 0)
+    assert migrate_layout(10) == 1
+    data_dir = get_data_dir()
+    assert get_by_id(note_fixture.id).parent == data_dir / ".shard-0"
+    assert get_folder()["files"] == [{"id": note_fixture.id, "title": note_fixture.title}]
+
+    assert migrate_layout(0) == 1
+    assert get_by_id(note_fixture.id).parent == data_dir
+    assert not (data_dir / ".shard-0").exists()
+
+
+def test_iter_items_pages_from_catalog(test_app, note_fixture, bookmark_fixture, monkeypatch):
+    notes = [DataObj(type="note", title=f"Note {i}") for i in range(4)]
+    for note in notes:
+        note.insert()
+    monkeypatch.setattr(data, "ITER_PAGE_SIZE", 2)
+    notes[1].fullpath.unlink()
+
+    scans = []
+    scan_data_dir = data.scan_data_dir
+    monkeypatch.setattr(data, "scan_data_dir", lambda *args: scans.append(args)
+                        or scan_data_dir(*args))
+    ids = [dataobj["metadata"]["id"] for dataobj in data.iter_items(fields=["title"])]
+    # the data dir isn't walked for each page, and deleted files are skipped
+    assert scans == []
+    assert ids == [note_fixture.id, bookmark_fixture.id, notes[0].id, notes[2].id, notes[3].id]
+
+    page = data.iter_items(cursor=bookmark_fixture.id, limit=2, collections=["note"])
+    assert [dataobj["metadata"]["id"] for dataobj in page] == [notes[0].id, notes[2].id]
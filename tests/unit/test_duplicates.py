@@ -0,0 +1,101 @@
+import pytest
+
+from archivy import duplicates
+from archivy.data import delete_item, get_data_dir
+from archivy.models import DataObj
+
+ARTICLE = " ".join(f"sentence {i} of a long article about minhash and locality sensitive hashing"
+                   for i in range(30))
+
+
+def test_minhash_similarity():
+    signature = duplicates.minhash(ARTICLE)
+    assert len(signature) == duplicates.NUM_PERM
+    assert duplicates.similarity(signature, duplicates.minhash(ARTICLE.upper())) == 1
+    assert duplicates.similarity(signature, duplicates.minhash(ARTICLE + " footer")) > 0.8
+    assert duplicates.similarity(signature, duplicates.minhash("something else entirely")) < 0.2
+    assert duplicates.minhash("") is None
+
+
+def test_minhash_implementations_agree(monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(duplicates, "CHUNK_SIZE", 7)
+    texts = ["a few words", ARTICLE, ARTICLE * 3 + " and more"]
+    signatures = [duplicates.minhash(text) for text in texts]
+    monkeypatch.setattr(duplicates, "np", None)
+    assert signatures == [duplicates.minhash(text) for text in texts]
+
+
+def test_duplicate_index():
+    index = duplicates.DuplicateIndex(None)
+    index.add(1, {"title": "Original", "type": "bookmark", "content": ARTICLE})
+    index.add(2, {"title": "Mirror", "type": "bookmark", "content": ARTICLE + " mirror"})
+    index.add(3, {"title": "Copy", "type": "note", "content": "Copy: " + ARTICLE})
+    index.add(4, {"title": "Other", "type": "bookmark", "content": "an unrelated page"})
+    index.add(5, {"title": "Other copy", "type": "bookmark", "content": "an unrelated page"})
+
+    matches = index.find(duplicates.minhash(ARTICLE), exclude=1)
+    assert [match["id"] for match in matches] == [2, 3]
+    assert index.clusters() == [[1, 2, 3], [4, 5]]
+    assert index.clusters(types={"bookmark"}) == [[1, 2], [4, 5]]
+
+    index.remove(5)
+    assert index.clusters() == [[1, 2, 3]]
+    assert index.find(duplicates.minhash("an unrelated page"), exclude=4) == []
+
+
+def test_bookmarks_flagged_on_insert(test_app, note_fixture):
+    duplicates.build_in_background().join()
+    original = DataObj(type="note", title="Original", content=ARTICLE)
+    original.insert()
+    bookmark = DataObj(type="bookmark", title="Mirror", content=ARTICLE + " mirror",
+                       url="https://example.org")
+    bookmark.insert()
+    assert [duplicate["id"] for duplicate in bookmark.duplicates] == [original.id]
+
+    delete_item(original.id)
+    other = DataObj(type="bookmark", title="Mirror 2", content=ARTICLE,
+                    url="https://example.net")
+    other.insert()
+    assert [duplicate["id"] for duplicate in other.duplicates] == [bookmark.id]
+
+
+def test_index_built_in_background_on_insert(test_app):
+    original = DataObj(type="note", title="Original", content=ARTICLE)
+    original.insert()
+    bookmark = DataObj(type="bookmark", title="Mirror", content=ARTICLE + " mirror",
+                       url="https://example.org")
+    bookmark.insert()
+    # the request didn't wait for the index, which is built meanwhile
+    assert bookmark.duplicates == []
+    with duplicates._build_lock:
+        pass
+    index = duplicates.get_duplicate_index(build=False)
+    assert sorted(index.docs) == [original.id, bookmark.id]
+
+
+def test_signatures_stored(test_app, monkeypatch):
+    original = DataObj(type="note", title="Original", content=ARTICLE)
+    original.insert()
+    copy = DataObj(type="note", title="Copy", content=ARTICLE)
+    copy.insert()
+    path = duplicates._signatures_path()
+    duplicates.DuplicateIndex(get_data_dir(), path).refresh()
+    assert path.exists()
+
+    # signatures of files that didn't change are read back instead of computed again
+    computed = []
+    minhash = duplicates.minhash
+    monkeypatch.setattr(duplicates, "minhash", lambda text: computed.append(text) or minhash(text))
+    delete_item(copy.id)
+    other = DataObj(type="note", title="Other", content="something else")
+    other.insert()
+    index = duplicates.DuplicateIndex(get_data_dir(), path)
+    index.refresh()
+    assert computed == ["something else"]
+    assert sorted(index.docs) == [original.id, other.id]
+
+    path.write_bytes(b"corrupt")
+    index = duplicates.DuplicateIndex(get_data_dir(), path)
+    index.refresh()
+    assert sorted(index.docs) == [original.id, other.id]
@@ -0,0 +1,66 @@
+import os
+
+import frontmatter
+import yaml
+
+from archivy.data import get_items
+from archivy.metadata_cache import MetadataCache, get_metadata_cache
+
+
+def fail(*args, **kwargs):
+    raise AssertionError("frontmatter should not be parsed")
+
+
+def test_cached_entries_are_reused(test_app, note_fixture, monkeypatch):
+    cache = get_metadata_cache()
+    expected = frontmatter.load(note_fixture.fullpath)
+    assert cache.load(note_fixture.fullpath, metadata_only=True) == expected.metadata
+    cache.save()
+
+    # a new process would load the entries back from disk
+    cache = MetadataCache(cache.path)
+    monkeypatch.setattr(yaml, "load", fail)
+    assert cache.load(note_fixture.fullpath, metadata_only=True) == expected.metadata
+    post = cache.load(note_fixture.fullpath)
+    assert post.metadata == expected.metadata
+    assert post.content == expected.content
+
+
+def test_modified_files_are_parsed_again(test_app, note_fixture):
+    cache = get_metadata_cache()
+    cache.load(note_fixture.fullpath)
+
+    post = frontmatter.load(note_fixture.fullpath)
+    post["title"] = "Changed title"
+    with open(note_fixture.fullpath, "w") as f:
+        f.write(frontmatter.dumps(post))
+    # make sure the modification time changes
+    stat = os.stat(note_fixture.fullpath)
+    os.utime(note_fixture.fullpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+
+    assert cache.load(note_fixture.fullpath, metadata_only=True)["title"] == "Changed title"
+
+
+def test_get_items_uses_cache(test_app, note_fixture, bookmark_fixture, monkeypatch):
+    expected = get_items(structured=False, json_format=True)
+    monkeypatch.setattr(yaml, "load", fail)
+    assert get_items(structured=False, json_format=True) == expected
+    assert len(get_items(metadata_only=True).child_files) == 2
+
+
+def test_corrupt_cache_is_discarded(test_app, note_fixture, tmp_path):
+    path = tmp_path / "metadata_cache.pickle"
+    cache = MetadataCache(path)
+    cache.load(note_fixture.fullpath, metadata_only=True)
+    cache.save()
+    # a truncated pickle can fail with almost any exception
+    path.write_bytes(path.read_bytes()[:20])
+    assert MetadataCache(path).entries == {}
+    path.write_bytes(b"\x80\x04\x95\x05\x00\x00\x00\x00\x00\x00\x00\x8c\x01x\x94\x93\x94.")
+    assert MetadataCache(path).entries == {}
+
+    cache = MetadataCache(path)
+    cache.load(note_fixture.fullpath, metadata_only=True)
+    cache.save()
+    assert MetadataCache(path).entries == cache.entries
+    assert os.listdir(tmp_path) == ["metadata_cache.pickle"]
@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from archivy import related
+from archivy.data import delete_item, get_data_dir, update_item
+from archivy.models import DataObj
+
+pytest.importorskip("scipy")
+
+
+def test_related_index():
+    index = related.RelatedIndex(None)
+    index.add(1, {"title": "Tomatoes", "tags": ["garden"], "content": "growing tomatoes"})
+    index.add(2, {"title": "Tomato sauce", "content": "cooking tomatoes with garlic"})
+    index.add(3, {"title": "Garlic", "tags": ["garden"], "content": "growing garlic"})
+    index.add(4, {"title": "Unrelated", "content": "nothing in common"})
+
+    results = index.related([1, 4, 5])
+    assert [hit["id"] for hit in results[1]] == [3, 2]
+    assert 0 < results[1][1]["score"] < results[1][0]["score"] <= 1
+    assert results[4] == []
+    assert results[5] == []
+    assert [hit["id"] for hit in index.related([1], limit=1)[1]] == [3]
+
+    index.add(2, {"title": "Sauce", "content": "growing tomatoes in the garden"})
+    assert index.related([1])[1][0]["id"] == 2
+    index.remove(2)
+    assert [hit["id"] for hit in index.related([1])[1]] == [3]
+
+
+def test_related_batches(monkeypatch):
+    monkeypatch.setattr(related, "BATCH_SIZE", 2)
+    index = related.RelatedIndex(None)
+    for i in range(5):
+        index.add(i, {"title": f"Note {i}", "content": f"shared words {i}"})
+    results = index.related(list(range(5)), limit=10)
+    assert all(len(hits) == 4 for hits in results.values())
+
+
+def test_related_updates_rows_in_place(monkeypatch):
+    monkeypatch.setattr(related, "MIN_TAIL_SIZE", 2)
+    docs = {i: {"title": f"Note {i}", "content": f"words {i % 3} common {i}"} for i in range(20)}
+    index = related.RelatedIndex(None)
+    for i, fields in docs.items():
+        index.add(i, fields)
+    index.related([0])
+    base = index.base
+
+    docs[3] = {"title": "Edited", "content": "words 1 common"}
+    index.add(3, docs[3])
+    index.remove(4)
+    del docs[4]
+    index.add(20, {"title": "New", "content": "words 2"})
+    docs[20] = {"title": "New", "content": "words 2"}
+    results = index.related(list(docs), limit=30)
+    # changes went to the small matrix, the main one was kept
+    assert index.base is base
+    assert sorted(index.base.rows) == [i for i in range(20) if i not in (3, 4)]
+
+    rebuilt = related.RelatedIndex(None)
+    for i, fields in docs.items():
+        rebuilt.add(i, fields)
+    assert results == rebuilt.related(list(docs), limit=30)
+
+    # past the size of the small matrix, it is merged into the main one
+    index.add(21, {"title": "Another", "content": "words"})
+    index.related([0])
+    assert index.base is not base
+    assert index.tail is None and sorted(index.base.rows) == sorted(docs) + [21]
+
+
+def wait_for_refresh():
+    with related._build_lock:
+        pass
+
+
+def test_related_follows_changes(test_app, note_fixture):
+    first = DataObj(type="note", title="Bees", content="honey bees make honey")
+    first.insert()
+    # the index is built in the background, and the panel is hidden meanwhile
+    assert related.get_related([first.id]) is None
+    wait_for_refresh()
+    assert related.get_related([first.id])[first.id] == []
+
+    second = DataObj(type="note", title="Beekeeping", content="keeping bees")
+    second.insert()
+    assert [hit["id"] for hit in related.get_related([first.id])[first.id]] == [second.id]
+
+    update_item(second.id, "something else")
+    update_item(note_fixture.id, "honey")
+    assert [hit["id"] for hit in related.get_related([first.id])[first.id]] == [note_fixture.id]
+    delete_item(note_fixture.id)
+    assert related.get_related([first.id])[first.id] == []
+
+
+def test_related_picks_up_files_edited_in_place(test_app, monkeypatch):
+    monkeypatch.setitem(test_app.config, "TREE_CHECK_INTERVAL", 0)
+    first = DataObj(type="note", title="Bees", content="honey bees make honey")
+    first.insert()
+    second = DataObj(type="note", title="Other", content="nothing in common")
+    second.insert()
+    related.refresh_in_background().join()
+    assert related.get_related([first.id])[first.id] == []
+
+    dir_stat = os.stat(get_data_dir())
+    path = next(get_data_dir().glob(f"{second.id}-*.md"))
+    path.write_text(path.read_text().replace("nothing in common", "bees and honey"))
+    os.utime(get_data_dir(), ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+    # changes are read in the background, without holding up the page
+    assert related.get_related([first.id])[first.id] == []
+    wait_for_refresh()
+    assert [hit["id"] for hit in related.get_related([first.id])[first.id]] == [second.id]
@@ -0,0 +1,587 @@
+import json
+import os
+import sqlite3
+import time
+
+import elasticsearch
+import pytest
+from elasticsearch import Elasticsearch
+
+from archivy import catalog, helpers, search
+from archivy.search import (embedded as embedded_search, query_index, search_index,
+                            get_search_backend)
+from archivy.search.base import decode_cursor, encode_cursor
+from archivy.search.cache import QueryCache, normalize_query
+from archivy.search.breaker import CircuitBreaker, SearchUnavailable, get_breaker
+from archivy.search.queue import IndexQueue, get_index_queue
+from archivy.search.spool import has_spooled
+from archivy.data import create_dir, get_by_id, get_data_dir, delete_item, update_item
+from archivy.models import DataObj
+
+
+def test_tokenize_and_highlight():
+    assert embedded_search.tokenize("The Quick, brown fox!") == ["quick", "brown", "fox"]
+    assert embedded_search.highlight("A quick fox", {"fox"}) == "A quick ==fox=="
+
+
+def test_bm25_ranking():
+    index = embedded_search.EmbeddedIndex(None)
+    index.add(1, {"title": "Cooking", "content": "pasta with tomato sauce"})
+    index.add(2, {"title": "Tomato", "content": "growing tomato plants"})
+    index.add(3, {"title": "Unrelated", "content": "nothing to see"})
+
+    results, total = index.search("tomato")
+    assert [dataobj_id for dataobj_id, _ in results] == [2, 1]
+    assert total == 2
+
+    index.remove(2)
+    assert [dataobj_id for dataobj_id, _ in index.search("tomato")[0]] == [1]
+    assert "growing" not in index.postings
+    index.add(1, {"title": "Cooking", "content": "rice"})
+    assert index.search("tomato") == ([], 0)
+
+
+def test_query_index(test_app, note_fixture):
+    note = DataObj(type="note", title="Gardening", content="Tomatoes need sun and water")
+    note.insert()
+
+    hits = query_index("sun")
+    assert hits == [{"id": str(note.id), "title": "Gardening",
+                     "highlight": ["Tomatoes need ==sun== and water"]}]
+    # title matches have no content highlight
+    assert query_index("gardening") == [{"id": str(note.id), "title": "Gardening"}]
+
+
+def test_index_updated_incrementally(test_app, note_fixture, monkeypatch):
+    assert query_index("model")
+    note = DataObj(type="note", title="Later", content="added after the first query")
+    note.insert()
+    assert [hit["id"] for hit in query_index("added")] == [str(note.id)]
+
+    update_item(note.id, "replaced content")
+    assert query_index("added") == []
+    assert [hit["id"] for hit in query_index("replaced")] == [str(note.id)]
+
+    delete_item(note.id)
+    assert query_index("replaced") == []
+
+    # files changed by other programs are picked up
+    monkeypatch.setitem(test_app.config, "TREE_CHECK_INTERVAL", 0)
+    (get_data_dir() / "9-01-01-21-external.md").write_text(
+        "---\nid: 9\ntitle: External\n---\nwritten elsewhere")
+    assert [hit["id"] for hit in query_index("elsewhere")] == ["9"]
+
+    # including files edited in place, which leave their directory untouched
+    dir_stat = os.stat(get_data_dir())
+    (get_data_dir() / "9-01-01-21-external.md").write_text(
+        "---\nid: 9\ntitle: External\n---\nrewritten somewhere")
+    os.utime(get_data_dir(), ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+    assert query_index("written") == []
+    assert [hit["id"] for hit in query_index("somewhere")] == ["9"]
+
+
+def test_embedded_search_disabled(test_app, note_fixture, monkeypatch):
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF", {"enabled": 0, "embedded": 0})
+    assert query_index("test") == []
+
+
+def test_backend_selection(test_app, monkeypatch):
+    conf = {"enabled": 0, "embedded": 1, "engine": "", "index_name": "dataobj"}
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF", conf)
+    assert isinstance(get_search_backend(), search.EmbeddedBackend)
+
+    conf["enabled"] = 1
+    assert isinstance(get_search_backend(), search.ElasticsearchBackend)
+
+    conf["engine"] = "embedded"
+    assert isinstance(get_search_backend(), search.EmbeddedBackend)
+
+    conf["engine"] = "unknown"
+    with pytest.raises(ValueError):
+        get_search_backend()
+
+
+def test_custom_backend(test_app, note_fixture, monkeypatch):
+    class MemoryBackend(search.SearchBackend):
+        name = "memory"
+        dataobjs = {}
+
+        def index(self, dataobj):
+            self.dataobjs[dataobj.id] = dataobj
+            return True
+
+        def delete(self, dataobj_id):
+            self.dataobjs.pop(int(dataobj_id), None)
+
+        def query(self, query, limit=10):
+            return [{"id": str(dataobj.id), "title": dataobj.title}
+                    for dataobj in self.dataobjs.values() if query in dataobj.title][:limit]
+
+    monkeypatch.setitem(search.BACKENDS, "memory", MemoryBackend)
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF", {"enabled": 0, "engine": "memory"})
+    note = DataObj(type="note", title="Plugged in")
+    note.insert()
+    assert query_index("Plugged") == [{"id": str(note.id), "title": "Plugged in"}]
+    assert get_search_backend().bulk_index([note_fixture]) == [note_fixture.id]
+
+    delete_item(note.id)
+    assert query_index("Plugged") == []
+
+
+def test_sqlite_connection_closed(test_app, monkeypatch):
+    backend = search.SQLiteBackend({})
+    with test_app.app_context():
+        conn = backend.connect()
+        # a new connection is opened if the internal dir changes
+        monkeypatch.setitem(test_app.config, "INTERNAL_DIR", str(get_data_dir()))
+        assert backend.connect() is not conn
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+        conn = backend.connect()
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+
+
+def test_sqlite_backend(test_app, note_fixture, monkeypatch):
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF", {"enabled": 0, "engine": "sqlite"})
+    backend = get_search_backend()
+    assert backend.bulk_index([note_fixture]) == [note_fixture.id]
+
+    note = DataObj(type="note", title="Gardening", content="Tomatoes need sun and water",
+                   tags=["garden"])
+    note.insert()
+    assert query_index("sun") == [{"id": str(note.id), "title": "Gardening",
+                                   "highlight": ["Tomatoes need ==sun== and water"]}]
+    # prefix queries, stemming and tags
+    assert [hit["id"] for hit in query_index("tomat*")] == [str(note.id)]
+    assert [hit["id"] for hit in query_index("tomato")] == [str(note.id)]
+    assert query_index("garden") == [{"id": str(note.id), "title": "Gardening"}]
+    # fts5 syntax is searched literally
+    assert query_index('sun" OR "') == query_index("sun")
+    assert query_index("**") == []
+
+    update_item(note.id, "replaced content")
+    assert query_index("sun") == []
+    assert backend.highlight(note.id, "content") == ["replaced ==content=="]
+    assert backend.health()["documents"] == 2
+
+    delete_item(note.id)
+    assert query_index("replaced") == []
+
+
+def test_elasticsearch_bulk_index(test_app, note_fixture, bookmark_fixture, monkeypatch):
+    es = Elasticsearch("http://localhost:9200")
+    requests, sources = [], []
+
+    # the real client and bulk helper, with a transport answering from any thread
+    def perform_request(method, url, headers=None, params=None, body=None):
+        if url.endswith("/_bulk"):
+            lines = (body.decode() if isinstance(body, bytes) else body).splitlines()
+            ids = [json.loads(line)["index"]["_id"] for line in lines[::2]]
+            requests.append(("bulk", ids))
+            sources.extend(json.loads(line) for line in lines[1::2])
+            return {"errors": True, "items": [
+                {"index": {"_id": dataobj_id, "status": 201}} if dataobj_id == note_fixture.id
+                else {"index": {"_id": dataobj_id, "status": 400, "error": "bad document"}}
+                for dataobj_id in ids]}
+        if method == "PUT":
+            requests.append(("refresh_interval", body["index"]["refresh_interval"]))
+        elif url.endswith("/_settings/index.refresh_interval"):
+            return {"dataobj": {"settings": {"index": {"refresh_interval": "30s"}}}}
+        return {}
+
+    monkeypatch.setattr(es.transport, "perform_request", perform_request)
+    monkeypatch.setattr("archivy.search.elastic.get_elastic_client", lambda: es)
+    backend = search.ElasticsearchBackend({"index_name": "dataobj"})
+    # dataobjs are read lazily through the catalog, like `archivy index` does
+    ids = [note_fixture.id, bookmark_fixture.id]
+    dataobjs = (DataObj.from_md(get_by_id(dataobj_id).read_text()) for dataobj_id in ids)
+    assert backend.bulk_index(dataobjs, chunk_size=1, workers=2) == [note_fixture.id]
+    # settings are left alone, as the index queue sends small batches
+    assert sorted(requests) == [("bulk", [dataobj_id]) for dataobj_id in sorted(ids)]
+    # facets are filled from the catalog
+    assert sorted((source["title"], source["type"], source["folder"]) for source in sources) == [
+        (bookmark_fixture.title, "bookmark", ""), (note_fixture.title, "note", "")]
+
+    # refreshing is only disabled while `archivy index` runs
+    requests.clear()
+    with backend.reindexing():
+        backend.bulk_index([note_fixture], chunk_size=1)
+    assert requests == [("refresh_interval", "-1"), ("bulk", [note_fixture.id]),
+                        ("refresh_interval", "30s")]
+
+
+class RecordingBackend(search.SearchBackend):
+    name = "recording"
+    calls = []
+    failures = 0
+
+    def bulk_index(self, dataobjs, chunk_size=500, workers=1):
+        if RecordingBackend.failures:
+            RecordingBackend.failures -= 1
+            raise ConnectionError("search engine unavailable")
+        self.calls.append(("index", [dataobj.title for dataobj in dataobjs]))
+        return [dataobj.id for dataobj in dataobjs]
+
+    def delete(self, dataobj_id):
+        self.calls.append(("delete", dataobj_id))
+
+
+def test_index_queue(test_app, monkeypatch):
+    monkeypatch.setitem(search.BACKENDS, "recording", RecordingBackend)
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF", {"enabled": 0, "engine": "recording"})
+    monkeypatch.setattr(RecordingBackend, "calls", [])
+    queue = IndexQueue(test_app, flush_interval=60)
+
+    first = DataObj(id=1, type="note", title="First")
+    queue.put(1, "index", first)
+    queue.put(2, "index", DataObj(id=2, type="note", title="Second"))
+    queue.put(1, "index", DataObj(id=1, type="note", title="First, edited"))
+    queue.put(3, "delete")
+    # nothing is sent before the flush interval
+    assert RecordingBackend.calls == []
+
+    assert queue.flush(timeout=5)
+    assert RecordingBackend.calls == [("delete", 3), ("index", ["Second", "First, edited"])]
+    queue.close()
+
+
+def test_index_queue_retries(test_app, monkeypatch):
+    monkeypatch.setitem(search.BACKENDS, "recording", RecordingBackend)
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF", {"enabled": 0, "engine": "recording"})
+    monkeypatch.setattr(RecordingBackend, "calls", [])
+    monkeypatch.setattr(RecordingBackend, "failures", 2)
+    monkeypatch.setattr("archivy.search.queue.RETRY_DELAY", 0)
+    queue = IndexQueue(test_app, flush_interval=0)
+
+    queue.put(1, "index", DataObj(id=1, type="note", title="Retried"))
+    queue.close()
+    assert RecordingBackend.calls == [("index", ["Retried"])]
+
+
+def test_async_indexing(test_app, monkeypatch):
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF",
+                        {"enabled": 0, "engine": "sqlite", "async_indexing": 1})
+    note = DataObj(type="note", title="Queued", content="indexed in the background")
+    note.insert()
+    assert get_index_queue().flush(timeout=5)
+    assert [hit["id"] for hit in query_index("background")] == [str(note.id)]
+
+    delete_item(note.id)
+    assert get_index_queue().flush(timeout=5)
+    assert query_index("background") == []
+
+
+def test_elastic_client_is_reused(test_app, monkeypatch):
+    class FakeCluster:
+        health_checks = 0
+
+        def health(self):
+            FakeCluster.health_checks += 1
+            return {"status": "green"}
+
+    class FakeElasticsearch:
+        instances = 0
+
+        def __init__(self, url):
+            FakeElasticsearch.instances += 1
+            self.cluster = FakeCluster()
+
+    monkeypatch.setattr(helpers, "Elasticsearch", FakeElasticsearch)
+    monkeypatch.setattr(helpers, "_elastic_clients", {})
+    monkeypatch.setattr(helpers, "_elastic_health", {})
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF",
+                        {"enabled": 1, "url": "http://es:9200", "health_ttl": 30})
+
+    es = helpers.get_elastic_client()
+    assert helpers.get_elastic_client() is es
+    assert (FakeElasticsearch.instances, FakeCluster.health_checks) == (1, 1)
+    assert helpers.get_elastic_health() == {"status": "green"}
+
+    # stale health is refreshed in the background
+    helpers._elastic_health["http://es:9200"]["checked_at"] -= 60
+    assert helpers.get_elastic_client() is es
+    for _ in range(100):
+        if FakeCluster.health_checks == 2:
+            break
+        time.sleep(0.01)
+    assert FakeCluster.health_checks == 2
+
+    # unexpected errors don't prevent later refreshes
+    def broken_health():
+        raise RuntimeError("unexpected")
+
+    monkeypatch.setattr(es.cluster, "health", broken_health)
+    helpers._elastic_health["http://es:9200"]["refreshing"] = True
+    with pytest.raises(RuntimeError):
+        helpers._refresh_elastic_health(es, "http://es:9200", test_app.logger)
+    assert not helpers._elastic_health["http://es:9200"]["refreshing"]
+
+
+def test_circuit_breaker(monkeypatch):
+    breaker = CircuitBreaker(threshold=2, timeout=30)
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    breaker.opened_at -= 30
+    assert breaker.state == "half-open"
+    # only one call probes the engine
+    assert breaker.allow()
+    assert not breaker.allow()
+    assert breaker.success()
+    assert breaker.state == "closed"
+
+
+class FlakyBackend(RecordingBackend):
+    name = "flaky"
+    down = True
+
+    def _check(self):
+        if FlakyBackend.down:
+            raise ConnectionError("search engine unavailable")
+
+    def index(self, dataobj):
+        self._check()
+        self.calls.append(("index", [dataobj.title]))
+        return True
+
+    def bulk_index(self, dataobjs, chunk_size=500, workers=1):
+        self._check()
+        return super().bulk_index(dataobjs, chunk_size, workers)
+
+    def delete(self, dataobj_id):
+        self._check()
+        super().delete(dataobj_id)
+
+    def query(self, query, limit=10):
+        self._check()
+        return []
+
+
+@pytest.mark.parametrize("engine", ["embedded", "sqlite"])
+def test_paginated_search(test_app, engine, monkeypatch):
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF", {"enabled": 0, "engine": engine})
+    for i in range(5):
+        DataObj(type="note", title=f"Page {i}", content="paging " * (i + 1)).insert()
+
+    first = search_index("paging", size=2)
+    assert first["total"] == 5 and first["page"] == 1 and len(first["hits"]) == 2
+    second = search_index("paging", page=2, size=2)
+    assert search_index("paging", size=2, after=first["next"])["hits"] == second["hits"]
+
+    ids, after = [], None
+    while True:
+        page = search_index("paging", size=2, after=after)
+        ids += [hit["id"] for hit in page["hits"]]
+        after = page["next"]
+        if after is None:
+            break
+    assert ids == [hit["id"] for hit in search_index("paging", size=10)["hits"]]
+    assert len(set(ids)) == 5
+    assert search_index("paging", page=4, size=2)["hits"] == []
+    assert search_index("nothing")["total"] == 0
+    with pytest.raises(ValueError):
+        search_index("paging", size=2, after=encode_cursor(2))
+
+
+def test_cursor_shapes():
+    assert decode_cursor(encode_cursor([1.5, 3])) == [1.5, 3]
+    assert decode_cursor(encode_cursor(20), offset=True) == 20
+    for values, offset in ((20, False), ([1.5, 3], True), (-1, True), (True, True),
+                           ([1.5, "3"], False), ([1.5, 3, 4], False), ({"a": 1}, False)):
+        with pytest.raises(ValueError):
+            decode_cursor(encode_cursor(values), offset=offset)
+    with pytest.raises(ValueError):
+        decode_cursor("not base64!")
+
+
+@pytest.mark.parametrize("engine", ["embedded", "sqlite"])
+def test_search_snippets(test_app, engine, monkeypatch):
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF", {"enabled": 0, "engine": engine})
+    content = " ".join(["filler"] * 200 + ["needle"] + ["filler"] * 200)
+    DataObj(type="note", title="Haystack", content=content).insert()
+
+    [hit] = search_index("needle", snippet_size=60)["hits"]
+    [snippet] = hit["highlight"]
+    assert "==needle==" in snippet
+    assert len(snippet) < 100
+    assert search_index("needle")["hits"][0]["highlight"][0].count("filler") > 20
+    # 0 highlights the whole content
+    [hit] = search_index("needle", snippet_size=0)["hits"]
+    assert hit["highlight"] == [content.replace("needle", "==needle==")]
+
+
+@pytest.mark.parametrize("engine", ["embedded", "sqlite"])
+def test_search_facets(test_app, engine, monkeypatch):
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF", {"enabled": 0, "engine": engine})
+    create_dir("recipes")
+    soup = DataObj(type="note", title="Soup", content="cooking soup", tags=["food", "winter"],
+                   path="recipes")
+    soup.insert()
+    salad = DataObj(type="note", title="Salad", content="cooking salad", tags=["food"])
+    salad.insert()
+    DataObj(type="note", title="Other", content="unrelated", tags=["food"]).insert()
+
+    results = search_index("cooking", facets=True)
+    assert results["total"] == 2
+    facets = results["facets"]
+    assert facets["tags"] == [{"value": "food", "count": 2}, {"value": "winter", "count": 1}]
+    assert facets["type"] == [{"value": "note", "count": 2}]
+    assert {"value": "recipes", "count": 1} in facets["folder"]
+    assert facets["date"] == [{"value": catalog.month_of(soup.date), "count": 2}]
+
+    narrowed = search_index("cooking", filters={"tags": ["winter"]}, facets=True)
+    assert [hit["id"] for hit in narrowed["hits"]] == [str(soup.id)]
+    assert narrowed["total"] == 1
+    assert narrowed["facets"]["tags"] == [{"value": "food", "count": 1},
+                                          {"value": "winter", "count": 1}]
+    assert [hit["id"] for hit in search_index("cooking", filters={"folder": [""]})["hits"]] \
+        == [str(salad.id)]
+    assert search_index("cooking", filters={"type": ["bookmark"]})["hits"] == []
+    assert "facets" not in search_index("cooking")
+
+
+@pytest.mark.parametrize("engine", ["embedded", "sqlite"])
+def test_fuzzy_search(test_app, engine, monkeypatch):
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF", {"enabled": 0, "engine": engine})
+    note = DataObj(type="note", title="Photosynthesis", content="light", tags=["biology"])
+    note.insert()
+    DataObj(type="note", title="Other", content="light").insert()
+
+    assert search_index("photosynthsis")["hits"] == []
+    results = search_index("photosynthsis", fuzzy=True)
+    assert results["fuzzy"]
+    assert [hit["id"] for hit in results["hits"]] == [str(note.id)]
+    assert search_index("biolgy", fuzzy=True, filters={"type": ["bookmark"]})["hits"] == []
+    # exact matches are returned as usual
+    assert "fuzzy" not in search_index("light", fuzzy=True)
+
+    test_app.config["SEARCH_CONF"]["fuzzy"] = 1
+    assert [hit["id"] for hit in query_index("photosynthsis")] == [str(note.id)]
+
+
+def test_search_engine_unavailable(test_app, client, note_fixture, monkeypatch):
+    conf = {"enabled": 0, "engine": "flaky", "breaker_threshold": 2, "breaker_timeout": 30}
+    monkeypatch.setitem(search.BACKENDS, "flaky", FlakyBackend)
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF", conf)
+    monkeypatch.setattr("archivy.search.breaker._breakers", {})
+    monkeypatch.setattr(FlakyBackend, "calls", [])
+    monkeypatch.setattr(FlakyBackend, "down", True)
+
+    note = DataObj(type="note", title="Spooled", content="written during an outage")
+    note.insert()
+    delete_item(note_fixture.id)
+    breaker = get_breaker("flaky", conf)
+    assert breaker.state == "open"
+
+    # searches fall back to the built-in engine
+    assert [hit["id"] for hit in query_index("outage")] == [str(note.id)]
+    conf["fallback"] = 0
+    with pytest.raises(SearchUnavailable):
+        query_index("outage")
+    assert client.get("/api/search?query=outage").status_code == 503
+
+    # once the engine is back, spooled operations are replayed
+    FlakyBackend.down = False
+    breaker.opened_at -= 30
+    assert query_index("outage") == []
+    for _ in range(100):
+        if not has_spooled():
+            break
+        time.sleep(0.01)
+    assert not has_spooled()
+    assert FlakyBackend.calls == [("delete", note_fixture.id), ("index", ["Spooled"])]
+
+
+def test_only_outages_open_the_breaker(test_app, monkeypatch):
+    class BuggyBackend(FlakyBackend):
+        name = "buggy"
+
+        def query(self, query, limit=10):
+            raise TypeError("bug in the backend")
+
+    conf = {"enabled": 0, "engine": "buggy", "breaker_threshold": 1}
+    monkeypatch.setitem(search.BACKENDS, "buggy", BuggyBackend)
+    monkeypatch.setitem(test_app.config, "SEARCH_CONF", conf)
+    monkeypatch.setattr("archivy.search.breaker._breakers", {})
+    with pytest.raises(TypeError):
+        query_index("anything")
+    assert get_breaker("buggy", conf).state == "closed"
+
+    assert search.is_outage(ConnectionError())
+    assert search.is_outage(sqlite3.OperationalError("database is locked"))
+    assert search.is_outage(elasticsearch.exceptions.ConnectionTimeout("N/A", "timed out"))
+    assert search.is_outage(elasticsearch.exceptions.TransportError(503, "unavailable"))
+    assert not search.is_outage(elasticsearch.exceptions.RequestError(400, "bad query"))
+    assert not search.is_outage(ValueError("invalid cursor"))
+
+
+def test_query_cache():
+    cache = QueryCache(max_size=2, ttl=60)
+    cache.put("a", ["hit"], cache.generation)
+    cache.put("b", [], cache.generation)
+    assert cache.get("a") == ["hit"]
+    cache.put("c", [], cache.generation)
+    # "b" was the least recently used
+    assert cache.get("b") is None
+    assert cache.stats()["evictions"] == 1
+
+    generation = cache.generation
+    cache.invalidate()
+    assert cache.get("a") is None
+    # results of searches that started before a write aren't cached
+    cache.put("a", ["stale"], generation)
+    assert cache.get("a") is None
+
+    cache.put("a", ["hit"], cache.generation)
+    cache.entries["a"] = (cache.generation, time.monotonic() - 1, ["expired"])
+    assert cache.get("a") is None
+
+    # nor results of searches that started before a write was searchable
+    cache.invalidate(delay=60)
+    assert cache.current_generation() is None
+    cache.put("a", ["stale"], cache.current_generation())
+    assert cache.get("a") is None
+    cache.settles_at = time.monotonic()
+    assert cache.current_generation() == cache.generation
+    assert normalize_query("  Hello   World ") == "hello world"
+
+
+def test_searches_during_writes_arent_cached(test_app, note_fixture, monkeypatch):
+    assert query_index("concurrent") == []
+    backend_index = search.EmbeddedBackend.index
+
+    def index(self, dataobj):
+        # a search running after the cache was invalidated, before the write is done
+        assert query_index("concurrent") == []
+        return backend_index(self, dataobj)
+
+    monkeypatch.setattr(search.EmbeddedBackend, "index", index)
+    note = DataObj(type="note", title="Concurrent write")
+    note.insert()
+    assert [hit["id"] for hit in query_index("concurrent")] == [str(note.id)]
+
+
+def test_query_results_are_cached(test_app, client, note_fixture, monkeypatch):
+    calls = []
+    backend_search = search.EmbeddedBackend.search
+
+    def counting_search(self, *args, **kwargs):
+        calls.append(args)
+        return backend_search(self, *args, **kwargs)
+
+    monkeypatch.setattr(search.EmbeddedBackend, "search", counting_search)
+    stats = client.get("/api/search/stats").json
+    assert query_index("Model") == query_index(" model ")
+    assert len(calls) == 1
+
+    DataObj(type="note", title="Another model").insert()
+    assert len(query_index("model")) == 2
+    assert len(calls) == 2
+
+    new_stats = client.get("/api/search/stats").json
+    assert new_stats["hits"] == stats["hits"] + 1
+    assert new_stats["misses"] == stats["misses"] + 2
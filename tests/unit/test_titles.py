@@ -0,0 +1,71 @@
+from archivy.data import create_dir, delete_dir, delete_item
+from archivy.models import DataObj
+from archivy.titles import TitleIndex, TrigramIndex, get_title_index, get_trigram_index, trigrams
+
+
+def test_title_index():
+    index = TitleIndex([(1, "Python tips"), (2, "Learning python"), (3, "Pythagoras")])
+    assert index.suggest("pyth") == [{"id": 3, "title": "Pythagoras"},
+                                     {"id": 1, "title": "Python tips"},
+                                     {"id": 2, "title": "Learning python"}]
+    assert index.suggest("  PYTHON   T") == [{"id": 1, "title": "Python tips"}]
+    assert index.suggest("pyth", limit=1) == [{"id": 3, "title": "Pythagoras"}]
+    assert index.suggest("") == []
+
+    index.add(1, "Rust tips")
+    assert [hit["id"] for hit in index.suggest("python")] == [2]
+    assert index.suggest("tips") == [{"id": 1, "title": "Rust tips"}]
+    index.remove(2)
+    assert index.suggest("python") == []
+    assert len(index.keys) == 3
+
+
+def test_title_index_large():
+    # lookup times are measured by benchmarks/titles.py
+    index = TitleIndex((i, f"Note number {i} about topic {i % 100}") for i in range(100000))
+    suggestions = index.suggest("topic 4")
+    assert len(suggestions) == 10
+    assert all(" topic 4" in suggestion["title"] for suggestion in suggestions)
+
+
+def test_title_index_follows_catalog(test_app, note_fixture):
+    index = get_title_index()
+    assert index.suggest("test n") == [{"id": note_fixture.id, "title": "Test Note"}]
+
+    create_dir("folder")
+    note = DataObj(type="note", title="Folder note", path="folder")
+    note.insert()
+    assert [hit["id"] for hit in index.suggest("folder")] == [note.id]
+
+    delete_dir("folder")
+    assert index.suggest("folder") == []
+    delete_item(note_fixture.id)
+    assert index.suggest("test") == []
+
+
+def test_trigram_index():
+    assert trigrams("Cat") == {"  c", " ca", "cat", "at "}
+    index = TrigramIndex([(1, "Python tips", ["programming"]), (2, "Gardening", ["plants"]),
+                          (3, "Python", [])])
+    assert [match["id"] for match in index.search("pyhton")] == [3, 1]
+    assert index.search("pyhton")[0]["similarity"] < 1
+    assert [match["id"] for match in index.search("programing")] == [1]
+    assert [match["id"] for match in index.search("plnts")] == [2]
+    assert index.search("unrelated") == []
+    assert [match["id"] for match in index.search("python", ids={1})] == [1]
+
+    index.add(3, "Snakes", ["reptiles"])
+    assert [match["id"] for match in index.search("pyhton")] == [1]
+    index.remove(2)
+    assert index.search("plants") == []
+    assert all(2 not in ids for ids in index.postings.values())
+
+
+def test_trigram_index_follows_catalog(test_app, note_fixture):
+    index = get_trigram_index()
+    assert [match["id"] for match in index.search("tset noet")] == [note_fixture.id]
+    note = DataObj(type="note", title="Gardening", tags=["plants"])
+    note.insert()
+    assert [match["id"] for match in index.search("gardning")] == [note.id]
+    delete_item(note.id)
+    assert index.search("gardning") == []
@@ -0,0 +1,46 @@
+import frontmatter
+import pytest
+import yaml
+
+from archivy import yaml_codec
+
+
+posts = [
+    {"title": "Simple note", "tags": ["a", "b"], "desc": None, "id": 1, "date": "01-01-21"},
+    {"title": "Unicode: éü漢 “quotes” — and a very long title " * 4, "tags": [], "id": 2},
+    {"title": "Emoji \U0001F600 and\ttabs", "desc": "line\nbreak " * 20, "id": 3},
+]
+
+
+@pytest.fixture(params=[True, False])
+def codec(request):
+    yaml_codec.configure(request.param)
+    yield yaml_codec
+    yaml_codec.configure(True)
+
+
+@pytest.mark.parametrize("metadata", posts)
+def test_output_matches_pure_python_yaml(codec, metadata):
+    post = frontmatter.Post("# Content\n\nLorem ipsum")
+    post.metadata.update(metadata)
+    md = codec.dumps(post)
+    assert md == frontmatter.dumps(post, Dumper=yaml.SafeDumper)
+
+    loaded = codec.loads(md)
+    expected = frontmatter.loads(md)
+    assert loaded.metadata == expected.metadata == metadata
+    assert loaded.content == expected.content
+
+
+def test_other_formats_are_detected(codec):
+    post = codec.loads('{\n"title": "json header"\n}\ncontent')
+    assert post["title"] == "json header"
+    assert post.content == "content"
+
+
+def test_libyaml_used_when_available():
+    yaml_codec.configure(True)
+    assert yaml_codec.handler.use_libyaml == yaml_codec.LIBYAML_AVAILABLE
+    yaml_codec.configure(False)
+    assert not yaml_codec.handler.use_libyaml
+    yaml_codec.configure(True)